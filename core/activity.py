@@ -0,0 +1,138 @@
+# core/activity.py
+import atexit
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from .cache import public_rooms_cache
+from .models import Room
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityBuffer:
+    """Coalesces Room.last_active / latest_message / last_updated writes in memory.
+
+    record() keeps only the newest value per room; a background thread writes
+    everything pending with one bulk_update every flush_interval seconds, or
+    sooner once max_pending rooms are waiting, and once more at exit. pending()
+    lets readers in this process show values that haven't reached the database
+    yet. With flush_interval set to 0, record() writes through immediately.
+
+    Only activity in public rooms can change the cached public rooms pages, and
+    it bumps their generation at most once per cache_bump_interval seconds, so
+    steady chat traffic doesn't throw the cache away on every flush.
+    """
+
+    def __init__(self, flush_interval=1.0, max_pending=500, batch_size=500, cache_bump_interval=30.0):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.cache_bump_interval = cache_bump_interval
+        self._bump_due = False
+        self._bumped_at = 0.0
+        self._pending = {}
+        self._flushing = {}  # Taken out of _pending but not yet committed; still visible to readers
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def record(self, room_id, last_active, latest_message=None):
+        # latest_message=None is a heartbeat: it moves last_active and keeps the pending message
+        with self._lock:
+            current = self._pending.get(room_id)
+            if current is not None:
+                if current[0] > last_active:
+                    return
+                if latest_message is None:
+                    latest_message = current[1]
+            self._pending[room_id] = (last_active, latest_message)
+            size = len(self._pending)
+
+        if not self.flush_interval:
+            self.flush()
+            return
+        self._ensure_thread()
+        if size >= self.max_pending:
+            self._wake.set()
+
+    def pending(self, room_id):
+        with self._lock:
+            return self._pending.get(room_id) or self._flushing.get(room_id)
+
+    def flush(self):
+        """Write everything pending now. Returns the number of rooms updated."""
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._pending = self._pending, {}
+                batch = self._flushing
+            if not batch:
+                self._bump_public_rooms(False)
+                return 0
+
+            now = timezone.now()
+            messages, heartbeats = [], []
+            for room_id, (last_active, latest_message) in batch.items():
+                if latest_message is None:
+                    heartbeats.append(Room(id=room_id, last_active=last_active, last_updated=now))
+                else:
+                    messages.append(Room(id=room_id, last_active=last_active, latest_message=latest_message,
+                                         last_updated=now))
+            try:
+                with transaction.atomic():
+                    public = Room.objects.filter(id__in=batch, visibility='public').exists()
+                    Room.objects.bulk_update(messages, ['last_active', 'latest_message', 'last_updated'],
+                                             batch_size=self.batch_size)
+                    Room.objects.bulk_update(heartbeats, ['last_active', 'last_updated'], batch_size=self.batch_size)
+            except Exception:
+                logger.exception('Failed to flush activity for %d rooms', len(batch))
+                with self._lock:
+                    # Put them back unless something newer arrived meanwhile
+                    for room_id, value in batch.items():
+                        self._pending.setdefault(room_id, value)
+                return 0
+            finally:
+                with self._lock:
+                    self._flushing = {}
+            self._bump_public_rooms(public)
+            return len(batch)
+
+    def _bump_public_rooms(self, changed):
+        # bulk_update skips the Room signals, so the public rooms cache is bumped here
+        self._bump_due = self._bump_due or changed
+        if self._bump_due and time.monotonic() - self._bumped_at >= self.cache_bump_interval:
+            public_rooms_cache.bump()
+            self._bump_due = False
+            self._bumped_at = time.monotonic()
+
+    def _ensure_thread(self):
+        # Started lazily and per process, like the mail pipeline: threads don't survive a fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='room-activity-flush', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            close_old_connections()
+
+
+activity_buffer = ActivityBuffer(
+    flush_interval=getattr(settings, 'ROOM_ACTIVITY_FLUSH_INTERVAL', 1.0),
+    max_pending=getattr(settings, 'ROOM_ACTIVITY_MAX_PENDING', 500),
+    cache_bump_interval=getattr(settings, 'ROOM_ACTIVITY_CACHE_BUMP_INTERVAL', 30.0),
+)
+
+atexit.register(activity_buffer.flush)
@@ -1,8 +1,14 @@
+from django import forms
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
+from django.contrib.auth.forms import UserChangeForm
 from .models import Room, Channel, UserProfile  # Import other models as needed
+from .credentials import email_taken
 from django.contrib.admin import SimpleListFilter
+from django.contrib.admin.views.main import PAGE_VAR, ChangeList
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
 
 # Check if User is registered before unregistering
 try:
@@ -10,20 +16,68 @@ try:
 except admin.sites.NotRegistered:
     pass  # User is not registered, so no need to unregister
 
-class RoomAdmin(admin.ModelAdmin):
+class CappedCountPaginator(Paginator):
+    # COUNT(*) over a large table is a full scan. Count at most count_cap rows from the
+    # start of the requested page instead: the total is exact up to there and grows as
+    # admins page on, so every row stays reachable by paging while a page costs the same
+    # however many rows lie beyond it.
+    count_cap = 10000
+
+    def __init__(self, *args, page_number=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_number = max(page_number, 1)
+
+    @cached_property
+    def count(self):
+        start = (self.page_number - 1) * self.per_page
+        return start + self.object_list[start:start + self.count_cap].count()
+
+
+class CappedCountAdmin(admin.ModelAdmin):
+    paginator = CappedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # ChangeList reads the page number the same way
+        try:
+            page_number = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+
+class RoomAdmin(CappedCountAdmin):
     list_display = ('name', 'id', 'owner_uuid', 'category', 'active')
-    list_filter = ('owner_uuid', 'category', 'active')
+    # Owners are found through search rather than a sidebar listing every distinct owner_uuid
+    list_filter = ('category', 'active')
+    search_fields = ('name', '=owner_uuid')
+
+class UniqueEmailUserChangeForm(UserChangeForm):
+    # Emails are unique case-insensitively (UserProfile.email_normalized); say so instead of failing the save
+    def clean_email(self):
+        email = self.cleaned_data.get('email')
+        if email_taken(email, self.instance):
+            raise forms.ValidationError('A user with this email already exists.')
+        return email
+
+
+class KWFUserAdmin(UserAdmin):
+    form = UniqueEmailUserChangeForm
 
 # Register the User model again using UserAdmin
-admin.site.register(User, UserAdmin)
+admin.site.register(User, KWFUserAdmin)
 
 class RoomFilter(SimpleListFilter):
     title = 'Room'
     parameter_name = 'room_uuid'
+    max_lookups = 20
 
     def lookups(self, request, model_admin):
-        rooms = Room.objects.all()
-        return [(room.owner_uuid, room.name) for room in rooms]
+        # Only offer the most recently active rooms (plus the selected one); any other room is reachable via search
+        rooms = list(Room.objects.only('id', 'name').order_by('-last_active', '-id')[:self.max_lookups])
+        if self.value() and str(self.value()) not in {str(room.id) for room in rooms}:
+            rooms += list(Room.objects.filter(id=self.value()).only('id', 'name'))
+        return [(str(room.id), room.name) for room in rooms]
 
     def queryset(self, request, queryset):
         if self.value():
@@ -34,30 +88,42 @@ class RoomFilter(SimpleListFilter):
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
     list_display = ['user', 'uuid']  # Customize the columns shown in the admin
+    list_select_related = ['user']
     search_fields = ['user__username', 'user__email']  # Enable searching by username or email
 
 # Register the Room model
 admin.site.register(Room, RoomAdmin)
-class ChannelAdmin(admin.ModelAdmin):
+class ChannelChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # Resolve room names and owner usernames for the whole page in two queries instead of two per row
+        room_names = dict(
+            Room.objects.filter(id__in={obj.room_uuid for obj in self.result_list}).values_list('id', 'name')
+        )
+        owner_usernames = dict(
+            UserProfile.objects.filter(uuid__in={obj.owner_uuid for obj in self.result_list}).values_list('uuid', 'user__username')
+        )
+        for obj in self.result_list:
+            obj._room_name = room_names.get(obj.room_uuid)
+            obj._owner_username = owner_usernames.get(obj.owner_uuid)
+
+
+class ChannelAdmin(CappedCountAdmin):
     list_display = ['id',  'relative_id', 'get_room_name', 'name', 'get_owner_username', 'created_at']
     list_filter = [RoomFilter]
+    search_fields = ['name', '=room_uuid', '=uuid', '=owner_uuid']
+
+    def get_changelist(self, request, **kwargs):
+        return ChannelChangeList
 
-    # Custom method to display the room name based on its UUID
+    # Custom method to display the room name based on its UUID (resolved per page by ChannelChangeList)
     def get_room_name(self, obj):
-        try:
-            room = Room.objects.get(id=obj.room_uuid)  # Fetch the room based on the UUID
-            return room.name
-        except Room.DoesNotExist:
-            return "Room Not Found"
+        return getattr(obj, '_room_name', None) or "Room Not Found"
     get_room_name.short_description = 'Room'
 
-    # Custom method to display the owner's username based on their UUID
+    # Custom method to display the owner's username based on their UUID (resolved per page by ChannelChangeList)
     def get_owner_username(self, obj):
-        try:
-            user = User.objects.get(userprofile__uuid=obj.owner_uuid)  # Fetch user by UUID from UserProfile
-            return user.username
-        except User.DoesNotExist:
-            return "User Not Found"
+        return getattr(obj, '_owner_username', None) or "User Not Found"
     get_owner_username.short_description = 'Owner'
 
 # Register the Channel model
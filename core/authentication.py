@@ -0,0 +1,134 @@
+# core/authentication.py
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.utils.crypto import salted_hmac
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .cache import TTLCache
+from .models import UserProfile
+
+# Fields whose change must invalidate every token already issued to the user
+VERSIONED_FIELDS = ('username', 'password', 'is_active', 'is_staff', 'is_superuser')
+
+# user id -> snapshot of the User and UserProfile rows, so most requests authenticate without touching the database
+user_snapshot_cache = TTLCache(
+    max_entries=getattr(settings, 'JWT_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'JWT_USER_CACHE_TTL', 60),
+)
+
+
+def user_version(user):
+    # An HMAC rather than a counter, so it needs no extra column and never exposes the password hash
+    value = '|'.join(str(getattr(user, field)) for field in VERSIONED_FIELDS)
+    return salted_hmac('core.authentication.user_version', value).hexdigest()[:16]
+
+
+class VersionedRefreshToken(RefreshToken):
+    # Extra claims on the refresh token are copied onto every access token minted from it
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token['profile_uuid'] = str(user.userprofile.uuid)
+        token['user_version'] = user_version(user)
+        return token
+
+
+def load_snapshot(user_id):
+    try:
+        user = User.objects.select_related('userprofile').get(pk=user_id)
+    except User.DoesNotExist:
+        raise AuthenticationFailed('User not found', code='user_not_found')
+
+    profile = getattr(user, 'userprofile', None)
+    snapshot = {
+        'user': {field.attname: getattr(user, field.attname) for field in User._meta.concrete_fields},
+        'profile': {field.attname: getattr(profile, field.attname) for field in UserProfile._meta.concrete_fields} if profile else None,
+        'version': user_version(user),
+    }
+    user_snapshot_cache.set(user.pk, snapshot)
+    return snapshot
+
+
+def forget_snapshot(user_id):
+    user_snapshot_cache.delete(user_id)
+
+
+def build_user(snapshot):
+    # Fresh instances per request, so nothing mutable is shared between requests or threads
+    user = User(**snapshot['user'])
+    user._state.adding = False
+    user._state.db = 'default'
+    if snapshot['profile'] is not None:
+        profile = UserProfile(**snapshot['profile'])
+        profile._state.adding = False
+        profile._state.db = 'default'
+        user.userprofile = profile
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that builds request.user from a TTL-bounded snapshot.
+
+    Tokens carry a user_version claim derived from the fields in
+    VERSIONED_FIELDS. A token whose version no longer matches the user (after a
+    password change, deactivation...) is rejected. Saving a user drops its
+    snapshot in this process immediately and in other workers within
+    JWT_USER_CACHE_TTL. Tokens issued before versioning cost a query every time.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        version = validated_token.get('user_version')
+        if version is None:
+            # Issued before versioning, so nothing says the cached snapshot is current: always re-read.
+            # The snapshot still brings the profile along, which async consumers can't load lazily.
+            snapshot = load_snapshot(user_id)
+        else:
+            snapshot = user_snapshot_cache.get(user_id)
+            if snapshot is None or snapshot['version'] != version:
+                # A mismatch may just mean our snapshot is older than the token, so re-read before rejecting
+                snapshot = load_snapshot(user_id)
+            if snapshot['version'] != version:
+                raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+        if not snapshot['user']['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+        return build_user(snapshot)
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """Channels middleware that sets scope['user'] from the same JWTs the REST API accepts.
+
+    Browsers can't set headers on a WebSocket handshake, so the token may also
+    come as ?token=... in the query string. Anything invalid leaves the
+    connection anonymous and lets the consumer decide.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope, user=await database_sync_to_async(self.authenticate)(scope))
+        return await super().__call__(scope, receive, send)
+
+    def authenticate(self, scope):
+        raw_token = parse_qs(scope.get('query_string', b'').decode()).get('token', [None])[0]
+        if raw_token is None:
+            header = dict(scope.get('headers', [])).get(b'authorization', b'').decode().split()
+            if len(header) == 2 and header[0] in api_settings.AUTH_HEADER_TYPES:
+                raw_token = header[1]
+        if not raw_token:
+            return AnonymousUser()
+
+        authentication = CachedJWTAuthentication()
+        try:
+            return authentication.get_user(authentication.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed):
+            return AnonymousUser()
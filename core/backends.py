@@ -0,0 +1,23 @@
+# core/backends.py
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+
+from .credentials import resolve_user
+
+
+class UsernameOrEmailBackend(ModelBackend):
+    # Accepts a username or an email address as `username`, resolved in one indexed query
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+
+        user = resolve_user(username)
+        if user is None:
+            # Run the hasher anyway so response time doesn't reveal which accounts exist
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
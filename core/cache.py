@@ -0,0 +1,129 @@
+# core/cache.py
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+
+class LocalLRU:
+    # Small thread-safe LRU kept in each worker process in front of the shared cache
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class TTLCache(LocalLRU):
+    # LocalLRU whose entries also expire after ttl seconds
+    def __init__(self, max_entries, ttl):
+        super().__init__(max_entries)
+        self.ttl = ttl
+
+    def get(self, key):
+        entry = super().get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+
+class VersionedResponseCache:
+    """Pre-rendered response bodies keyed by a generation counter.
+
+    Writers never delete entries: they bump the generation stored in the shared
+    cache, which changes every key readers build, and the old entries expire on
+    their own. Bodies are looked up in the process-local LRU first, then in the
+    shared backend.
+    """
+
+    def __init__(self, namespace, alias='default', local_size=256, timeout=300):
+        self.namespace = namespace
+        self.alias = alias
+        self.timeout = timeout
+        self.local = LocalLRU(local_size)
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    @property
+    def generation_key(self):
+        return f'{self.namespace}:generation'
+
+    def generation(self):
+        generation = self.shared.get(self.generation_key)
+        if generation is None:
+            # Seed from the clock so a counter lost to eviction never reuses an old generation
+            generation = time.time_ns()
+            self.shared.add(self.generation_key, generation, timeout=None)
+            generation = self.shared.get(self.generation_key, generation)
+        return generation
+
+    def bump(self):
+        try:
+            self.shared.incr(self.generation_key)
+        except ValueError:
+            self.shared.set(self.generation_key, time.time_ns(), timeout=None)
+
+    def bump_on_commit(self):
+        # Bumping before commit would let a concurrent reader cache the old rows under the new generation
+        transaction.on_commit(self.bump)
+
+    def make_key(self, generation, request_key):
+        digest = hashlib.sha1(request_key.encode('utf-8')).hexdigest()
+        return f'{self.namespace}:{generation}:{digest}'
+
+    def get(self, generation, request_key):
+        key = self.make_key(generation, request_key)
+        body = self.local.get(key)
+        if body is None:
+            body = self.shared.get(key)
+            if body is not None:
+                self.local.set(key, body)
+        return body
+
+    def set(self, generation, request_key, body):
+        key = self.make_key(generation, request_key)
+        self.local.set(key, body)
+        self.shared.set(key, body, timeout=self.timeout)
+
+
+public_rooms_cache = VersionedResponseCache(
+    'public_rooms',
+    alias=getattr(settings, 'PUBLIC_ROOMS_CACHE_ALIAS', 'default'),
+    local_size=getattr(settings, 'PUBLIC_ROOMS_CACHE_LOCAL_SIZE', 256),
+    timeout=getattr(settings, 'PUBLIC_ROOMS_CACHE_TIMEOUT', 300),
+)
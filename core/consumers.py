@@ -0,0 +1,93 @@
+# core/consumers.py
+import json
+
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.utils import timezone
+
+from .activity import activity_buffer
+from .messages import NotAChannelMember, group_name, is_channel_member, post_message
+from .models import Channel
+
+# Close codes sent after accepting, so clients can tell why they were dropped
+CLOSE_UNAUTHENTICATED = 4401
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+
+
+class ChannelConsumer(AsyncWebsocketConsumer):
+    """WebSocket for one Channel, at ws/channels/<uuid>/.
+
+    The JWT and the channel's owner_uuid/members_uuids are checked once, at
+    connect. {"type": "heartbeat"} marks the room active. Messages, sent as
+    {"body": "..."}, are stored through core.messages.post_message, which
+    fans them out to every subscriber (the sender included) once they are
+    committed with their sequence.
+    """
+
+    group = None
+
+    async def connect(self):
+        await self.accept()
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close(code=CLOSE_UNAUTHENTICATED)
+            return
+
+        self.channel_uuid = self.scope['url_route']['kwargs']['channel_uuid']
+        self.profile_uuid = str(user.userprofile.uuid)
+        channel = await database_sync_to_async(
+            Channel.objects.filter(uuid=self.channel_uuid).values('room_uuid', 'owner_uuid', 'members_uuids').first
+        )()
+        if channel is None:
+            await self.close(code=CLOSE_NOT_FOUND)
+            return
+        if not is_channel_member(channel, self.profile_uuid):
+            await self.close(code=CLOSE_FORBIDDEN)
+            return
+
+        self.room_uuid = channel['room_uuid']
+        self.group = group_name(self.channel_uuid)
+        await self.channel_layer.group_add(self.group, self.channel_name)
+
+    async def disconnect(self, code):
+        if self.group is not None:
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if self.group is None:
+            return
+        try:
+            data = json.loads(text_data or '')
+            heartbeat = data.get('type') == 'heartbeat'
+            body = None if heartbeat else data['body']
+        except (ValueError, KeyError, TypeError, AttributeError):
+            await self.send(text_data=json.dumps({'error': 'Expected {"body": "..."} or {"type": "heartbeat"}'}))
+            return
+        if heartbeat:
+            await self.record_heartbeat()
+            return
+        if not isinstance(body, str) or not body.strip():
+            await self.send(text_data=json.dumps({'error': 'Message body is required'}))
+            return
+        if len(body) > getattr(settings, 'WEBSOCKET_MAX_MESSAGE_LENGTH', 4000):
+            await self.send(text_data=json.dumps({'error': 'Message body is too long'}))
+            return
+
+        try:
+            await database_sync_to_async(post_message)(self.channel_uuid, self.profile_uuid, body)
+        except (Channel.DoesNotExist, NotAChannelMember):
+            # Removed from the channel (or the channel deleted) since connecting
+            await self.close(code=CLOSE_FORBIDDEN)
+
+    async def record_heartbeat(self):
+        # Keeps the room active; normally only memory is touched and the activity buffer batches the write.
+        # With ROOM_ACTIVITY_FLUSH_INTERVAL=0 record() writes through, which can't run on the event loop.
+        if activity_buffer.flush_interval:
+            activity_buffer.record(self.room_uuid, timezone.now())
+        else:
+            await database_sync_to_async(activity_buffer.record)(self.room_uuid, timezone.now())
+
+    async def channel_message(self, event):
+        await self.send(text_data=event['text'])
@@ -0,0 +1,31 @@
+# core/credentials.py
+from django.contrib.auth.models import User
+
+from .models import UserProfile
+
+
+def normalize_email(email):
+    email = (email or '').strip().lower()
+    return email or None
+
+
+def email_taken(email, user=None):
+    # Case-insensitive, through the unique email_normalized index; user is the account being edited, if any
+    email = normalize_email(email)
+    if email is None:
+        return False
+    profiles = UserProfile.objects.filter(email_normalized=email)
+    if user is not None and user.pk is not None:
+        profiles = profiles.exclude(user_id=user.pk)
+    return profiles.exists()
+
+
+def resolve_user(identifier):
+    """Return the User for a username or email address with a single indexed query, or None."""
+    if not identifier:
+        return None
+    # The profile comes along in the same query because issuing a token needs its uuid
+    users = User.objects.select_related('userprofile')
+    if '@' in identifier:
+        return users.filter(userprofile__email_normalized=normalize_email(identifier)).first()
+    return users.filter(username=identifier).first()
@@ -0,0 +1,128 @@
+# core/dbrouting.py
+import contextvars
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+# The alias reads go to, chosen per request by ReadReplicaMiddleware. Outside requests
+# (management commands, background threads, WebSocket consumers) everything uses the primary.
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+# {'id': user id} for the user the current request acts for; 'pinned' is filled in from
+# the shared cache on the request's first replica read
+_read_user = contextvars.ContextVar('read_user', default=None)
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def replica_alias():
+    alias = getattr(settings, 'READ_DATABASE_ALIAS', 'replica')
+    return alias if alias in settings.DATABASES else None
+
+
+def pin_key(user_id):
+    return f'kwf_primary_pin:{user_id}'
+
+
+def pin_user(user_id, seconds):
+    # Shared by every worker, so the user's next reads stay on the primary wherever they land
+    cache.set(pin_key(user_id), time.time() + seconds, seconds)
+
+
+def user_pinned(user):
+    if 'pinned' not in user:
+        user['pinned'] = (cache.get(pin_key(user['id'])) or 0) > time.time()
+    return user['pinned']
+
+
+def token_user_id(request):
+    # The user a JWT-authenticated request acts for, read from the token without a query
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        return AccessToken(header[1])[api_settings.USER_ID_CLAIM]
+    except (TokenError, KeyError):
+        return None
+
+
+class PrimaryReplicaRouter:
+    """Reads go to the replica while a request has picked it; writes always go to the primary.
+
+    Inside a transaction on the primary, reads stay there too, so a view never
+    mixes its own uncommitted writes with replica data. So do reads for a user
+    who wrote within READ_YOUR_WRITES_SECONDS, from whichever client.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        user = _read_user.get()
+        if user is not None and user_pinned(user):
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True  # Both aliases hold the same rows
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # The replica gets its schema along with the data it copies from the primary
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadReplicaMiddleware:
+    """Sends GET/HEAD/OPTIONS requests' reads to the replica and everything else to the primary.
+
+    After any other request the client gets a cookie pinning it to the primary
+    for READ_YOUR_WRITES_SECONDS, so it reads its own writes even while the
+    replica lags. An authenticated user is also pinned in the shared cache for
+    as long, which covers their other devices and clients that drop cookies.
+    Does nothing unless a replica alias is configured.
+    """
+
+    cookie_name = 'kwf_primary_until'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.alias = replica_alias()
+        self.window = getattr(settings, 'READ_YOUR_WRITES_SECONDS', 5)
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(self.cookie_name, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def __call__(self, request):
+        if self.alias is None:
+            return self.get_response(request)
+
+        reads_from_replica = request.method in SAFE_METHODS and not self.pinned(request)
+        user_id = token_user_id(request)
+        token = _read_alias.set(self.alias if reads_from_replica else None)
+        user_token = _read_user.set(None if user_id is None else {'id': user_id})
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_alias.reset(token)
+            _read_user.reset(user_token)
+
+        if request.method not in SAFE_METHODS:
+            response.set_cookie(self.cookie_name, f'{time.time() + self.window:.3f}', max_age=self.window,
+                                httponly=True, samesite='Lax')
+            # DRF and the auth middleware have set request.user by now; the token covers anything else
+            user = getattr(request, 'user', None)
+            if user_id is None and user is not None and user.is_authenticated:
+                user_id = user.pk
+            if user_id is not None:
+                pin_user(user_id, self.window)
+        return response
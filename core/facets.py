@@ -0,0 +1,253 @@
+# core/facets.py
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db.models import Count, Exists, OuterRef
+
+from .models import RoomFacet
+
+logger = logging.getLogger(__name__)
+
+# Query parameter / RoomFacet.facet -> Room field it indexes
+FACET_FIELDS = {
+    RoomFacet.FACET_TAG: 'tags',
+    RoomFacet.FACET_TOPIC: 'topics',
+    RoomFacet.FACET_CATEGORY: 'category',
+}
+
+
+def normalize_value(value):
+    # Filters match case-insensitively, so values are stored the way queries are normalized
+    value = str(value or '').strip().lower()[:RoomFacet._meta.get_field('value').max_length]
+    return value or None
+
+
+def desired_facets(room):
+    desired = set()
+    for facet, field in FACET_FIELDS.items():
+        values = getattr(room, field)
+        for value in (values if isinstance(values, list) else [values]):
+            value = normalize_value(value)
+            if value:
+                desired.add((facet, value))
+    return desired
+
+
+def sync_room_facets(rooms, batch_size=1000):
+    """Bring RoomFacet rows in line with each room's tags, topics and category.
+
+    Like sync_room_memberships: one SELECT for the whole batch plus at most one
+    INSERT and one DELETE, so bulk writers should pass every touched room at once.
+    """
+    rooms = list(rooms)
+    if not rooms:
+        return
+
+    existing = {}
+    for facet in RoomFacet.objects.filter(room_id__in=[room.id for room in rooms]):
+        existing.setdefault(facet.room_id, {})[(facet.facet, facet.value)] = facet.pk
+
+    to_create, to_delete = [], []
+    for room in rooms:
+        current = existing.get(room.id, {})
+        desired = desired_facets(room)
+        to_create.extend(RoomFacet(room_id=room.id, facet=facet, value=value)
+                         for facet, value in desired - current.keys())
+        to_delete.extend(pk for key, pk in current.items() if key not in desired)
+
+    if to_create:
+        RoomFacet.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+    if to_delete:
+        RoomFacet.objects.filter(pk__in=to_delete).delete()
+
+
+def facet_filters(query_params):
+    """(facet, value) pairs from ?tag=&topic=&category=; repeating a parameter narrows further."""
+    filters = []
+    for facet in FACET_FIELDS:
+        for value in query_params.getlist(facet):
+            value = normalize_value(value)
+            if value:
+                filters.append((facet, value))
+    return filters
+
+
+def matching_room_ids(filters):
+    # Intersection of the posting lists, each an index range scan on unique_room_facet
+    room_ids = None
+    for facet, value in filters:
+        posting = RoomFacet.objects.filter(facet=facet, value=value).values('room_id')
+        room_ids = posting if room_ids is None else room_ids.filter(room_id__in=posting)
+    return room_ids
+
+
+def filter_by_facets(queryset, filters, estimated_size=None):
+    """Narrow a Room queryset to rooms carrying every (facet, value) in filters.
+
+    Large results are filtered with one EXISTS probe per filter while SQLite
+    walks the listing's last_active index, so a page stops after page_size
+    hits. Small ones (estimated_size below FACET_SEEK_THRESHOLD) start from the
+    intersected posting lists instead, where walking the index would visit
+    almost every room to find a few.
+    """
+    if not filters:
+        return queryset
+    if estimated_size is not None and estimated_size < getattr(settings, 'FACET_SEEK_THRESHOLD', 2000):
+        return queryset.filter(id__in=matching_room_ids(filters))
+    for facet, value in filters:
+        queryset = queryset.filter(Exists(RoomFacet.objects.filter(room_id=OuterRef('id'), facet=facet, value=value)))
+    return queryset
+
+
+class FacetCountIndex:
+    """Per-process bitmaps of every facet posting list, for counting.
+
+    Rooms are numbered by their search key, core_room_fts_key.fts_rowid: an
+    INTEGER PRIMARY KEY that, unlike core_room's implicit rowid, doesn't change
+    on VACUUM or when a migration remakes the table. Common values are Python
+    int bitmaps, so intersecting filters and counting each value against the
+    result is an AND and a popcount per value, a few milliseconds even at a
+    million rooms. Rare values are kept as tuples of numbers.
+    The bitmaps are rebuilt in a background thread every refresh_interval
+    seconds, so counts can trail writes by that long. Result lists are
+    always exact because they come from the database.
+    """
+
+    def __init__(self, refresh_interval=60):
+        self.refresh_interval = refresh_interval
+        self._postings = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._loading = False
+
+    def load(self, chunk_size=10000):
+        # Rows are streamed in chunks and a posting turns into a bitmap as soon as it
+        # passes 1 in 64 rooms, so a load never holds every row or room list at once
+        postings = {}
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT max(fts_rowid) FROM core_room_fts_key')
+            size = (cursor.fetchone()[0] or 0) + 1
+            cursor.execute(
+                'SELECT core_roomfacet.facet, core_roomfacet.value, core_room_fts_key.fts_rowid FROM core_roomfacet '
+                'JOIN core_room_fts_key ON core_room_fts_key.room_id = core_roomfacet.room_id'
+            )
+            while rows := cursor.fetchmany(chunk_size):
+                for facet, value, number in rows:
+                    posting = postings.setdefault((facet, value), [])
+                    if isinstance(posting, list):
+                        posting.append(number)
+                        # A bitmap costs size bits whatever it holds; below 1 in 64 rooms a tuple is smaller
+                        if len(posting) * 64 >= size:
+                            postings[(facet, value)] = self._as_bytes(posting, size)
+                    else:
+                        if number >> 3 >= len(posting):
+                            # A room created since max(fts_rowid) was read
+                            posting.extend(bytes((number >> 3) + 1 - len(posting)))
+                        posting[number >> 3] |= 1 << (number & 7)
+
+        self._postings = {
+            key: tuple(posting) if isinstance(posting, list) else int.from_bytes(posting, 'little')
+            for key, posting in postings.items()
+        }
+        self._loaded_at = time.monotonic()
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._loading:
+                return
+            self._loading = True
+
+        def run():
+            try:
+                self.load()
+            except Exception:
+                logger.exception('Failed to load the facet count index')
+            finally:
+                self._loading = False
+                close_old_connections()
+
+        threading.Thread(target=run, name='facet-count-index', daemon=True).start()
+
+    def current(self):
+        # Returns the postings, or None until the first load has finished
+        if self._postings is None or time.monotonic() - self._loaded_at >= self.refresh_interval:
+            self._refresh_in_background()
+        return self._postings
+
+    @staticmethod
+    def _as_bytes(posting, size=0):
+        bits = bytearray((max(max(posting, default=0), size - 1) >> 3) + 1)
+        for number in posting:
+            bits[number >> 3] |= 1 << (number & 7)
+        return bits
+
+    @classmethod
+    def _as_bitmap(cls, posting):
+        if isinstance(posting, int):
+            return posting
+        return int.from_bytes(cls._as_bytes(posting), 'little')
+
+    def result(self, postings, filters):
+        # The matching rooms as one bitmap, or None when there are no filters (every room matches)
+        bitmap = None
+        for key in filters:
+            posting = self._as_bitmap(postings.get(key, 0))
+            bitmap = posting if bitmap is None else bitmap & posting
+        return bitmap
+
+    def result_size(self, filters):
+        # Unfiltered listings don't need the estimate, so they don't start a load either
+        postings = self.current() if filters else None
+        if postings is None:
+            return None
+        return self.result(postings, filters).bit_count()
+
+    def counts(self, filters, limit=20):
+        postings = self.current()
+        if postings is None:
+            return None
+        bitmap = self.result(postings, filters)
+        members = None if bitmap is None else bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+
+        counts = {facet: [] for facet in FACET_FIELDS}
+        for (facet, value), posting in postings.items():
+            if members is None:
+                count = posting.bit_count() if isinstance(posting, int) else len(posting)
+            elif isinstance(posting, int):
+                count = (posting & bitmap).bit_count()
+            else:
+                count = sum(1 for number in posting if number >> 3 < len(members) and members[number >> 3] >> (number & 7) & 1)
+            if count:
+                counts[facet].append({'value': value, 'count': count})
+        for facet in counts:
+            counts[facet] = sorted(counts[facet], key=lambda row: (-row['count'], row['value']))[:limit]
+        return counts
+
+
+facet_index = FacetCountIndex(refresh_interval=getattr(settings, 'FACET_COUNTS_REFRESH_INTERVAL', 60))
+
+
+def facet_counts(filters, limit=20):
+    """The most common values of each facet among rooms matching filters (all rooms when there are none).
+
+    Private and unlisted rooms are counted: these are counts for the room
+    listing, which doesn't filter on visibility either, not for /rooms/public/.
+    """
+    counts = facet_index.counts(filters, limit)
+    if counts is not None:
+        return counts
+
+    # The bitmaps are still loading: count in SQL this once
+    facets = RoomFacet.objects.all()
+    if filters:
+        facets = facets.filter(room_id__in=matching_room_ids(filters))
+    rows = facets.values('facet', 'value').annotate(count=Count('room_id')).order_by('facet', '-count', 'value')
+
+    counts = {facet: [] for facet in FACET_FIELDS}
+    for row in rows:
+        if len(counts[row['facet']]) < limit:
+            counts[row['facet']].append({'value': row['value'], 'count': row['count']})
+    return counts
@@ -0,0 +1,84 @@
+# core/fieldsets.py
+from django.db.models import Func, IntegerField, Value
+from django.db.models.functions import Coalesce
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+class JSONArrayLength(Func):
+    function = 'JSON_ARRAY_LENGTH'
+    output_field = IntegerField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='JSONB_ARRAY_LENGTH', **extra_context)
+
+
+class ArrayLengthField(serializers.ReadOnlyField):
+    """The length of a JSON array field, e.g. members_count for members_uuids.
+
+    Read from an annotation of the same name when restrict_queryset() added
+    one, so the array itself never leaves the database.
+    """
+
+    def __init__(self, array_field, **kwargs):
+        self.array_field = array_field
+        super().__init__(source='*', **kwargs)
+
+    def to_representation(self, instance):
+        count = getattr(instance, self.field_name, None)
+        if count is None:
+            count = len(getattr(instance, self.array_field) or [])
+        return count
+
+
+def split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+class SparseFieldsMixin:
+    """?fields=a,b keeps only those fields of a GET response, ?omit=c,d drops some.
+
+    Meta.array_counts maps count fields to the JSON arrays they summarize.
+    compact=True (what the list views pass) shows the counts in place of the
+    arrays; otherwise only the arrays are shown. Either can still be named
+    in ?fields=. Unknown names are ignored.
+    """
+
+    def __init__(self, *args, compact=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        counts = getattr(self.Meta, 'array_counts', {})
+        for name, array_field in counts.items():
+            self.fields[name] = ArrayLengthField(array_field)
+
+        request = self.context.get('request')
+        params = request.query_params if request is not None and request.method in SAFE_METHODS else {}
+        requested = split_param(params.get('fields'))
+        if requested:
+            keep = requested
+        else:
+            keep = set(self.fields) - set(counts.values() if compact else counts)
+        keep -= split_param(params.get('omit'))
+        for name in list(self.fields):
+            if name not in keep:
+                self.fields.pop(name)
+
+    def restrict_queryset(self, queryset, always=()):
+        """Load only the columns the remaining fields read, and count arrays in SQL.
+
+        always names columns something other than the serializer reads, such as
+        the pagination's ordering field.
+        """
+        counts = getattr(self.Meta, 'array_counts', {})
+        columns = set(always)
+        annotations = {}
+        for name, field in self.fields.items():
+            if name in counts:
+                annotations[name] = Coalesce(JSONArrayLength(counts[name]), Value(0))
+            elif not field.write_only and field.source != '*':
+                columns.add(field.source.replace('.', '__'))
+        if isinstance(queryset.query.select_related, dict):
+            # Django refuses to follow a relation none of whose columns are loaded
+            followed = {column.split('__')[0] for column in columns if '__' in column}
+            related = [name for name in queryset.query.select_related if name in followed]
+            queryset = queryset.select_related(None).select_related(*related)
+        return queryset.only(*columns).annotate(**annotations)
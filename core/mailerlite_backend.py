@@ -1,33 +1,205 @@
 # mailerlite_backend.py
+import atexit
+import os
+import queue
+import random
+import threading
+import time
+
 import requests
+from requests.adapters import HTTPAdapter
 from django.core.mail.backends.base import BaseEmailBackend
 from django.conf import settings
 
-class MailerLiteEmailBackend(BaseEmailBackend):
-    def send_messages(self, email_messages):
-        for message in email_messages:
-            self._send_mailerlite_message(message)
+DEFAULT_API_URL = 'https://connect.mailerlite.com/v2/campaigns/send'
+
 
-    def _send_mailerlite_message(self, message):
-        url = 'https://connect.mailerlite.com/v2/campaigns/send'
-        headers = {
+class DeliveryQueueFull(Exception):
+    pass
+
+
+class MailerLiteClient:
+    # Shared by every worker thread: one pooled keep-alive session instead of a new connection per message
+    retry_statuses = {429, 500, 502, 503, 504}
+
+    def __init__(self, api_key, url=DEFAULT_API_URL, timeout=10, max_retries=4, backoff=0.5, max_backoff=30, pool_size=10):
+        self.url = url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
             'Content-Type': 'application/json',
-            'Authorization': f'Bearer {settings.MAILERLITE_API_KEY}'
-        }
+            'Authorization': f'Bearer {api_key}',
+        })
 
+    def send(self, subject, content, recipients):
         data = {
-            "subject": message.subject,
-            "content": message.body,
+            "subject": subject,
+            "content": content,
             "recipients": [
                 {
                     "email": email
-                } for email in message.to
+                } for email in recipients
             ]
         }
 
-        response = requests.post(url, json=data, headers=headers)
+        for attempt in range(self.max_retries + 1):
+            delay = None
+            try:
+                response = self.session.post(self.url, json=data, timeout=self.timeout)
+            except requests.RequestException as e:
+                error = str(e)
+            else:
+                if response.status_code == 200:
+                    return True
+                error = response.text
+                if response.status_code not in self.retry_statuses:
+                    break
+                delay = self._retry_after(response)
+
+            if attempt < self.max_retries:
+                # Exponential backoff with jitter so retrying workers don't hit the API in lockstep
+                time.sleep(delay if delay is not None else min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1))
+
+        print(f"Failed to send email to: {recipients}. Error: {error}")
+        return False
+
+    def _retry_after(self, response):
+        try:
+            return min(self.max_backoff, float(response.headers['Retry-After']))
+        except (KeyError, ValueError):
+            return None
+
+
+class DeliveryPipeline:
+    """Bounded queue of outgoing mail drained by background worker threads.
+
+    Messages that share a subject and body are merged into one API call of up
+    to batch_size recipients. submit() raises DeliveryQueueFull once the queue
+    has stayed full for enqueue_timeout seconds, pushing back on senders
+    instead of growing without bound.
+    """
+
+    def __init__(self, client, queue_size=1000, workers=2, batch_size=50, enqueue_timeout=0.05):
+        self.client = client
+        self.batch_size = batch_size
+        self.enqueue_timeout = enqueue_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pid = os.getpid()
+        self.threads = [
+            threading.Thread(target=self._work, name=f'mailerlite-delivery-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, subject, content, recipients, timeout=None):
+        try:
+            self.queue.put((subject, content, list(recipients)), timeout=self.enqueue_timeout if timeout is None else timeout)
+        except queue.Full:
+            raise DeliveryQueueFull(f"MailerLite delivery queue is full ({self.queue.maxsize} messages)")
 
-        if response.status_code == 200:
-            print(f"Email sent to: {message.to}")
-        else:
-            print(f"Failed to send email to: {message.to}. Error: {response.text}")
+    def drain(self, timeout=None):
+        # Wait until everything queued so far has been delivered (or given up on); returns False on timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _work(self):
+        while True:
+            items = [self.queue.get()]
+            # Opportunistically pick up whatever else is already waiting, to batch it into fewer calls
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._deliver(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    def _deliver(self, items):
+        groups = {}
+        for subject, content, recipients in items:
+            groups.setdefault((subject, content), []).extend(recipients)
+        for (subject, content), recipients in groups.items():
+            for start in range(0, len(recipients), self.batch_size):
+                try:
+                    self.client.send(subject, content, recipients[start:start + self.batch_size])
+                except Exception as e:
+                    print(f"Failed to send email to: {recipients[start:start + self.batch_size]}. Error: {e}")
+
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_client():
+    return MailerLiteClient(
+        settings.MAILERLITE_API_KEY,
+        url=getattr(settings, 'MAILERLITE_API_URL', DEFAULT_API_URL),
+        max_retries=getattr(settings, 'MAILERLITE_MAX_RETRIES', 4),
+        pool_size=getattr(settings, 'MAILERLITE_WORKERS', 2),
+    )
+
+
+def get_pipeline():
+    # Created lazily and per process: worker threads don't survive a gunicorn fork
+    global _pipeline
+    if _pipeline is None or _pipeline.pid != os.getpid():
+        with _pipeline_lock:
+            if _pipeline is None or _pipeline.pid != os.getpid():
+                _pipeline = DeliveryPipeline(
+                    get_client(),
+                    queue_size=getattr(settings, 'MAILERLITE_QUEUE_SIZE', 1000),
+                    workers=getattr(settings, 'MAILERLITE_WORKERS', 2),
+                    batch_size=getattr(settings, 'MAILERLITE_BATCH_SIZE', 50),
+                    enqueue_timeout=getattr(settings, 'MAILERLITE_ENQUEUE_TIMEOUT', 0.05),
+                )
+    return _pipeline
+
+
+@atexit.register
+def _drain_on_exit():
+    if _pipeline is not None and _pipeline.pid == os.getpid():
+        _pipeline.drain(timeout=getattr(settings, 'MAILERLITE_SHUTDOWN_TIMEOUT', 5))
+
+
+class MailerLiteEmailBackend(BaseEmailBackend):
+    def __init__(self, fail_silently=False, asynchronous=None, **kwargs):
+        super().__init__(fail_silently=fail_silently, **kwargs)
+        self.asynchronous = getattr(settings, 'MAILERLITE_ASYNC', True) if asynchronous is None else asynchronous
+        self.client = None
+
+    def send_messages(self, email_messages):
+        # Asynchronous mode returns the number of messages accepted for delivery
+        sent = 0
+        if not self.asynchronous and self.client is None:
+            self.client = get_client()  # Kept for the backend's lifetime so repeated calls reuse the session
+        client = self.client
+        for message in email_messages:
+            if not message.to:
+                continue
+            try:
+                if self.asynchronous:
+                    get_pipeline().submit(message.subject, message.body, message.to)
+                    sent += 1
+                elif client.send(message.subject, message.body, message.to):
+                    print(f"Email sent to: {message.to}")
+                    sent += 1
+            except DeliveryQueueFull:
+                if not self.fail_silently:
+                    raise
+        return sent
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Room
+from core.membership import sync_room_memberships
+
+class Command(BaseCommand):
+    help = 'Builds (or repairs) the RoomMembership index from every room\'s owner_uuid and members_uuids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rooms synced per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        rooms = Room.objects.only('id', 'owner_uuid', 'members_uuids').order_by('id')
+
+        processed = 0
+        last_id = None
+        while True:
+            # Walk the table by primary key so every batch is an index range scan
+            batch = rooms.filter(id__gt=last_id) if last_id else rooms
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                sync_room_memberships(batch, batch_size=batch_size)
+
+            processed += len(batch)
+            last_id = batch[-1].id
+            self.stdout.write(f'Synced memberships for {processed} rooms...')
+
+        self.stdout.write(self.style.SUCCESS(f'Finished backfilling memberships for {processed} rooms.'))
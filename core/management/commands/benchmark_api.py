@@ -0,0 +1,214 @@
+import json
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+from core.authentication import VersionedRefreshToken
+from core.models import Room, Channel, UserProfile
+
+BENCHMARK_PASSWORD = 'benchmark-Passw0rd!'
+
+# name -> (method, path builder, payload builder, authenticated, max SQL queries per request).
+# Budgets are the number of queries each endpoint needs today; raising one should be a deliberate decision.
+# The run is wrapped in a transaction, so a view's own atomic() block also counts its SAVEPOINT/RELEASE.
+ENDPOINTS = {
+    'rooms-list': ('get', lambda ctx: reverse('room-list'), None, True, 1),
+    'rooms-public': ('get', lambda ctx: reverse('room-public-rooms'), None, True, 0),
+    # 1 query once the facet count bitmaps are loaded, 2 while counts still come from SQL
+    'rooms-facets': ('get', lambda ctx: reverse('room-list') + '?tag=exam+prep&category=science', None, True, 2),
+    'rooms-search': ('get', lambda ctx: reverse('room-search') + '?q=science', None, True, 2),
+    'rooms-user': ('get', lambda ctx: reverse('room-user-rooms', args=[ctx['member_user_id']]), None, True, 2),
+    'channels-room': ('get', lambda ctx: reverse('channel-room-channels', args=[ctx['room_uuid']]), None, True, 2),
+    'rooms-batch': ('get', lambda ctx: reverse('room-batch') + '?ids=' + ','.join(ctx['room_ids']), None, True, 1),
+    'channels-batch': ('get', lambda ctx: reverse('channel-batch') + '?uuids=' + ','.join(ctx['channel_uuids']),
+                       None, True, 1),
+    # 0 queries once the usernames are cached in this process, 1 on the first request
+    'users-resolve': ('get', lambda ctx: reverse('user-resolve') + '?uuids=' + ','.join(ctx['member_uuids']),
+                      None, True, 1),
+    'register': ('post', lambda ctx: reverse('register'), lambda ctx, i: {
+        'username': f'benchmark_new_{ctx["run"]}_{i}',
+        'email': f'benchmark_new_{ctx["run"]}_{i}@example.com',
+        'password': BENCHMARK_PASSWORD,
+        'confirm_password': BENCHMARK_PASSWORD,
+    }, False, 7),
+    'signin': ('post', lambda ctx: reverse('login'), lambda ctx, i: {
+        'username_or_email': ctx['email'] if i % 2 else ctx['username'],
+        'password': BENCHMARK_PASSWORD,
+    }, False, 1),
+    'profile': ('get', lambda ctx: reverse('profile'), None, True, 0),
+    'users': ('get', lambda ctx: reverse('user-list'), None, True, 1),
+    # 0 queries for a free name, 1 to confirm a taken one; suggestions come from the index
+    'check-username': ('post', lambda ctx: reverse('check-username'), lambda ctx, i: {
+        'username': ctx['username'] if i % 2 else f'free_{ctx["run"]}_{i}',
+    }, False, 1),
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class QueryCounter:
+    # Counts every statement, unlike connection.queries which stops at 9000 entries
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarks every API endpoint against the current (seeded) database, recording latency percentiles '
+            'and SQL query counts. Fails when a query budget or latency baseline is exceeded. '
+            'Everything written during the run is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20, help='Timed requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=2, help='Untimed requests per endpoint before measuring')
+        parser.add_argument('--endpoints', help=f'Comma-separated subset of: {", ".join(ENDPOINTS)}')
+        parser.add_argument('--output', default='bench_output.json', help='Where to write the machine-readable results')
+        parser.add_argument('--baseline', help='Previous results file; p90 latency is compared against it')
+        parser.add_argument('--latency-tolerance', type=float, default=1.5,
+                            help='Allowed p90 slowdown relative to the baseline, as a ratio')
+
+    def handle(self, *args, **options):
+        names = options['endpoints'].split(',') if options['endpoints'] else list(ENDPOINTS)
+        unknown = set(names) - set(ENDPOINTS)
+        if unknown:
+            raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+        results = {}
+        try:
+            with transaction.atomic():
+                context = self._prepare()
+                for name in names:
+                    results[name] = self._run(name, context, options['iterations'], options['warmup'])
+                    self._report(name, results[name])
+                raise Rollback
+        except Rollback:
+            pass
+
+        violations = self._check(results, options['baseline'], options['latency_tolerance'])
+        report = {
+            'generated_at': timezone.now().isoformat(),
+            'dataset': {
+                'users': User.objects.count(),
+                'rooms': Room.objects.count(),
+                'channels': Channel.objects.count(),
+            },
+            'iterations': options['iterations'],
+            'endpoints': results,
+            'violations': violations,
+        }
+        with open(options['output'], 'w') as handle:
+            json.dump(report, handle, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}.')
+
+        if violations:
+            for violation in violations:
+                self.stdout.write(self.style.ERROR(violation))
+            raise CommandError(f'{len(violations)} benchmark budget(s) exceeded.')
+        self.stdout.write(self.style.SUCCESS('All endpoints within budget.'))
+
+    def _prepare(self):
+        run = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(f'benchmark_{run}', f'benchmark_{run}@example.com', BENCHMARK_PASSWORD)
+        token = str(VersionedRefreshToken.for_user(user).access_token)
+
+        # Benchmark the seeded data where there is some, otherwise a minimal room/channel of our own
+        room = Room.objects.order_by('-last_active').only('id', 'owner_uuid').first()
+        if room is None:
+            room = Room.objects.create(name=f'Benchmark room {run}', owner_uuid=user.userprofile.uuid,
+                                       members_uuids=[str(user.userprofile.uuid)])
+        channel = Channel.objects.only('room_uuid').first()
+        if channel is None:
+            channel = Channel.objects.create(name='Intro', room_uuid=room.id, owner_uuid=room.owner_uuid)
+        owner = UserProfile.objects.filter(uuid=room.owner_uuid).values_list('user_id', flat=True).first()
+        batch = [str(room.id)] + [str(room_id) for room_id in Room.objects.values_list('id', flat=True)[:49]]
+        channel_uuids = [str(key) for key in Channel.objects.values_list('uuid', flat=True)[:50]]
+        member_uuids = [str(key) for key in UserProfile.objects.values_list('uuid', flat=True)[:50]]
+
+        return {
+            'run': run,
+            'username': user.username,
+            'email': user.email,
+            'token': token,
+            'member_user_id': owner or user.id,
+            'room_uuid': channel.room_uuid,
+            'room_ids': batch,
+            'channel_uuids': channel_uuids,
+            'member_uuids': member_uuids,
+        }
+
+    def _run(self, name, context, iterations, warmup):
+        method, path_builder, payload_builder, authenticated, budget = ENDPOINTS[name]
+        client = Client()
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {context["token"]}'} if authenticated else {}
+        path = path_builder(context)
+
+        timings, queries, statuses = [], [], set()
+        for i in range(warmup + iterations):
+            kwargs = dict(headers)
+            if payload_builder:
+                kwargs.update(data=json.dumps(payload_builder(context, i)), content_type='application/json')
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                response = getattr(client, method)(path, **kwargs)
+                elapsed = time.perf_counter() - started
+            if i >= warmup:
+                timings.append(elapsed * 1000)
+                queries.append(counter.count)
+                statuses.add(response.status_code)
+
+        timings.sort()
+        return {
+            'method': method.upper(),
+            'path': path,
+            'statuses': sorted(statuses),
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p90_ms': round(percentile(timings, 0.90), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(statistics.fmean(timings), 3),
+            'max_ms': round(timings[-1], 3),
+            'queries_max': max(queries),
+            'queries_mean': round(statistics.fmean(queries), 2),
+            'query_budget': budget,
+        }
+
+    def _report(self, name, result):
+        self.stdout.write(
+            f'{name:<15} {result["method"]:<4} p50 {result["p50_ms"]:>9.2f} ms  p90 {result["p90_ms"]:>9.2f} ms  '
+            f'p99 {result["p99_ms"]:>9.2f} ms  queries {result["queries_max"]:>3}/{result["query_budget"]}  '
+            f'status {",".join(map(str, result["statuses"]))}'
+        )
+
+    def _check(self, results, baseline_path, tolerance):
+        violations = []
+        for name, result in results.items():
+            if result['queries_max'] > result['query_budget']:
+                violations.append(f'{name}: {result["queries_max"]} queries exceeds budget of {result["query_budget"]}')
+            if any(status >= 500 for status in result['statuses']):
+                violations.append(f'{name}: server errors {result["statuses"]}')
+
+        if baseline_path:
+            with open(baseline_path) as handle:
+                baseline = json.load(handle)['endpoints']
+            for name, result in results.items():
+                if name in baseline and result['p90_ms'] > baseline[name]['p90_ms'] * tolerance:
+                    violations.append(
+                        f'{name}: p90 {result["p90_ms"]:.2f} ms is over {tolerance}x the baseline {baseline[name]["p90_ms"]:.2f} ms'
+                    )
+        return violations
@@ -0,0 +1,70 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from core.models import Room, RoomMembership
+from core.membership import rooms_for_member
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Measures the user_rooms lookup as the room table grows. Rooms are inserted inside a transaction '
+            'that is rolled back, so the database is left untouched.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000', help='Comma-separated room counts to measure')
+        parser.add_argument('--user-rooms', type=int, default=20, help='Number of rooms the benchmarked user belongs to')
+        parser.add_argument('--repeat', type=int, default=50, help='Lookups timed per size')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+        user_rooms = options['user_rooms']
+        batch_size = options['batch_size']
+        member_uuid = uuid.uuid4()
+
+        try:
+            with transaction.atomic():
+                inserted = 0
+                for size in sizes:
+                    self._grow(inserted, size, member_uuid, user_rooms, batch_size)
+                    inserted = size
+                    self._measure(size, member_uuid, user_rooms, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def _grow(self, start, stop, member_uuid, user_rooms, batch_size):
+        # The benchmarked user is a member of the first `user_rooms` rooms only, so the result size stays fixed
+        for offset in range(start, stop, batch_size):
+            rooms, memberships = [], []
+            for i in range(offset, min(offset + batch_size, stop)):
+                owner_uuid = uuid.uuid4()
+                members = [str(owner_uuid)]
+                if i < user_rooms:
+                    members.append(str(member_uuid))
+                room = Room(name=f'Benchmark room {i}', owner_uuid=owner_uuid, members_uuids=members)
+                rooms.append(room)
+                memberships.append(RoomMembership(room=room, member_uuid=owner_uuid, role=RoomMembership.ROLE_OWNER))
+                if i < user_rooms:
+                    memberships.append(RoomMembership(room=room, member_uuid=member_uuid))
+            Room.objects.bulk_create(rooms)
+            RoomMembership.objects.bulk_create(memberships)
+
+    def _measure(self, size, member_uuid, user_rooms, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            results = list(rooms_for_member(member_uuid))
+            timings.append(time.perf_counter() - started)
+
+        timings.sort()
+        median_ms = timings[len(timings) // 2] * 1000
+        per_result_us = median_ms * 1000 / max(len(results), 1)
+        self.stdout.write(
+            f'{size:>10} rooms: {len(results)} results, median {median_ms:.3f} ms, {per_result_us:.1f} us/result'
+        )
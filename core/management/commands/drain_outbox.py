@@ -0,0 +1,39 @@
+import time
+from datetime import timedelta
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+from core.outbox import claim_batch, deliver_batch, new_worker_id
+
+class Command(BaseCommand):
+    help = 'Sends pending outbox emails through MailerLite. Safe to run as several concurrent workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails claimed per round')
+        parser.add_argument('--loop', action='store_true', help='Keep running and poll for new emails')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when the outbox is empty (with --loop)')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Attempts before an email is marked failed')
+        parser.add_argument('--lease', type=int, default=300,
+                            help='Seconds after which an email claimed by a crashed worker is claimed again; '
+                                 'must exceed the time one email can take to send, retries included')
+
+    def handle(self, *args, **options):
+        worker_id = new_worker_id()
+        lease = timedelta(seconds=options['lease'])
+        # One backend (and so one pooled HTTP session) for the life of the worker
+        connection = get_connection('core.mailerlite_backend.MailerLiteEmailBackend', fail_silently=True, asynchronous=False)
+        total_sent = total_failed = 0
+
+        while True:
+            emails = claim_batch(worker_id, batch_size=options['batch_size'], lease=lease)
+            if emails:
+                sent, failed = deliver_batch(emails, connection=connection, max_attempts=options['max_attempts'])
+                total_sent += sent
+                total_failed += failed
+                self.stdout.write(f'Sent {sent} emails, {failed} failed or rescheduled.')
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f'Outbox drained: {total_sent} sent, {total_failed} failed or rescheduled.'))
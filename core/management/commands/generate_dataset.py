@@ -0,0 +1,178 @@
+import random
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from core.models import Room, Channel, UserProfile, RoomMembership
+from core.cache import public_rooms_cache
+from core.credentials import normalize_email
+from core.facets import sync_room_facets
+
+CATEGORIES = ['Science', 'Math', 'History', 'English', 'Languages', 'Technology', 'Arts', 'Business']
+
+TOPICS = {
+    'Science': ['physics', 'chemistry', 'biology', 'astronomy', 'genetics', 'ecology'],
+    'Math': ['calculus', 'algebra', 'statistics', 'geometry', 'probability', 'linear algebra'],
+    'History': ['ancient rome', 'world war ii', 'renaissance', 'industrial revolution', 'cold war'],
+    'English': ['poetry', 'shakespeare', 'essay writing', 'grammar', 'modern fiction'],
+    'Languages': ['spanish', 'french', 'mandarin', 'german', 'japanese', 'arabic'],
+    'Technology': ['python', 'algorithms', 'databases', 'networking', 'machine learning', 'web development'],
+    'Arts': ['drawing', 'music theory', 'art history', 'photography', 'film'],
+    'Business': ['accounting', 'marketing', 'economics', 'finance', 'entrepreneurship'],
+}
+
+TAGS = ['exam prep', 'homework', 'beginner', 'advanced', 'study group', 'revision', 'project',
+        'flashcards', 'discussion', 'reading club', 'q&a', 'late night', 'weekend', 'olympiad']
+
+VISIBILITY_WEIGHTS = [('public', 80), ('private', 15), ('unlisted', 5)]
+
+CHANNEL_NAMES = ['Intro', 'General', 'Homework', 'Resources', 'Exam Prep', 'Off Topic', 'Announcements', 'Q&A']
+CHANNEL_COLORS = ['rgb(216, 210, 123)', 'rgb(123, 180, 216)', 'rgb(216, 123, 150)', 'rgb(140, 216, 123)']
+
+
+def zipf_weights(count, exponent=1.1):
+    # Weight of the n-th most popular item, so a few categories/tags dominate like in production
+    return [1 / (rank ** exponent) for rank in range(1, count + 1)]
+
+
+class Command(BaseCommand):
+    help = 'Generates a deterministic synthetic dataset of users, rooms and channels for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of users (with profiles) to create')
+        parser.add_argument('--rooms', type=int, default=1000, help='Number of rooms to create')
+        parser.add_argument('--channels', type=int, default=3000, help='Total number of channels to create')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed always produces the same data')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk INSERT and per transaction')
+        parser.add_argument('--max-members', type=int, default=500, help='Upper bound on members in a single room')
+        parser.add_argument('--prefix', default='loadtest', help='Prefix for generated usernames and emails')
+
+    def handle(self, *args, **options):
+        # The prefix is part of the seed so two datasets can coexist without UUID collisions
+        self.rng = random.Random(f'{options["seed"]}:{options["prefix"]}')
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        if options['rooms'] and not options['users']:
+            raise CommandError('Rooms need owners; pass --users greater than 0.')
+        if User.objects.filter(username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(f'Users prefixed "{self.prefix}_" already exist; pick another --prefix.')
+
+        profile_uuids = self._create_users(options['users'])
+        rows = self._create_rooms(profile_uuids, options['rooms'], options['channels'], options['max_members'])
+        # bulk_create skips the Room signals, so invalidate the public feed once at the end
+        public_rooms_cache.bump()
+
+        elapsed = time.perf_counter() - started
+        total = options['users'] * 2 + sum(rows.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {options["users"]} users, {rows["rooms"]} rooms, {rows["channels"]} channels and '
+            f'{rows["memberships"]} memberships in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.0f} rows/s).'
+        ))
+
+    def _uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def _create_users(self, count):
+        # Hashing is deliberately slow, so every generated user shares one precomputed hash
+        password = make_password('loadtest-password')
+        profile_uuids = []
+        for start in range(0, count, self.batch_size):
+            stop = min(start + self.batch_size, count)
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(username=f'{self.prefix}_{i}', email=f'{self.prefix}_{i}@example.com', password=password,
+                         date_joined=self.now - timedelta(days=self.rng.expovariate(1 / 180)))
+                    for i in range(start, stop)
+                ])
+                # bulk_create skips post_save, so profiles are inserted here rather than by the signal,
+                # with the normalized email it would have set (sign-in by email looks users up by it)
+                profiles = [UserProfile(user=user, uuid=self._uuid(), email_normalized=normalize_email(user.email))
+                            for user in users]
+                UserProfile.objects.bulk_create(profiles)
+            profile_uuids.extend(profile.uuid for profile in profiles)
+            self.stdout.write(f'Created {stop} users...')
+        return profile_uuids
+
+    def _create_rooms(self, profile_uuids, room_count, channel_count, max_members):
+        rng = self.rng
+        rows = Counter()
+        if not room_count:
+            return rows
+
+        # Popularity skew: most rooms have a couple of channels, a few have dozens
+        room_weights = [rng.paretovariate(1.2) for _ in range(room_count)]
+        channels_per_room = Counter(rng.choices(range(room_count), weights=room_weights, k=channel_count))
+        owner_weights = zipf_weights(len(profile_uuids), exponent=0.8)
+        owner_cum_weights = []
+        running = 0
+        for weight in owner_weights:
+            running += weight
+            owner_cum_weights.append(running)
+        category_weights = zipf_weights(len(CATEGORIES))
+        tag_weights = zipf_weights(len(TAGS))
+
+        for start in range(0, room_count, self.batch_size):
+            stop = min(start + self.batch_size, room_count)
+            rooms, channels, memberships = [], [], []
+            for index in range(start, stop):
+                owner_uuid = rng.choices(profile_uuids, cum_weights=owner_cum_weights)[0]
+                member_count = min(int(rng.paretovariate(1.5)), max_members, len(profile_uuids))
+                members = {profile_uuids[i] for i in rng.sample(range(len(profile_uuids)), member_count)}
+                members.add(owner_uuid)
+                category = rng.choices(CATEGORIES, weights=category_weights)[0]
+                room = Room(
+                    id=self._uuid(),
+                    name=f'{category} room {index}',
+                    description=f'Synthetic {category.lower()} study room #{index}',
+                    category=category,
+                    owner_uuid=owner_uuid,
+                    members_uuids=[str(member) for member in members],
+                    tags=sorted(set(rng.choices(TAGS, weights=tag_weights, k=rng.randint(0, 4)))),
+                    topics=sorted(set(rng.sample(TOPICS[category], rng.randint(1, 3)))),
+                    visibility=rng.choices([v for v, _ in VISIBILITY_WEIGHTS], weights=[w for _, w in VISIBILITY_WEIGHTS])[0],
+                    # Activity decays exponentially with age; some rooms were never active at all
+                    last_active=None if rng.random() < 0.05 else self.now - timedelta(seconds=rng.expovariate(1 / 259200)),
+                    latest_message=f'Message {rng.randint(1, 10 ** 6)} in {category.lower()}',
+                )
+
+                room_channels = []
+                for position in range(1, channels_per_room.get(index, 0) + 1):
+                    channel_members = [str(member) for member in members if member == owner_uuid or rng.random() < 0.6]
+                    room_channels.append(Channel(
+                        uuid=self._uuid(),
+                        name=CHANNEL_NAMES[position - 1] if position <= len(CHANNEL_NAMES) else f'Channel {position}',
+                        room_uuid=room.id,
+                        owner_uuid=owner_uuid,
+                        color=rng.choice(CHANNEL_COLORS),
+                        members_uuids=channel_members,
+                        relative_id=position,
+                    ))
+                room.channel_ids = [str(channel.uuid) for channel in room_channels]
+                channels.extend(room_channels)
+
+                memberships.extend(
+                    RoomMembership(room=room, member_uuid=member,
+                                   role=RoomMembership.ROLE_OWNER if member == owner_uuid else RoomMembership.ROLE_MEMBER)
+                    for member in members
+                )
+                rooms.append(room)
+
+            with transaction.atomic():
+                Room.objects.bulk_create(rooms, batch_size=self.batch_size)
+                Channel.objects.bulk_create(channels, batch_size=self.batch_size)
+                RoomMembership.objects.bulk_create(memberships, batch_size=self.batch_size)
+                sync_room_facets(rooms, batch_size=self.batch_size)  # bulk_create skips the Room signals
+            rows['rooms'] += len(rooms)
+            rows['channels'] += len(channels)
+            rows['memberships'] += len(memberships)
+            self.stdout.write(f'Created {stop} rooms...')
+        return rows
@@ -0,0 +1,32 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from core.transfer import Importer, open_ndjson
+
+
+class Command(BaseCommand):
+    help = ('Loads NDJSON written by export_data (plain or gzip) in batches. Records whose UUID already exists '
+            'are skipped, or overwritten with --on-conflict update. Memberships and facets are rebuilt from the rooms.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File to read, or - for stdin')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Records per bulk INSERT and per transaction')
+        parser.add_argument('--on-conflict', choices=['skip', 'update'], default='skip',
+                            help='What to do with records whose UUID already exists')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        importer = Importer(batch_size=options['batch_size'], on_conflict=options['on_conflict'])
+        source = sys.stdin.buffer if options['input'] == '-' else open(options['input'], 'rb')
+        try:
+            importer.add_lines(open_ndjson(source))
+            counts = importer.finish()
+        except (ValueError, OSError) as e:
+            raise CommandError(f'Import stopped ({dict(importer.counts) or "nothing"} committed so far): {e}')
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+
+        summary = ', '.join(f'{count} {name}' for name, count in sorted(counts.items())) or 'nothing'
+        self.stdout.write(self.style.SUCCESS(f'Imported {summary} in {time.perf_counter() - started:.1f}s.'))
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.models import Room
+from core.search import install_search_index, optimize_search_index
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the room full-text search index from core_room and reinstalls its triggers. '
+            'Run after a migration that rebuilds the core_room table, since SQLite drops its triggers with it.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-optimize', action='store_true', help='Skip merging the index segments afterwards')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        install_search_index(rebuild=True)
+        if not options['no_optimize']:
+            optimize_search_index()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {Room.objects.count()} rooms in {time.perf_counter() - started:.1f}s.'
+        ))
@@ -0,0 +1,40 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from core.dbrouting import replica_alias
+
+
+class Command(BaseCommand):
+    help = ('Copies the primary SQLite database into the replica file with SQLite\'s online backup API. '
+            'A local stand-in for replication, so reads can be scaled and lag tested without a second server.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep copying, simulating continuous replication')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between copies (the replica lag) with --loop')
+
+    def handle(self, *args, **options):
+        alias = replica_alias()
+        if alias is None:
+            raise CommandError('No replica configured; set DATABASE_REPLICA_NAME.')
+        primary, replica = settings.DATABASES[DEFAULT_DB_ALIAS], settings.DATABASES[alias]
+        if 'sqlite3' not in primary['ENGINE'] or 'sqlite3' not in replica['ENGINE']:
+            raise CommandError('Only SQLite files can be copied; use the database server\'s own replication.')
+
+        while True:
+            started = time.perf_counter()
+            source = sqlite3.connect(primary['NAME'], timeout=primary.get('OPTIONS', {}).get('timeout', 5))
+            target = sqlite3.connect(replica['NAME'], timeout=replica.get('OPTIONS', {}).get('timeout', 5))
+            try:
+                # One step, so the copy is a single consistent snapshot. Under WAL it is only a read
+                # transaction on the primary, which keeps accepting writes meanwhile
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            self.stdout.write(f'Copied {primary["NAME"]} to {replica["NAME"]} in {time.perf_counter() - started:.2f}s.')
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
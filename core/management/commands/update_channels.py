@@ -1,29 +1,61 @@
+import json
+import os
+import time
+
 from django.core.management.base import BaseCommand
-from core.models import Channel, Room
 from django.utils import timezone
-import uuid
+from django.utils.dateparse import parse_datetime
+from core.renumbering import (
+    clear_channel_deletions, install_deletion_trigger, renumber_channels, rooms_with_changed_channels,
+    rooms_with_deleted_channels,
+)
 
 class Command(BaseCommand):
     help = 'Updates all existing channels with a unique UUID and a relative ID based on their room.'
 
-    def handle(self, *args, **kwargs):
-        # Fetch all the rooms
-        rooms = Room.objects.all()
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only renumber rooms whose channels were created, changed or deleted since the last run')
+        parser.add_argument('--state-file', default='.update_channels_state.json',
+                            help='Where the time of the last successful run is recorded')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Rooms renumbered per statement in incremental mode')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # Taken before reading anything, so changes made while we run are picked up next time
+        run_started_at = timezone.now()
+
+        install_deletion_trigger()
+        # Also read up front: a full run covers these rooms as well, so it clears them too
+        deleted_room_uuids, deletions_up_to = rooms_with_deleted_channels()
 
-        for room in rooms:
-            # Fetch all channels for this room and update each one
-            channels = Channel.objects.filter(room_uuid=room.id).order_by('created_at')
+        room_uuids = None
+        if options['incremental']:
+            since = self._last_run(options['state_file'])
+            if since is None:
+                self.stdout.write(self.style.WARNING('No previous run recorded; renumbering every room.'))
+            else:
+                changed = set(rooms_with_changed_channels(since))
+                room_uuids = list(changed | deleted_room_uuids)
+                self.stdout.write(f'{len(room_uuids)} rooms have channels changed since {since.isoformat()} '
+                                  f'({len(deleted_room_uuids)} with deletions).')
 
-            for idx, channel in enumerate(channels, start=1):
-                # Update the channel with a unique UUID and a relative_id based on its order in the room
-                if not channel.uuid:  # Ensure we only set uuid if it's missing
-                    channel.uuid = uuid.uuid4()
+        updated = renumber_channels(room_uuids, chunk_size=options['chunk_size'])
+        clear_channel_deletions(deletions_up_to)
+        self._record_run(options['state_file'], run_started_at)
 
-                channel.relative_id = idx  # Set the relative ID based on its order in the room
-                channel.save()
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully updated all channels: {updated} relative IDs changed in {time.perf_counter() - started:.2f}s.'
+        ))
 
-                self.stdout.write(self.style.SUCCESS(
-                    f'Updated channel "{channel.name}" in room "{room.name}" with UUID: {channel.uuid} and relative ID: {channel.relative_id}'
-                ))
+    def _last_run(self, path):
+        if not os.path.exists(path):
+            return None
+        with open(path) as handle:
+            return parse_datetime(json.load(handle)['last_run'])
 
-        self.stdout.write(self.style.SUCCESS("Successfully updated all channels."))
+    def _record_run(self, path, run_started_at):
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'last_run': run_started_at.isoformat()}, handle)
+        os.replace(temporary, path)
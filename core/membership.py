@@ -0,0 +1,114 @@
+# core/membership.py
+import uuid
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import public_rooms_cache
+from .models import Room, RoomMembership
+
+
+class MembershipConflict(Exception):
+    pass
+
+
+def _as_uuid(value):
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def desired_memberships(room):
+    # The owner always has the owner role, even if they are not listed in members_uuids
+    desired = {}
+    for member in room.members_uuids or []:
+        member_uuid = _as_uuid(member)
+        if member_uuid:
+            desired[member_uuid] = RoomMembership.ROLE_MEMBER
+
+    owner_uuid = _as_uuid(room.owner_uuid)
+    if owner_uuid:
+        desired[owner_uuid] = RoomMembership.ROLE_OWNER
+    return desired
+
+
+def sync_room_memberships(rooms, batch_size=1000):
+    """Bring RoomMembership rows in line with each room's owner_uuid/members_uuids.
+
+    Costs one SELECT for the whole batch plus at most one INSERT, DELETE and
+    UPDATE, so callers doing bulk writes should pass every touched room at once.
+    """
+    rooms = list(rooms)
+    if not rooms:
+        return
+
+    existing = {}
+    for membership in RoomMembership.objects.filter(room_id__in=[room.id for room in rooms]):
+        existing.setdefault(membership.room_id, {})[membership.member_uuid] = membership
+
+    to_create, to_update, to_delete = [], [], []
+    for room in rooms:
+        current = existing.get(room.id, {})
+        desired = desired_memberships(room)
+
+        for member_uuid, role in desired.items():
+            membership = current.get(member_uuid)
+            if membership is None:
+                to_create.append(RoomMembership(room_id=room.id, member_uuid=member_uuid, role=role))
+            elif membership.role != role:
+                membership.role = role
+                to_update.append(membership)
+
+        to_delete.extend(membership.pk for member_uuid, membership in current.items() if member_uuid not in desired)
+
+    if to_create:
+        RoomMembership.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+    if to_update:
+        RoomMembership.objects.bulk_update(to_update, ['role'], batch_size=batch_size)
+    if to_delete:
+        RoomMembership.objects.filter(pk__in=to_delete).delete()
+
+
+def rooms_for_member(member_uuid):
+    # Served by membership_member_room_idx, so cost tracks the number of results, not the number of rooms
+    room_ids = RoomMembership.objects.filter(member_uuid=member_uuid).values('room_id')
+    return Room.objects.filter(id__in=room_ids)
+
+
+def apply_member_batch(model, pk, add=(), remove=(), retries=5):
+    """Add and remove many members of a Room or Channel in one transaction.
+
+    The new members_uuids list is written with a compare-and-swap on
+    last_updated (plus row locking where the database supports it), so
+    concurrent batches never lose each other's changes. Returns the instance
+    with its updated members_uuids.
+    """
+    add = [str(member) for member in add]
+    remove = {str(member) for member in remove}
+
+    for _ in range(retries):
+        with transaction.atomic():
+            instance = model.objects.select_for_update().get(pk=pk)
+            current = [str(member) for member in instance.members_uuids or []]
+
+            members = [member for member in dict.fromkeys(current) if member not in remove]
+            known = set(members)
+            members.extend(member for member in dict.fromkeys(add) if member not in known)
+            if members == current:
+                return instance
+
+            updated = model.objects.filter(pk=pk, last_updated=instance.last_updated).update(
+                members_uuids=members, last_updated=timezone.now(),
+            )
+            if not updated:
+                continue  # Someone else changed the row since we read it; re-read and retry
+
+            # update() skips post_save, so keep the membership index and public feed in step here
+            instance.members_uuids = members
+            if model is Room:
+                sync_room_memberships([instance])
+                public_rooms_cache.bump_on_commit()
+            return instance
+
+    raise MembershipConflict(f'Members of {model.__name__} {pk} kept changing; gave up after {retries} attempts')
@@ -0,0 +1,86 @@
+# core/messages.py
+import json
+import uuid
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .activity import activity_buffer
+from .models import Channel, Message
+
+
+class NotAChannelMember(Exception):
+    pass
+
+
+def group_name(channel_uuid):
+    return f'channel.{uuid.UUID(str(channel_uuid)).hex}'
+
+
+def publish(channel_uuid, message):
+    """Send message (a JSON-serializable dict) to every socket subscribed to the channel, from sync code."""
+    # Encoded once here rather than once per subscriber
+    async_to_sync(get_channel_layer().group_send)(
+        group_name(channel_uuid), {'type': 'channel.message', 'text': json.dumps(message, default=str)},
+    )
+
+
+def is_channel_member(channel, member_uuid):
+    # channel is a dict with owner_uuid and members_uuids, as returned by .values()
+    member_uuid = str(member_uuid)
+    return member_uuid == str(channel['owner_uuid']) or member_uuid in map(str, channel['members_uuids'])
+
+
+def post_message(channel_uuid, sender_uuid, body):
+    """Append a message to a channel and return it.
+
+    Bumping Channel.last_sequence first takes the write lock, so concurrent
+    posters get consecutive sequences without retries. Once the transaction
+    commits, the room's latest_message and last_active go to the activity
+    buffer and WebSocket subscribers are notified.
+    Raises Channel.DoesNotExist or NotAChannelMember.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        if not Channel.objects.filter(uuid=channel_uuid).update(last_sequence=F('last_sequence') + 1):
+            raise Channel.DoesNotExist
+        channel = Channel.objects.values('room_uuid', 'owner_uuid', 'members_uuids', 'last_sequence').get(uuid=channel_uuid)
+        if not is_channel_member(channel, sender_uuid):
+            raise NotAChannelMember  # Rolls the sequence back too
+
+        message = Message.objects.create(
+            channel_uuid=channel_uuid, sequence=channel['last_sequence'], sender_uuid=sender_uuid, body=body,
+        )
+        # The Room row is written in batches by the activity buffer instead of once per message
+        transaction.on_commit(lambda: activity_buffer.record(channel['room_uuid'], now, body))
+        transaction.on_commit(lambda: publish(message.channel_uuid, message_payload(message)))
+    return message
+
+
+def message_payload(message):
+    return {
+        'channel_uuid': str(message.channel_uuid),
+        'sequence': message.sequence,
+        'sender_uuid': str(message.sender_uuid),
+        'body': message.body,
+        'created_at': message.created_at.isoformat(),
+    }
+
+
+def message_history(channel_uuid, before=None, after=None, limit=50):
+    """One page of a channel's messages in ascending sequence order, plus whether more exist past it.
+
+    Every variant is a seek into (channel_uuid, sequence) reading limit + 1
+    rows, so the newest page costs the same however long the history is.
+    """
+    messages = Message.objects.filter(channel_uuid=channel_uuid)
+    if after is not None:
+        page = list(messages.filter(sequence__gt=after).order_by('sequence')[:limit + 1])
+        return page[:limit], len(page) > limit
+    if before is not None:
+        messages = messages.filter(sequence__lt=before)
+    page = list(messages.order_by('-sequence')[:limit + 1])
+    return page[:limit][::-1], len(page) > limit
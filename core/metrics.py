@@ -0,0 +1,248 @@
+# core/metrics.py
+import atexit
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _new_series():
+    return {
+        'requests': {},
+        'latency_buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+        'latency_sum': 0.0,
+        'size_buckets': [0] * (len(SIZE_BUCKETS) + 1),
+        'size_sum': 0,
+        'db_queries': 0,
+        'db_seconds': 0.0,
+    }
+
+
+class MetricsRegistry:
+    """Per-process request metrics keyed by (url name, method).
+
+    Recording is a handful of additions under one short lock. When
+    METRICS_DIR is set, a background thread in every worker writes its totals
+    to its own file there each flush_interval seconds, and the /metrics view
+    sums all files, so the scrape sees the whole gunicorn pool whichever
+    worker answers it. Files are named per process start, so a reused pid
+    never takes over another worker's counters, and a file that hasn't been
+    rewritten for stale_after seconds belongs to a dead worker and is deleted.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0, stale_after=60.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.stale_after = stale_after
+        self._series = {}
+        self._lock = threading.Lock()
+        self._pid = None
+        self._path = None
+
+    def record(self, view, method, status, duration, size, db_queries, db_seconds):
+        latency_bucket = bisect_left(LATENCY_BUCKETS, duration)
+        size_bucket = bisect_left(SIZE_BUCKETS, size)
+        status_class = f'{status // 100}xx'
+        with self._lock:
+            series = self._series.get((view, method))
+            if series is None:
+                series = self._series[(view, method)] = _new_series()
+            series['requests'][status_class] = series['requests'].get(status_class, 0) + 1
+            series['latency_buckets'][latency_bucket] += 1
+            series['latency_sum'] += duration
+            series['size_buckets'][size_bucket] += 1
+            series['size_sum'] += size
+            series['db_queries'] += db_queries
+            series['db_seconds'] += db_seconds
+
+        if self.directory:
+            self._ensure_thread()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                key: dict(series, requests=dict(series['requests']),
+                          latency_buckets=list(series['latency_buckets']), size_buckets=list(series['size_buckets']))
+                for key, series in self._series.items()
+            }
+
+    def _ensure_thread(self):
+        # Per process, like the activity buffer: threads don't survive a fork, and a forked worker needs its own file
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f'worker_{self._pid}_{time.time_ns()}.json')
+            threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+
+    def _run(self):
+        # Rewriting the file even when idle keeps its mtime fresh, which is how collect() tells live workers from dead
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        # Each worker owns one file, so writers never contend; write-then-rename keeps readers from seeing partial files
+        self._ensure_thread()
+        payload = [[view, method, series] for (view, method), series in self.snapshot().items()]
+        temporary = f'{self._path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump(payload, handle)
+        os.replace(temporary, self._path)
+
+    def remove(self):
+        # At exit a worker's counts leave the totals right away rather than after stale_after
+        if self._pid == os.getpid():
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+
+    def collect(self):
+        if not self.directory:
+            return self.snapshot()
+
+        self.flush()
+        merged = {}
+        expired = time.time() - self.stale_after
+        for path in glob.glob(os.path.join(self.directory, 'worker_*.json')):
+            try:
+                if os.path.getmtime(path) < expired:
+                    os.remove(path)  # Its worker is gone; keeping it would add to the totals forever
+                    continue
+                with open(path) as handle:
+                    entries = json.load(handle)
+            except (OSError, ValueError):
+                continue
+            for view, method, series in entries:
+                total = merged.setdefault((view, method), _new_series())
+                for status_class, count in series['requests'].items():
+                    total['requests'][status_class] = total['requests'].get(status_class, 0) + count
+                for name in ('latency_buckets', 'size_buckets'):
+                    total[name] = [a + b for a, b in zip(total[name], series[name])]
+                for name in ('latency_sum', 'size_sum', 'db_queries', 'db_seconds'):
+                    total[name] += series[name]
+        return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _histogram(lines, name, help_text, bounds, series_by_key, buckets_field, sum_field):
+    lines.append(f'# HELP {name} {help_text}')
+    lines.append(f'# TYPE {name} histogram')
+    for (view, method), series in sorted(series_by_key.items()):
+        cumulative = 0
+        for bound, count in zip(bounds + ('+Inf',), series[buckets_field]):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{_labels(view=view, method=method, le=bound)}}} {cumulative}')
+        lines.append(f'{name}_sum{{{_labels(view=view, method=method)}}} {series[sum_field]}')
+        lines.append(f'{name}_count{{{_labels(view=view, method=method)}}} {cumulative}')
+
+
+def render_prometheus(series_by_key):
+    lines = [
+        '# HELP kwf_http_requests_total Requests handled, by resolved URL name, method and status class.',
+        '# TYPE kwf_http_requests_total counter',
+    ]
+    for (view, method), series in sorted(series_by_key.items()):
+        for status_class, count in sorted(series['requests'].items()):
+            lines.append(f'kwf_http_requests_total{{{_labels(view=view, method=method, status=status_class)}}} {count}')
+
+    _histogram(lines, 'kwf_http_request_duration_seconds', 'Time spent handling requests.',
+               LATENCY_BUCKETS, series_by_key, 'latency_buckets', 'latency_sum')
+    _histogram(lines, 'kwf_http_response_size_bytes', 'Size of response bodies.',
+               SIZE_BUCKETS, series_by_key, 'size_buckets', 'size_sum')
+
+    for name, field, help_text in (
+        ('kwf_db_queries_total', 'db_queries', 'SQL statements executed while handling requests.'),
+        ('kwf_db_query_seconds_total', 'db_seconds', 'Time spent in SQL while handling requests.'),
+    ):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} counter')
+        for (view, method), series in sorted(series_by_key.items()):
+            lines.append(f'{name}{{{_labels(view=view, method=method)}}} {series[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry(
+    directory=getattr(settings, 'METRICS_DIR', None),
+    flush_interval=getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0),
+    stale_after=getattr(settings, 'METRICS_STALE_AFTER', 60.0),
+)
+
+if registry.directory:
+    os.makedirs(registry.directory, exist_ok=True)
+    atexit.register(registry.remove)
+
+
+class QueryTimer:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.view_name or match._func_path) if match else '<unresolved>'
+        size = 0 if response.streaming else len(response.content)
+        registry.record(view, request.method, response.status_code, duration, size, timer.count, timer.seconds)
+        return response
+
+
+def metrics_allowed(request):
+    # Scrapers send METRICS_TOKEN as a bearer token or come from METRICS_ALLOWED_IPS; staff can look from the admin session
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {token}'):
+        return True
+    if request.META.get('REMOTE_ADDR') in getattr(settings, 'METRICS_ALLOWED_IPS', []):
+        return True
+    user = getattr(request, 'user', None)
+    return bool(user and user.is_active and user.is_staff)
+
+
+def metrics_view(request):
+    # Per-endpoint traffic and query counts are internal; don't serve them to the public API
+    if not metrics_allowed(request):
+        return HttpResponseForbidden('Forbidden\n', content_type='text/plain')
+    return HttpResponse(render_prometheus(registry.collect()), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,62 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:20
+
+import django.db.models.deletion
+import uuid
+
+from django.db import migrations, models
+
+
+def _as_uuid(value):
+    try:
+        return value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def backfill_room_memberships(apps, schema_editor):
+    # Same rules as core.membership.desired_memberships, inlined so the migration doesn't depend on app code.
+    # user_rooms reads only from RoomMembership, so existing rooms must be indexed before it is deployed.
+    Room = apps.get_model('core', 'Room')
+    RoomMembership = apps.get_model('core', 'RoomMembership')
+    pending = []
+    for room in Room.objects.only('id', 'owner_uuid', 'members_uuids').order_by('id').iterator(chunk_size=2000):
+        desired = {}
+        for member in room.members_uuids or []:
+            member_uuid = _as_uuid(member)
+            if member_uuid:
+                desired[member_uuid] = 'member'
+        owner_uuid = _as_uuid(room.owner_uuid)
+        if owner_uuid:
+            desired[owner_uuid] = 'owner'
+        pending.extend(RoomMembership(room_id=room.id, member_uuid=member_uuid, role=role)
+                       for member_uuid, role in desired.items())
+        if len(pending) >= 5000:
+            RoomMembership.objects.bulk_create(pending)
+            pending = []
+    if pending:
+        RoomMembership.objects.bulk_create(pending)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('member_uuid', models.UUIDField()),
+                ('role', models.CharField(choices=[('owner', 'Owner'), ('member', 'Member')], default='member', max_length=10)),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['member_uuid', 'room'], name='membership_member_room_idx')],
+                'constraints': [models.UniqueConstraint(fields=('room', 'member_uuid'), name='unique_room_member')],
+            },
+        ),
+        migrations.RunPython(backfill_room_memberships, migrations.RunPython.noop),
+    ]
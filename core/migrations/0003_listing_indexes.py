@@ -0,0 +1,25 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_room_membership'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='channel',
+            index=models.Index(fields=['room_uuid', 'relative_id', 'id'], name='channel_room_relative_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['visibility', 'last_active', 'id'], name='room_visibility_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['last_active', 'id'], name='room_active_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_channel_last_updated'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='channel',
+            index=models.Index(fields=['last_updated'], name='channel_last_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:34
+
+from django.db import migrations, models
+
+
+def backfill_email_normalized(apps, schema_editor):
+    # The first profile to claim an address keeps it; case-insensitive duplicates stay NULL
+    UserProfile = apps.get_model('core', 'UserProfile')
+    seen = set()
+    pending = []
+    for profile in UserProfile.objects.select_related('user').only('id', 'user__email').order_by('id').iterator(chunk_size=2000):
+        email = (profile.user.email or '').strip().lower()
+        if not email or email in seen:
+            continue
+        seen.add(email)
+        profile.email_normalized = email
+        pending.append(profile)
+        if len(pending) >= 2000:
+            UserProfile.objects.bulk_update(pending, ['email_normalized'])
+            pending = []
+    if pending:
+        UserProfile.objects.bulk_update(pending, ['email_normalized'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_outbox_email'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='email_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=254, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_email_normalized, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_userprofile_email_normalized'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='channel',
+            index=models.Index(fields=['uuid'], name='channel_uuid_idx'),
+        ),
+    ]
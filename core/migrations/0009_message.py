@@ -0,0 +1,32 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_channel_uuid_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='channel',
+            name='last_sequence',
+            field=models.PositiveBigIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Message',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('channel_uuid', models.UUIDField()),
+                ('sequence', models.PositiveBigIntegerField()),
+                ('sender_uuid', models.UUIDField()),
+                ('body', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('channel_uuid', 'sequence'), name='message_channel_sequence_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:52
+
+from django.db import migrations
+
+# Inlined rather than imported from core.search so later edits there can't change this migration;
+# 0013_room_search_by_id replaces this rowid-keyed index
+INSTALL_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts USING fts5(
+        name, description, category, tags, topics,
+        content='core_room', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_insert AFTER INSERT ON core_room BEGIN
+        INSERT INTO core_room_fts(rowid, name, description, category, tags, topics)
+        VALUES (new.rowid, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_delete AFTER DELETE ON core_room BEGIN
+        INSERT INTO core_room_fts(core_room_fts, rowid, name, description, category, tags, topics)
+        VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags, old.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_update AFTER UPDATE OF name, description, category, tags, topics ON core_room BEGIN
+        INSERT INTO core_room_fts(core_room_fts, rowid, name, description, category, tags, topics)
+        VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags, old.topics);
+        INSERT INTO core_room_fts(rowid, name, description, category, tags, topics)
+        VALUES (new.rowid, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts_vocab USING fts5vocab(core_room_fts, 'row')",
+    "INSERT INTO core_room_fts(core_room_fts) VALUES ('rebuild')",
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS core_room_fts_insert',
+    'DROP TRIGGER IF EXISTS core_room_fts_delete',
+    'DROP TRIGGER IF EXISTS core_room_fts_update',
+    'DROP TABLE IF EXISTS core_room_fts_vocab',
+    'DROP TABLE IF EXISTS core_room_fts',
+]
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in INSTALL_SQL:
+        schema_editor.execute(statement)
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_message'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
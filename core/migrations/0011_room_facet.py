@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_room_facets(apps, schema_editor):
+    # Same normalization as core.facets.desired_facets, inlined so the migration doesn't depend on app code
+    Room = apps.get_model('core', 'Room')
+    RoomFacet = apps.get_model('core', 'RoomFacet')
+    pending = []
+    for room in Room.objects.only('id', 'tags', 'topics', 'category').order_by('id').iterator(chunk_size=2000):
+        seen = set()
+        for facet, values in (('tag', room.tags), ('topic', room.topics), ('category', [room.category])):
+            for value in values if isinstance(values, list) else [values]:
+                value = str(value or '').strip().lower()[:100]
+                if value and (facet, value) not in seen:
+                    seen.add((facet, value))
+                    pending.append(RoomFacet(room_id=room.id, facet=facet, value=value))
+        if len(pending) >= 5000:
+            RoomFacet.objects.bulk_create(pending)
+            pending = []
+    if pending:
+        RoomFacet.objects.bulk_create(pending)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_room_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('tag', 'Tag'), ('topic', 'Topic'), ('category', 'Category')], max_length=10)),
+                ('value', models.CharField(max_length=100)),
+                ('room', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='core.room')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'facet', 'value'], name='facet_room_idx')],
+                'constraints': [models.UniqueConstraint(fields=('facet', 'value', 'room'), name='unique_room_facet')],
+            },
+        ),
+        migrations.RunPython(backfill_room_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+# Inlined rather than imported from core.renumbering so later edits there can't change this migration
+TRIGGER_SQL = {
+    'sqlite': [
+        """
+        CREATE TRIGGER IF NOT EXISTS core_channel_record_deletion AFTER DELETE ON core_channel BEGIN
+            INSERT INTO core_channeldeletion(room_uuid) VALUES (old.room_uuid);
+        END
+        """,
+    ],
+    'postgresql': [
+        """
+        CREATE OR REPLACE FUNCTION core_channel_record_deletion() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO core_channeldeletion(room_uuid) VALUES (OLD.room_uuid);
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS core_channel_record_deletion ON core_channel',
+        """
+        CREATE TRIGGER core_channel_record_deletion AFTER DELETE ON core_channel
+        FOR EACH ROW EXECUTE FUNCTION core_channel_record_deletion()
+        """,
+    ],
+}
+
+DROP_SQL = {
+    'sqlite': ['DROP TRIGGER IF EXISTS core_channel_record_deletion'],
+    'postgresql': [
+        'DROP TRIGGER IF EXISTS core_channel_record_deletion ON core_channel',
+        'DROP FUNCTION IF EXISTS core_channel_record_deletion()',
+    ],
+}
+
+
+def create_trigger(apps, schema_editor):
+    for statement in TRIGGER_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+def drop_trigger(apps, schema_editor):
+    for statement in DROP_SQL.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_room_facet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChannelDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('room_uuid', models.UUIDField()),
+            ],
+        ),
+        migrations.RunPython(create_trigger, drop_trigger),
+    ]
@@ -0,0 +1,118 @@
+# Generated by Django 5.1.1 on 2026-10-18 15:40
+
+from django.db import migrations
+
+# Inlined rather than imported from core.search so later edits there can't change this migration.
+# core_room's implicit rowid is not stable (its primary key is a UUID), so the index now keeps
+# the room id in its own content and gives each room a fixed FTS rowid in core_room_fts_key.
+INSTALL_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS core_room_fts_key (
+        fts_rowid INTEGER PRIMARY KEY,
+        room_id TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts USING fts5(
+        room_id UNINDEXED, name, description, category, tags, topics,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_insert AFTER INSERT ON core_room BEGIN
+        INSERT INTO core_room_fts_key(room_id) VALUES (new.id);
+        INSERT INTO core_room_fts(rowid, room_id, name, description, category, tags, topics)
+        VALUES (last_insert_rowid(), new.id, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_delete AFTER DELETE ON core_room BEGIN
+        DELETE FROM core_room_fts WHERE rowid = (SELECT fts_rowid FROM core_room_fts_key WHERE room_id = old.id);
+        DELETE FROM core_room_fts_key WHERE room_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_update AFTER UPDATE OF name, description, category, tags, topics ON core_room BEGIN
+        UPDATE core_room_fts
+        SET name = new.name, description = new.description, category = new.category, tags = new.tags, topics = new.topics
+        WHERE rowid = (SELECT fts_rowid FROM core_room_fts_key WHERE room_id = new.id);
+    END
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts_vocab USING fts5vocab(core_room_fts, 'row')",
+    'DELETE FROM core_room_fts',
+    'DELETE FROM core_room_fts_key',
+    'INSERT INTO core_room_fts_key(room_id) SELECT id FROM core_room ORDER BY created_at, id',
+    """
+    INSERT INTO core_room_fts(rowid, room_id, name, description, category, tags, topics)
+    SELECT core_room_fts_key.fts_rowid, core_room.id, core_room.name, core_room.description,
+           core_room.category, core_room.tags, core_room.topics
+    FROM core_room JOIN core_room_fts_key ON core_room_fts_key.room_id = core_room.id
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS core_room_fts_insert',
+    'DROP TRIGGER IF EXISTS core_room_fts_delete',
+    'DROP TRIGGER IF EXISTS core_room_fts_update',
+    'DROP TABLE IF EXISTS core_room_fts_vocab',
+    'DROP TABLE IF EXISTS core_room_fts',
+    'DROP TABLE IF EXISTS core_room_fts_key',
+]
+
+# The rowid-keyed index from 0010, restored when this migration is reversed
+ROWID_INSTALL_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts USING fts5(
+        name, description, category, tags, topics,
+        content='core_room', content_rowid='rowid',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_insert AFTER INSERT ON core_room BEGIN
+        INSERT INTO core_room_fts(rowid, name, description, category, tags, topics)
+        VALUES (new.rowid, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_delete AFTER DELETE ON core_room BEGIN
+        INSERT INTO core_room_fts(core_room_fts, rowid, name, description, category, tags, topics)
+        VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags, old.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_update AFTER UPDATE OF name, description, category, tags, topics ON core_room BEGIN
+        INSERT INTO core_room_fts(core_room_fts, rowid, name, description, category, tags, topics)
+        VALUES ('delete', old.rowid, old.name, old.description, old.category, old.tags, old.topics);
+        INSERT INTO core_room_fts(rowid, name, description, category, tags, topics)
+        VALUES (new.rowid, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts_vocab USING fts5vocab(core_room_fts, 'row')",
+    "INSERT INTO core_room_fts(core_room_fts) VALUES ('rebuild')",
+]
+
+
+def key_search_index_by_room_id(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL + INSTALL_SQL:
+        schema_editor.execute(statement)
+
+
+def key_search_index_by_rowid(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_SQL + ROWID_INSTALL_SQL:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_channel_deletion'),
+    ]
+
+    operations = [
+        migrations.RunPython(key_search_index_by_room_id, key_search_index_by_rowid),
+    ]
@@ -1,12 +1,196 @@
-from django.db import models 
+from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 import uuid
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # Lower-cased copy of user.email, kept in sync by core.signals; the unique index makes sign-in by email a single seek
+    email_normalized = models.CharField(max_length=254, unique=True, null=True, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.user.username}'s profile"
-    
- 
\ No newline at end of file
+
+
+class Room(models.Model):
+    VISIBILITY_CHOICES = [
+        ('public', 'Public'),
+        ('private', 'Private'),
+        ('unlisted', 'Unlisted'),
+    ]
+
+    owner_uuid = models.UUIDField(editable=False)
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    active = models.BooleanField(default=True)
+    category = models.CharField(max_length=50, blank=True)
+    channel_ids = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+    description = models.TextField(blank=True, null=True)
+    files = models.JSONField(default=list, blank=True)
+    last_active = models.DateTimeField(blank=True, null=True)
+    last_updated = models.DateTimeField(auto_now=True)
+    latest_message = models.TextField(blank=True, null=True)
+    members_uuids = models.JSONField(default=list, blank=True)
+    name = models.CharField(max_length=255)
+    tags = models.JSONField(default=list, blank=True)
+    topics = models.JSONField(default=list, blank=True)
+    visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='public')
+
+    class Meta:
+        indexes = [
+            # Keyset pagination seeks on (last_active, id), see core/pagination.py
+            models.Index(fields=['visibility', 'last_active', 'id'], name='room_visibility_active_idx'),
+            models.Index(fields=['last_active', 'id'], name='room_active_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class Channel(models.Model):
+    room_uuid = models.UUIDField()
+    name = models.CharField(max_length=255)
+    color = models.CharField(max_length=20, blank=True, null=True)
+    owner_uuid = models.UUIDField()
+    members_uuids = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False)
+    relative_id = models.IntegerField(blank=True, null=True)
+    last_updated = models.DateTimeField(auto_now=True)  # Compare-and-swap token for batch membership updates
+    last_sequence = models.PositiveBigIntegerField(default=0, editable=False)  # Sequence of the newest Message; see core.messages
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room_uuid', 'relative_id', 'id'], name='channel_room_relative_idx'),
+            models.Index(fields=['last_updated'], name='channel_last_updated_idx'),
+            models.Index(fields=['uuid'], name='channel_uuid_idx'),  # WebSocket connections look channels up by uuid
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ChannelDeletion(models.Model):
+    # One row per deleted channel, written by a database trigger on core_channel so
+    # queryset and raw deletes are caught too. update_channels --incremental renumbers
+    # these rooms and then clears the rows it handled; see core.renumbering.
+    room_uuid = models.UUIDField()
+
+    def __str__(self):
+        return f"Channel deleted from {self.room_uuid}"
+
+
+class RoomMembership(models.Model):
+    # Indexed mirror of Room.owner_uuid / Room.members_uuids so "which rooms is
+    # this user in" is an index lookup instead of a JSON scan over every room.
+    # Kept in sync by core.membership.sync_room_memberships.
+    ROLE_OWNER = 'owner'
+    ROLE_MEMBER = 'member'
+    ROLE_CHOICES = [
+        (ROLE_OWNER, 'Owner'),
+        (ROLE_MEMBER, 'Member'),
+    ]
+
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='memberships')
+    member_uuid = models.UUIDField()
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, default=ROLE_MEMBER)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'member_uuid'], name='unique_room_member'),
+        ]
+        indexes = [
+            models.Index(fields=['member_uuid', 'room'], name='membership_member_room_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.member_uuid} in {self.room_id} ({self.role})"
+
+
+class RoomFacet(models.Model):
+    # Inverted index over Room.tags, Room.topics and Room.category: one row per
+    # (facet, value, room), so a filter is a range scan per value instead of a JSON
+    # scan over every room. Kept in sync by core.facets.sync_room_facets.
+    FACET_TAG = 'tag'
+    FACET_TOPIC = 'topic'
+    FACET_CATEGORY = 'category'
+    FACET_CHOICES = [
+        (FACET_TAG, 'Tag'),
+        (FACET_TOPIC, 'Topic'),
+        (FACET_CATEGORY, 'Category'),
+    ]
+
+    facet = models.CharField(max_length=10, choices=FACET_CHOICES)
+    value = models.CharField(max_length=100)
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='facets', db_index=False)
+
+    class Meta:
+        constraints = [
+            # Doubles as the posting lists: room ids for one (facet, value), in order
+            models.UniqueConstraint(fields=['facet', 'value', 'room'], name='unique_room_facet'),
+        ]
+        indexes = [
+            # Counting the facets of a result set reads each room's rows from this index alone
+            models.Index(fields=['room', 'facet', 'value'], name='facet_room_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.facet}={self.value} on {self.room_id}"
+
+
+class OutboxEmail(models.Model):
+    # Mail written in the same transaction as the change that triggers it and
+    # delivered later by the drain_outbox command, so no email is lost and no
+    # request waits on the mail provider.
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)  # Not retried before this time
+    claimed_by = models.CharField(max_length=100, blank=True)
+    claimed_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+            models.Index(fields=['claimed_by'], name='outbox_claimed_by_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
+
+
+class Message(models.Model):
+    # Append-only history of a Channel. Sequences run 1, 2, 3... per channel and are
+    # handed out by core.messages.post_message from Channel.last_sequence.
+    channel_uuid = models.UUIDField()
+    sequence = models.PositiveBigIntegerField()
+    sender_uuid = models.UUIDField()
+    body = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            # Also the index every history page seeks into, newest first or after a sequence
+            models.UniqueConstraint(fields=['channel_uuid', 'sequence'], name='message_channel_sequence_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.channel_uuid}#{self.sequence}'
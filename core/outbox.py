@@ -0,0 +1,84 @@
+# core/outbox.py
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+def enqueue_email(subject, body, recipient):
+    # Call inside the transaction that makes the email necessary, so both commit or neither does
+    return OutboxEmail.objects.create(subject=subject, body=body, recipient=recipient)
+
+
+def new_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def claim_batch(worker_id, batch_size=50, lease=timedelta(minutes=5)):
+    """Atomically mark up to batch_size due emails as being sent by worker_id.
+
+    The claim is a single UPDATE that re-checks the row's status, so concurrent
+    workers can never claim the same row. Rows left in "sending" by a worker
+    that died are reclaimed once their lease runs out.
+    """
+    now = timezone.now()
+    claimable = (
+        Q(status=OutboxEmail.STATUS_PENDING, available_at__lte=now)
+        | Q(status=OutboxEmail.STATUS_SENDING, claimed_at__lt=now - lease)
+    )
+    candidates = OutboxEmail.objects.filter(claimable).order_by('available_at', 'id').values('id')[:batch_size]
+    claimed = OutboxEmail.objects.filter(claimable, id__in=candidates).update(
+        status=OutboxEmail.STATUS_SENDING, claimed_by=worker_id, claimed_at=now,
+    )
+    if not claimed:
+        return []
+    return list(OutboxEmail.objects.filter(claimed_by=worker_id, status=OutboxEmail.STATUS_SENDING, claimed_at=now))
+
+
+def deliver_batch(emails, connection=None, max_attempts=5, retry_backoff=timedelta(seconds=30)):
+    """Send claimed emails one by one and record each outcome. Returns (sent, failed).
+
+    Each claim is renewed just before its email is sent, and the outcome is only
+    written while the claim is still ours. An email whose lease ran out while
+    earlier ones were being sent belongs to whichever worker reclaimed it, and
+    is neither sent twice nor overwritten here. The lease must therefore outlast
+    a single send, retries included.
+    """
+    connection = connection or get_connection('core.mailerlite_backend.MailerLiteEmailBackend',
+                                              fail_silently=True, asynchronous=False)
+    sent = failed = 0
+    for email in emails:
+        worker_id = email.claimed_by
+        claim = OutboxEmail.objects.filter(pk=email.pk, status=OutboxEmail.STATUS_SENDING, claimed_by=worker_id)
+        if not claim.update(claimed_at=timezone.now()):
+            continue
+
+        email.attempts += 1
+        try:
+            delivered = connection.send_messages([EmailMessage(email.subject, email.body, to=[email.recipient])])
+            error = '' if delivered else 'Provider rejected the message'
+        except Exception as e:
+            delivered, error = 0, str(e)
+
+        outcome = {'attempts': email.attempts, 'claimed_by': '', 'claimed_at': None, 'last_error': error}
+        if delivered:
+            outcome.update(status=OutboxEmail.STATUS_SENT, sent_at=timezone.now())
+            sent += 1
+        elif email.attempts >= max_attempts:
+            outcome.update(status=OutboxEmail.STATUS_FAILED)
+            failed += 1
+        else:
+            # Back off exponentially between attempts
+            outcome.update(status=OutboxEmail.STATUS_PENDING,
+                           available_at=timezone.now() + retry_backoff * 2 ** (email.attempts - 1))
+            failed += 1
+
+        if not claim.update(**outcome):
+            print(f"Outbox email {email.pk} was reclaimed by another worker while it was being sent")
+    return sent, failed
@@ -0,0 +1,131 @@
+# core/pagination.py
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Forward-only keyset pagination over a (nullable field, unique tiebreaker) pair.
+
+    Unlike DRF's CursorPagination the cursor holds both columns, so every page is
+    a single range seek on a composite index and never falls back to OFFSET.
+    Rows whose ordering field is NULL always come last.
+    """
+    ordering_field = None
+    tiebreaker_field = 'id'
+    descending = False
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self):
+        prefix = '-' if self.descending else ''
+        return [f'{prefix}{self.ordering_field}', f'{prefix}{self.tiebreaker_field}']
+
+    def get_page_size(self, request):
+        try:
+            requested = int(request.query_params[self.page_size_query_param])
+            if requested > 0:
+                return min(requested, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        value, pk = self.decode_cursor(request, queryset.model) or (None, None)
+        ordered = queryset.order_by(*self.get_ordering())
+        pk_lookup = f"{self.tiebreaker_field}__{'lt' if self.descending else 'gt'}"
+
+        # Fetch one extra row to learn whether a next page exists without a COUNT.
+        # Non-NULL and NULL rows are read as two separate seeks: an OR across both
+        # would stop SQLite from range-seeking the composite index.
+        rows = []
+        if pk is None or value is not None:
+            rows = list(ordered.filter(self.after(value, pk))[:page_size + 1])
+        if len(rows) <= page_size:
+            nulls = ordered.filter(**{f'{self.ordering_field}__isnull': True})
+            if pk is not None and value is None:
+                nulls = nulls.filter(**{pk_lookup: pk})
+            rows += list(nulls[:page_size + 1 - len(rows)])
+
+        self.has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        self.next_position = self.position_of(rows[-1]) if self.has_next else None
+        return rows
+
+    def after(self, value, pk):
+        # Rows strictly after (value, pk) in a non-NULL ordering field, phrased as
+        # a range on the field so the index can seek straight to the cursor
+        if pk is None:
+            return Q(**{f'{self.ordering_field}__isnull': False})
+        bound, strict = ('lte', 'lt') if self.descending else ('gte', 'gt')
+        return Q(**{f'{self.ordering_field}__{bound}': value}) & (
+            Q(**{f'{self.ordering_field}__{strict}': value})
+            | Q(**{f'{self.tiebreaker_field}__{strict}': pk})
+        )
+
+    def position_of(self, instance):
+        return [
+            None if getattr(instance, name) is None
+            else instance._meta.get_field(name).value_to_string(instance)
+            for name in (self.ordering_field, self.tiebreaker_field)
+        ]
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            value, pk = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            value = None if value is None else model._meta.get_field(self.ordering_field).to_python(value)
+            pk = model._meta.get_field(self.tiebreaker_field).to_python(pk)
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    def encode_cursor(self, position):
+        encoded = base64.urlsafe_b64encode(json.dumps(position).encode('ascii')).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        return self.encode_cursor(self.next_position) if self.has_next else None
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class RoomCursorPagination(KeysetPagination):
+    # Most recently active rooms first; served by room_visibility_active_idx / room_active_idx
+    ordering_field = 'last_active'
+    descending = True
+
+
+class ChannelCursorPagination(KeysetPagination):
+    # Channels in the order they appear in a room; served by channel_room_relative_idx
+    ordering_field = 'relative_id'
@@ -0,0 +1,144 @@
+# core/provisioning.py
+import json
+import os
+import time
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import public_rooms_cache
+from .membership import sync_room_memberships
+from .models import Room, Channel, UserProfile
+
+DEFAULT_CHANNEL_NAME = "Intro"
+DEFAULT_CHANNEL_COLOR = "rgb(216, 210, 123)"
+
+
+def add_provisioning_arguments(parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Rooms processed per transaction')
+    parser.add_argument('--dry-run', action='store_true', help='Run every batch but roll it back instead of committing')
+    parser.add_argument('--checkpoint', help='File recording the last committed room; an existing checkpoint is resumed from')
+
+
+class DefaultChannelProvisioner:
+    """Creates the default "Intro" channel for rooms in set-based chunks.
+
+    Each chunk of rooms costs a fixed number of queries: one to read the rooms,
+    one to resolve every owner profile, one bulk INSERT of channels, one bulk
+    UPDATE of rooms and the membership index sync.
+    """
+
+    def __init__(self, stdout, style, batch_size=1000, dry_run=False, checkpoint=None,
+                 only_without_channels=False, replace_channel_ids=False, channel_reference='uuid', verbosity=1):
+        self.stdout = stdout
+        self.style = style
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.checkpoint = checkpoint
+        self.only_without_channels = only_without_channels
+        self.replace_channel_ids = replace_channel_ids
+        self.channel_reference = channel_reference
+        self.verbosity = verbosity
+        self.processed = self.created = self.skipped = 0
+
+    def run(self):
+        started = time.perf_counter()
+        last_id = self._load_checkpoint()
+        if last_id:
+            self.stdout.write(f'Resuming after room {last_id}.')
+
+        rooms = Room.objects.only('id', 'name', 'owner_uuid', 'channel_ids', 'members_uuids').order_by('id')
+        while True:
+            batch = list((rooms.filter(id__gt=last_id) if last_id else rooms)[:self.batch_size])
+            if not batch:
+                break
+
+            with transaction.atomic():
+                self._provision(batch)
+                if self.dry_run:
+                    transaction.set_rollback(True)
+
+            last_id = batch[-1].id
+            self.processed += len(batch)
+            if not self.dry_run:
+                self._save_checkpoint(last_id)
+            if self.verbosity >= 1:
+                self.stdout.write(f'Processed {self.processed} rooms...')
+
+        if self.checkpoint and not self.dry_run and os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+        self._summary(time.perf_counter() - started)
+
+    def _provision(self, batch):
+        if self.only_without_channels:
+            for room in batch:
+                if room.channel_ids and self.verbosity >= 2:
+                    self.stdout.write(f'Room "{room.name}" already has channels. Skipping.')
+            batch = [room for room in batch if not room.channel_ids]
+        if not batch:
+            return
+
+        # Resolve every owner in the chunk with a single query
+        owners = set(UserProfile.objects.filter(uuid__in={room.owner_uuid for room in batch}).values_list('uuid', flat=True))
+
+        now = timezone.now()
+        rooms, channels = [], []
+        for room in batch:
+            if room.owner_uuid not in owners:
+                self.skipped += 1
+                self.stdout.write(self.style.ERROR(f'Owner with UUID {room.owner_uuid} does not exist. Skipping room "{room.name}".'))
+                continue
+            owner_uuid = str(room.owner_uuid)
+            channels.append(Channel(
+                name=DEFAULT_CHANNEL_NAME,
+                room_uuid=room.id,
+                created_at=now,
+                color=DEFAULT_CHANNEL_COLOR,
+                owner_uuid=owner_uuid,
+                members_uuids=[owner_uuid],
+            ))
+            rooms.append(room)
+
+        if not rooms:
+            return
+
+        Channel.objects.bulk_create(channels, batch_size=self.batch_size)
+        for room, channel in zip(rooms, channels):
+            reference = str(channel.uuid) if self.channel_reference == 'uuid' else channel.id
+            room.channel_ids = [reference] if self.replace_channel_ids else (room.channel_ids or []) + [reference]
+            owner_uuid = str(room.owner_uuid)
+            if owner_uuid not in room.members_uuids:
+                room.members_uuids = (room.members_uuids or []) + [owner_uuid]
+            room.last_updated = now  # bulk_update skips auto_now, and last_updated is the CAS token for member batches
+
+        Room.objects.bulk_update(rooms, ['channel_ids', 'members_uuids', 'last_updated'], batch_size=self.batch_size)
+        sync_room_memberships(rooms, batch_size=self.batch_size)
+        public_rooms_cache.bump_on_commit()
+        self.created += len(channels)
+
+        if self.verbosity >= 2:
+            for room in rooms:
+                self.stdout.write(self.style.SUCCESS(f'Channel "{DEFAULT_CHANNEL_NAME}" created for room "{room.name}".'))
+
+    def _load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as handle:
+            return Room._meta.pk.to_python(json.load(handle)['last_room_id'])
+
+    def _save_checkpoint(self, last_id):
+        if not self.checkpoint:
+            return
+        # Write-then-rename so an interrupted run never leaves a truncated checkpoint behind
+        temporary = f'{self.checkpoint}.tmp'
+        with open(temporary, 'w') as handle:
+            json.dump({'last_room_id': str(last_id), 'processed': self.processed}, handle)
+        os.replace(temporary, self.checkpoint)
+
+    def _summary(self, elapsed):
+        rate = self.processed / elapsed if elapsed else 0
+        prefix = '[dry run] ' if self.dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Finished processing rooms: {self.processed} rooms, {self.created} channels created, '
+            f'{self.skipped} skipped in {elapsed:.2f}s ({rate:.0f} rooms/s).'
+        ))
@@ -0,0 +1,141 @@
+# core/renumbering.py
+import uuid
+
+from django.db import connection, transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+
+from .models import Channel, ChannelDeletion, Room
+
+# relative_id is a channel's 1-based position in its room, ordered by creation time.
+# The id tiebreaker keeps the numbering stable for channels created in the same instant.
+RENUMBER_SQL = """
+    UPDATE {channel}
+    SET relative_id = ranked.position
+    FROM (
+        SELECT id, ROW_NUMBER() OVER (PARTITION BY room_uuid ORDER BY created_at, id) AS position
+        FROM {channel}
+        WHERE room_uuid IN (SELECT id FROM {room}){room_filter}
+    ) AS ranked
+    WHERE {channel}.id = ranked.id
+      AND ({channel}.relative_id IS NULL OR {channel}.relative_id <> ranked.position)
+"""
+
+# Same trigger as migration 0012. SQLite drops a table's triggers when a migration
+# rebuilds it, so update_channels reinstalls it (IF NOT EXISTS) on every run.
+DELETION_TRIGGER_SQL = """
+    CREATE TRIGGER IF NOT EXISTS core_channel_record_deletion AFTER DELETE ON core_channel BEGIN
+        INSERT INTO core_channeldeletion(room_uuid) VALUES (old.room_uuid);
+    END
+"""
+
+
+def supports_update_from():
+    # UPDATE ... FROM arrived in SQLite 3.33; PostgreSQL has always had it
+    if connection.vendor == 'sqlite':
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 33, 0)
+    return connection.vendor == 'postgresql'
+
+
+def renumber_channels(room_uuids=None, chunk_size=500, batch_size=1000):
+    """Recompute relative_id for every channel (or only those in room_uuids).
+
+    Uses one window-function UPDATE per chunk of rooms (a single statement when
+    renumbering everything), falling back to a chunked bulk_update on backends
+    without UPDATE ... FROM. Only rows whose number actually changes are
+    written. Returns the number of channels updated.
+    """
+    _fill_missing_uuids(batch_size)
+
+    if room_uuids is None:
+        chunks = [None]
+    else:
+        room_uuids = list(room_uuids)
+        chunks = [room_uuids[i:i + chunk_size] for i in range(0, len(room_uuids), chunk_size)]
+
+    updated = 0
+    for chunk in chunks:
+        with transaction.atomic():
+            if supports_update_from():
+                updated += _renumber_with_window_update(chunk)
+            else:
+                updated += _renumber_with_bulk_update(chunk, batch_size)
+    return updated
+
+
+def _renumber_with_window_update(room_uuids):
+    channel_table = connection.ops.quote_name(Channel._meta.db_table)
+    room_table = connection.ops.quote_name(Room._meta.db_table)
+    room_filter, params = '', []
+    if room_uuids is not None:
+        # Bind parameters through the field so UUIDs match the backend's storage format
+        field = Channel._meta.get_field('room_uuid')
+        params = [field.get_db_prep_value(value, connection) for value in room_uuids]
+        room_filter = f" AND room_uuid IN ({', '.join(['%s'] * len(params))})"
+
+    sql = RENUMBER_SQL.format(channel=channel_table, room=room_table, room_filter=room_filter)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def _renumber_with_bulk_update(room_uuids, batch_size):
+    channels = Channel.objects.filter(room_uuid__in=Room.objects.values('id'))
+    if room_uuids is not None:
+        channels = channels.filter(room_uuid__in=room_uuids)
+    channels = channels.annotate(position=Window(
+        RowNumber(), partition_by=[F('room_uuid')], order_by=[F('created_at').asc(), F('id').asc()],
+    )).only('id', 'relative_id')
+
+    updated, pending = 0, []
+    for channel in channels.iterator(chunk_size=batch_size):
+        if channel.relative_id != channel.position:
+            channel.relative_id = channel.position
+            pending.append(channel)
+        if len(pending) >= batch_size:
+            updated += Channel.objects.bulk_update(pending, ['relative_id'])
+            pending = []
+    if pending:
+        updated += Channel.objects.bulk_update(pending, ['relative_id'])
+    return updated
+
+
+def _fill_missing_uuids(batch_size):
+    missing = list(Channel.objects.filter(uuid__isnull=True).only('id'))
+    for channel in missing:
+        channel.uuid = uuid.uuid4()
+    if missing:
+        Channel.objects.bulk_update(missing, ['uuid'], batch_size=batch_size)
+
+
+def rooms_with_changed_channels(since):
+    # Creating a channel also stamps last_updated, so one range on channel_last_updated_idx covers both cases
+    return Channel.objects.filter(last_updated__gte=since).values_list('room_uuid', flat=True).distinct()
+
+
+def install_deletion_trigger(using_connection=None):
+    using_connection = using_connection or connection
+    if using_connection.vendor != 'sqlite':
+        return  # Other backends keep triggers across ALTER TABLE
+    with using_connection.cursor() as cursor:
+        cursor.execute(DELETION_TRIGGER_SQL)
+
+
+def rooms_with_deleted_channels():
+    """Rooms that lost a channel since the last clear_channel_deletions(), and the id to clear up to.
+
+    Deleted channels leave nothing in core_channel for rooms_with_changed_channels
+    to find, so the trigger records their rooms in ChannelDeletion instead.
+    """
+    last_id = ChannelDeletion.objects.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        return set(), None
+    rooms = ChannelDeletion.objects.filter(id__lte=last_id).values_list('room_uuid', flat=True).distinct()
+    return set(rooms), last_id
+
+
+def clear_channel_deletions(up_to_id):
+    # Rows recorded after rooms_with_deleted_channels() read them stay for the next run
+    if up_to_id is not None:
+        ChannelDeletion.objects.filter(id__lte=up_to_id).delete()
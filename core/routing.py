@@ -0,0 +1,8 @@
+# core/routing.py
+from django.urls import path
+
+from .consumers import ChannelConsumer
+
+websocket_urlpatterns = [
+    path('ws/channels/<uuid:channel_uuid>/', ChannelConsumer.as_asgi()),
+]
@@ -0,0 +1,199 @@
+# core/search.py
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection, connections, router
+
+from .models import Room
+
+# bm25() weights, in column order: room_id is unindexed, a hit in the name counts most,
+# the description least
+SEARCH_WEIGHTS = (0.0, 10.0, 1.0, 4.0, 3.0, 3.0)
+
+# FTS5 index over core_room. core_room's primary key is a UUID, so its implicit rowid
+# can change on VACUUM or when a migration remakes the table; the index therefore
+# keeps its own copy of each room's text together with the room id, and
+# core_room_fts_key gives every room a fixed FTS rowid (an INTEGER PRIMARY KEY, which
+# never changes) so the triggers can find a room's row without scanning. Triggers
+# rather than signals keep it current, so bulk_create, bulk_update and queryset
+# update() are covered too. Everything is IF NOT EXISTS so install_search_index()
+# can also repair the triggers after a migration that rebuilds core_room.
+INSTALL_SQL = [
+    """
+    CREATE TABLE IF NOT EXISTS core_room_fts_key (
+        fts_rowid INTEGER PRIMARY KEY,
+        room_id TEXT NOT NULL UNIQUE
+    )
+    """,
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts USING fts5(
+        room_id UNINDEXED, name, description, category, tags, topics,
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_insert AFTER INSERT ON core_room BEGIN
+        INSERT INTO core_room_fts_key(room_id) VALUES (new.id);
+        INSERT INTO core_room_fts(rowid, room_id, name, description, category, tags, topics)
+        VALUES (last_insert_rowid(), new.id, new.name, new.description, new.category, new.tags, new.topics);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_delete AFTER DELETE ON core_room BEGIN
+        DELETE FROM core_room_fts WHERE rowid = (SELECT fts_rowid FROM core_room_fts_key WHERE room_id = old.id);
+        DELETE FROM core_room_fts_key WHERE room_id = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS core_room_fts_update AFTER UPDATE OF name, description, category, tags, topics ON core_room BEGIN
+        UPDATE core_room_fts
+        SET name = new.name, description = new.description, category = new.category, tags = new.tags, topics = new.topics
+        WHERE rowid = (SELECT fts_rowid FROM core_room_fts_key WHERE room_id = new.id);
+    END
+    """,
+    # Per-term document counts, used to pick a ranking strategy before running the search
+    "CREATE VIRTUAL TABLE IF NOT EXISTS core_room_fts_vocab USING fts5vocab(core_room_fts, 'row')",
+]
+
+# Refills the index from core_room, oldest rooms first so FTS rowids follow creation order
+REBUILD_SQL = [
+    'DELETE FROM core_room_fts',
+    'DELETE FROM core_room_fts_key',
+    'INSERT INTO core_room_fts_key(room_id) SELECT id FROM core_room ORDER BY created_at, id',
+    """
+    INSERT INTO core_room_fts(rowid, room_id, name, description, category, tags, topics)
+    SELECT core_room_fts_key.fts_rowid, core_room.id, core_room.name, core_room.description,
+           core_room.category, core_room.tags, core_room.topics
+    FROM core_room JOIN core_room_fts_key ON core_room_fts_key.room_id = core_room.id
+    """,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS core_room_fts_insert',
+    'DROP TRIGGER IF EXISTS core_room_fts_delete',
+    'DROP TRIGGER IF EXISTS core_room_fts_update',
+    'DROP TABLE IF EXISTS core_room_fts_vocab',
+    'DROP TABLE IF EXISTS core_room_fts',
+    'DROP TABLE IF EXISTS core_room_fts_key',
+]
+
+RANKED_SQL = f"""
+    SELECT core_room.* FROM core_room_fts
+    JOIN core_room ON core_room.id = core_room_fts.room_id
+    WHERE core_room_fts MATCH %s
+      AND (core_room.visibility = 'public'
+           OR core_room.id IN (SELECT room_id FROM core_roommembership WHERE member_uuid = %s))
+    ORDER BY bm25(core_room_fts, {', '.join(map(str, SEARCH_WEIGHTS))})
+    LIMIT %s
+"""
+
+# Public rooms come from the newest candidates matches only (FTS5 stops reading the
+# doclist there), so the cost is bounded however many rooms match. The caller's other
+# rooms are few, so CROSS JOIN makes SQLite start from the membership index and test
+# each of them against the search index instead of scanning every match.
+RECENT_SQL = f"""
+    SELECT * FROM (
+        SELECT core_room.* FROM core_room
+        WHERE core_room.visibility = 'public' AND core_room.id IN (
+            SELECT room_id FROM core_room_fts WHERE core_room_fts MATCH %s ORDER BY rowid DESC LIMIT %s
+        )
+        ORDER BY core_room.last_active DESC LIMIT %s
+    )
+    UNION ALL
+    SELECT * FROM (
+        SELECT core_room.* FROM core_roommembership
+        CROSS JOIN core_room ON core_room.id = core_roommembership.room_id
+        CROSS JOIN core_room_fts_key ON core_room_fts_key.room_id = core_room.id
+        CROSS JOIN core_room_fts ON core_room_fts.rowid = core_room_fts_key.fts_rowid
+        WHERE core_roommembership.member_uuid = %s AND core_room.visibility != 'public'
+          AND core_room_fts MATCH %s
+        ORDER BY core_room.last_active DESC LIMIT %s
+    )
+    ORDER BY last_active DESC
+    LIMIT %s
+"""
+
+
+def install_search_index(using_connection=None, rebuild=True):
+    using_connection = using_connection or connection
+    if using_connection.vendor != 'sqlite':
+        return
+    with using_connection.cursor() as cursor:
+        for statement in INSTALL_SQL:
+            cursor.execute(statement)
+        if rebuild:
+            for statement in REBUILD_SQL:
+                cursor.execute(statement)
+
+
+def drop_search_index(using_connection=None):
+    using_connection = using_connection or connection
+    if using_connection.vendor != 'sqlite':
+        return
+    with using_connection.cursor() as cursor:
+        for statement in DROP_SQL:
+            cursor.execute(statement)
+
+
+def optimize_search_index():
+    # Merges the index's b-trees into one; worth running after a large rebuild or import
+    with connection.cursor() as cursor:
+        cursor.execute("INSERT INTO core_room_fts(core_room_fts) VALUES ('optimize')")
+
+
+def search_terms(query):
+    # Roughly what the unicode61 tokenizer produces: case-folded, diacritics removed, split on anything but letters/digits
+    folded = ''.join(c for c in unicodedata.normalize('NFKD', query or '') if not unicodedata.combining(c)).lower()
+    return re.findall(r'[^\W_]+', folded)[:8]
+
+
+def match_expression(terms):
+    """An FTS5 query requiring every term, the last one as a prefix so results follow typing.
+
+    Terms are quoted, so FTS5 operators typed by users can never cause a syntax error.
+    """
+    quoted = [f'"{term}"' for term in terms]
+    if len(terms[-1]) >= 2:
+        quoted[-1] += '*'  # A one-letter prefix would match nearly everything
+    return ' '.join(quoted)
+
+
+def estimate_matches(terms):
+    # Every term must match, so the rarest one bounds the result size. Each lookup is a seek in the vocab table.
+    estimate = None
+    # Same database as the search query that follows, the replica during GET requests
+    with connections[router.db_for_read(Room)].cursor() as cursor:
+        for i, term in enumerate(terms):
+            if i == len(terms) - 1 and len(term) >= 2:
+                cursor.execute('SELECT sum(doc) FROM core_room_fts_vocab WHERE term >= %s AND term < %s', [term, term + '\uffff'])
+            else:
+                cursor.execute('SELECT sum(doc) FROM core_room_fts_vocab WHERE term = %s', [term])
+            count = cursor.fetchone()[0] or 0
+            estimate = count if estimate is None else min(estimate, count)
+            if not estimate:
+                break
+    return estimate or 0
+
+
+def search_rooms(query, member_uuid, limit=20):
+    """Public rooms and rooms member_uuid belongs to that match query.
+
+    Results are ranked by BM25 while the query matches at most
+    SEARCH_MAX_RANKED_MATCHES rooms. Terms common enough to match more than
+    that barely separate rooms by relevance, so those return the most recently
+    active of the newest SEARCH_RECENT_CANDIDATES matches instead. Either way
+    the work is bounded by a setting rather than by the number of rooms.
+    """
+    terms = search_terms(query)
+    if not terms:
+        return []
+    matches = estimate_matches(terms)
+    if not matches:
+        return []
+
+    expression = match_expression(terms)
+    if matches <= getattr(settings, 'SEARCH_MAX_RANKED_MATCHES', 20000):
+        return list(Room.objects.raw(RANKED_SQL, [expression, member_uuid.hex, limit]))
+    candidates = getattr(settings, 'SEARCH_RECENT_CANDIDATES', 5000)
+    return list(Room.objects.raw(RECENT_SQL, [expression, candidates, limit, member_uuid.hex, expression, limit, limit]))
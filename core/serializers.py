@@ -1,10 +1,67 @@
 # core/serializers
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import  UserProfile
-from django.db import IntegrityError
+from .models import  UserProfile, Room, Channel, Message
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from .credentials import email_taken
+from .activity import activity_buffer
+from .authentication import VersionedRefreshToken
+from .fieldsets import SparseFieldsMixin
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
  
 
+class RoomSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Room
+        fields = '__all__'
+        # Shown instead of the arrays in list responses; see core.fieldsets
+        array_counts = {'members_count': 'members_uuids', 'channels_count': 'channel_ids', 'files_count': 'files'}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Show activity still waiting in this process's buffer rather than the older row
+        pending = activity_buffer.pending(instance.pk)
+        if pending is not None:
+            last_active, latest_message = pending
+            if 'last_active' in data:
+                data['last_active'] = self.fields['last_active'].to_representation(last_active)
+            if latest_message is not None and 'latest_message' in data:
+                data['latest_message'] = latest_message
+        return data
+
+
+class ChannelSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = Channel
+        fields = '__all__'
+        array_counts = {'members_count': 'members_uuids'}
+
+
+class MessageSerializer(serializers.ModelSerializer):
+    body = serializers.CharField(max_length=getattr(settings, 'WEBSOCKET_MAX_MESSAGE_LENGTH', 4000))
+
+    class Meta:
+        model = Message
+        fields = ['channel_uuid', 'sequence', 'sender_uuid', 'body', 'created_at']
+        read_only_fields = ['channel_uuid', 'sequence', 'sender_uuid', 'created_at']
+
+
+class MemberBatchSerializer(serializers.Serializer):
+    MAX_MEMBERS = 5000
+
+    add = serializers.ListField(child=serializers.UUIDField(), required=False, default=list, max_length=MAX_MEMBERS)
+    remove = serializers.ListField(child=serializers.UUIDField(), required=False, default=list, max_length=MAX_MEMBERS)
+
+    def validate(self, data):
+        if not data['add'] and not data['remove']:
+            raise serializers.ValidationError("Provide at least one member to add or remove.")
+        if set(data['add']) & set(data['remove']):
+            raise serializers.ValidationError("A member cannot be both added and removed in the same batch.")
+        return data
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     uuid = serializers.UUIDField(read_only=True)  # Read-only since UUID is auto-generated
 
@@ -13,7 +70,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = ['uuid']
 
         
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     uuid = serializers.UUIDField(source='userprofile.uuid', read_only=True)  # Link to UserProfile UUID
 
     class Meta:
@@ -23,6 +80,7 @@ class UserSerializer(serializers.ModelSerializer):
             'password': {'write_only': True},
         }
 
+    @transaction.atomic
     def create(self, validated_data):
         # Remove nested userprofile data since we are only passing user fields
         profile_data = validated_data.pop('userprofile', None)
@@ -35,13 +93,17 @@ class UserSerializer(serializers.ModelSerializer):
             last_name=validated_data.get('last_name', '')
         )
         user.set_password(validated_data['password'])  # Hash the password
-        user.save()
-
-        # After saving the user, create a UserProfile instance linked to this user
-        UserProfile.objects.create(user=user)
+        user.save()  # The create_user_profile signal creates the UserProfile in the same transaction
 
         return user
 
+    def validate_email(self, value):
+        # Same check as registration; the user being edited may keep their own address
+        if email_taken(value, self.instance):
+            raise serializers.ValidationError("A user with this email already exists.")
+        return value
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.username = validated_data.get('username', instance.username)
         instance.email = validated_data.get('email', instance.email)
@@ -52,10 +114,19 @@ class UserSerializer(serializers.ModelSerializer):
         password = validated_data.get('password', None)
         if password:
             instance.set_password(password)  # Hash the password
-        instance.save()
+        try:
+            instance.save()
+        except DjangoValidationError as e:
+            # Lost a race for the email to a concurrent edit; save_user_profile reports it (and this rolls back)
+            raise serializers.ValidationError(e.message_dict)
 
         return instance
 
+class VersionedTokenObtainPairSerializer(TokenObtainPairSerializer):
+    # Tokens from /token/ carry the same profile_uuid and user_version claims as /signin/
+    token_class = VersionedRefreshToken
+
+
 class UserRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
     confirm_password = serializers.CharField(write_only=True)
@@ -71,25 +142,19 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         return data
     
     def validate_email(self, value):
-        # Check if the email already exists
-        if User.objects.filter(email=value).exists():
+        # Check if the email already exists (case-insensitively, through the indexed normalized column)
+        if email_taken(value):
             raise serializers.ValidationError("A user with this email already exists.")
         return value
 
     def create(self, validated_data):
-        try:
-            validated_data.pop('confirm_password')
-            user = User.objects.create(
-                username=validated_data['username'],
-                email=validated_data['email']
-            )
-            user.set_password(validated_data['password'])  # Hash the password
-            user.save()
-
-            # Create associated UserProfile only if it doesn't exist
-            UserProfile.objects.get_or_create(user=user)
-
-        except IntegrityError:
-            raise serializers.ValidationError({"error": "User profile already exists."})
-        
+        # Hash the password before the first save so the user is written with a single INSERT;
+        # the create_user_profile signal adds the profile. Callers wrap this in a transaction.
+        validated_data.pop('confirm_password')
+        user = User(
+            username=validated_data['username'],
+            email=validated_data['email']
+        )
+        user.set_password(validated_data['password'])  # Hash the password
+        user.save()
         return user
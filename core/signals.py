@@ -1,14 +1,99 @@
 # core/signals.py
-from django.db.models.signals import post_save
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import UserProfile, Room
+from .membership import sync_room_memberships
+from .facets import sync_room_facets
+from .cache import public_rooms_cache
+from .credentials import normalize_email
+from .authentication import forget_snapshot
+from .usernames import bump_username_generation, profile_usernames, username_index
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # WAL lets readers run alongside the writer; on the raw connection so query counts don't include it
+    if connection.vendor == 'sqlite':
+        for pragma in getattr(settings, 'SQLITE_PRAGMAS', ()):
+            connection.connection.execute(f'PRAGMA {pragma}')
+
+@receiver(post_init, sender=User)
+def remember_saved_fields(sender, instance, **kwargs):
+    # Dirty-field tracking for save_user_profile and the username index; __dict__ so deferred fields aren't fetched
+    instance._saved_email = instance.__dict__.get('email')
+    instance._saved_username = instance.__dict__.get('username')
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
+    # The only place a profile is created, so registration costs exactly one INSERT per table
     if created:
-        UserProfile.objects.create(user=instance)
+        UserProfile.objects.create(user=instance, email_normalized=normalize_email(instance.email))
+
+@receiver(post_save, sender=User)
+def save_user_profile(sender, instance, created, update_fields=None, **kwargs):
+    # Most User saves (last_login on sign-in, password changes...) don't touch the email, so they skip the profile
+    if update_fields is not None and 'email' not in update_fields:
+        return
+    if created or instance.email == instance._saved_email:
+        instance._saved_email = instance.email
+        return
+    email_normalized = normalize_email(instance.email)
+    try:
+        UserProfile.objects.filter(user=instance).update(email_normalized=email_normalized)
+    except IntegrityError:
+        # Another account has this address in some letter case. Callers validate first with
+        # core.credentials.email_taken, so this only catches races; raising makes the caller's
+        # transaction roll the User row back too.
+        raise ValidationError({'email': ['A user with this email already exists.']})
+    instance._saved_email = instance.email
+    if User.userprofile.related.is_cached(instance):
+        instance.userprofile.email_normalized = email_normalized
 
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.userprofile.save()
+def index_username(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'username' not in update_fields:
+        return
+    if instance._saved_username not in (None, instance.username):
+        username_index.discard(instance._saved_username)
+        transaction.on_commit(bump_username_generation)  # Other workers' indexes still hold the old name
+        # Renames are rare, so looking the profile up here costs nothing on ordinary saves
+        for profile_uuid in UserProfile.objects.filter(user=instance).values_list('uuid', flat=True):
+            profile_usernames.delete(profile_uuid)
+    instance._saved_username = instance.username
+    username_index.add(instance.username)
+
+@receiver(post_delete, sender=User)
+def unindex_username(sender, instance, **kwargs):
+    username_index.discard(instance.username)
+    transaction.on_commit(bump_username_generation)
+
+@receiver(post_delete, sender=UserProfile)
+def forget_profile_username(sender, instance, **kwargs):
+    profile_usernames.delete(instance.uuid)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_credentials(sender, instance, **kwargs):
+    forget_snapshot(instance.pk)
+
+@receiver(post_save, sender=Room)
+def sync_memberships_on_room_save(sender, instance, created, update_fields=None, **kwargs):
+    # Saves that don't touch ownership or membership leave the index alone
+    if update_fields is not None and not {'owner_uuid', 'members_uuids'} & set(update_fields):
+        return
+    sync_room_memberships([instance])
+
+@receiver(post_save, sender=Room)
+def sync_facets_on_room_save(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {'tags', 'topics', 'category'} & set(update_fields):
+        return
+    sync_room_facets([instance])
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_public_rooms(sender, instance, **kwargs):
+    public_rooms_cache.bump_on_commit()
@@ -1,3 +1,1369 @@
-from django.test import TestCase
+import datetime
+import importlib
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.apps import apps
+from django.contrib import admin
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, connections, router, transaction
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import mailerlite_backend
+from .activity import ActivityBuffer, activity_buffer
+from .admin import CappedCountPaginator, UniqueEmailUserChangeForm
+from .authentication import JWTAuthMiddleware, VersionedRefreshToken, user_snapshot_cache
+from .cache import public_rooms_cache
+from .dbrouting import _read_alias, _read_user, pin_user
+from .facets import FacetCountIndex, facet_index
+from .mailerlite_backend import DeliveryPipeline, DeliveryQueueFull, MailerLiteClient
+from .membership import MembershipConflict, apply_member_batch
+from .messages import NotAChannelMember, message_history, post_message
+from .metrics import MetricsRegistry, metrics_view
+from .models import Channel, ChannelDeletion, OutboxEmail, Room, RoomFacet, RoomMembership, UserProfile
+from .outbox import claim_batch, deliver_batch
+from .provisioning import DefaultChannelProvisioner
+from .transfer import Importer, open_ndjson
+from .routing import websocket_urlpatterns
+from .search import search_rooms
+from .usernames import UsernameIndex, profile_usernames, resolve_usernames
+
+
+class RegistrationQueryTests(TestCase):
+    def register(self, username='alice', email='Alice@Example.com'):
+        return self.client.post('/api/register/', {
+            'username': username,
+            'email': email,
+            'password': 'S3cure-Passw0rd!',
+            'confirm_password': 'S3cure-Passw0rd!',
+        }, content_type='application/json')
+
+    def test_register_writes_each_row_once(self):
+        # 2 uniqueness checks, SAVEPOINT, INSERT user, INSERT profile, INSERT outbox, RELEASE
+        with self.assertNumQueries(7):
+            response = self.register()
+        self.assertEqual(response.status_code, 201, response.content)
+
+        user = User.objects.get(username='alice')
+        self.assertTrue(user.check_password('S3cure-Passw0rd!'))
+        self.assertEqual(user.userprofile.email_normalized, 'alice@example.com')
+        self.assertEqual(OutboxEmail.objects.filter(recipient='Alice@Example.com').count(), 1)
+
+    def test_failed_registration_leaves_nothing_behind(self):
+        self.register()
+        response = self.register(username='alice2', email='ALICE@example.com')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(User.objects.count(), 1)
+        self.assertEqual(UserProfile.objects.count(), 1)
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_signin_is_one_query(self):
+        self.register()
+        for identifier in ('alice', 'alice@example.com'):
+            with self.assertNumQueries(1):
+                response = self.client.post('/api/signin/', {
+                    'username_or_email': identifier,
+                    'password': 'S3cure-Passw0rd!',
+                }, content_type='application/json')
+            self.assertEqual(response.status_code, 200, response.content)
+
+    def test_signin_follows_renames_made_elsewhere(self):
+        self.register()
+        self.client.post('/api/signin/', {'username_or_email': 'alice', 'password': 'S3cure-Passw0rd!'},
+                         content_type='application/json')
+        User.objects.filter(username='alice').update(username='alicia')  # No signals, as from another worker
+        for identifier, expected in (('alice', 400), ('alicia', 200)):
+            response = self.client.post('/api/signin/', {
+                'username_or_email': identifier,
+                'password': 'S3cure-Passw0rd!',
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, expected, response.content)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        user_snapshot_cache.clear()
+        self.user = User.objects.create_user('carol', 'carol@example.com', 'S3cure-Passw0rd!')
+
+    def get_profile(self, token):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        return client.get('/api/profile/')
+
+    def token(self):
+        return str(VersionedRefreshToken.for_user(User.objects.get(pk=self.user.pk)).access_token)
+
+    def test_warm_snapshot_authenticates_without_a_query(self):
+        token = self.token()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_profile(token).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.get_profile(token)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['uuid'], str(self.user.userprofile.uuid))
+
+    def test_versioned_fields_revoke_earlier_tokens(self):
+        changes = [
+            lambda user: user.set_password('An0ther-Passw0rd!'),
+            lambda user: setattr(user, 'is_staff', True),
+            lambda user: setattr(user, 'is_active', False),
+        ]
+        for change in changes:
+            token = self.token()
+            self.assertEqual(self.get_profile(token).status_code, 200)
+            user = User.objects.get(pk=self.user.pk)
+            change(user)
+            user.save()
+            self.assertEqual(self.get_profile(token).status_code, 401)
+        self.assertEqual(self.get_profile(self.token()).status_code, 401)  # Inactive, whatever the version
+
+    def test_newer_token_than_the_snapshot_reloads_it(self):
+        self.assertEqual(self.get_profile(self.token()).status_code, 200)
+        # Another worker changes the password: this process keeps its old snapshot
+        User.objects.filter(pk=self.user.pk).update(password='changed-elsewhere')
+        token = self.token()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.get_profile(token).status_code, 200)
+
+    def test_tokens_without_a_version_still_authenticate(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        for _ in range(2):
+            with self.assertNumQueries(1):  # Always re-read: nothing proves a snapshot is current
+                self.assertEqual(self.get_profile(token).status_code, 200)
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.get_profile(token).status_code, 401)
+
+
+class ProfileSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('bob', 'bob@example.com', 'S3cure-Passw0rd!')
+
+    def test_saves_that_keep_the_email_skip_the_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Bob'
+        with self.assertNumQueries(1):
+            user.save()
+        with self.assertNumQueries(1):
+            user.save(update_fields=['last_login'])
+
+    def test_email_change_updates_the_profile(self):
+        user = User.objects.get(pk=self.user.pk)
+        user.email = 'Robert@Example.com'
+        with self.assertNumQueries(2):
+            user.save()
+        self.assertEqual(UserProfile.objects.get(user=user).email_normalized, 'robert@example.com')
+
+    def test_taking_another_users_email_is_rejected(self):
+        other = User.objects.create_user('eve', 'eve@example.com', 'S3cure-Passw0rd!')
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(f'/api/users/{self.user.pk}/', {'email': 'EVE@example.com'}, format='json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertIn('email', response.json())
+        # Keeping your own address in another case is fine
+        response = client.patch(f'/api/users/{self.user.pk}/', {'email': 'BOB@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        form = UniqueEmailUserChangeForm({
+            'username': 'eve', 'email': 'bob@EXAMPLE.com', 'date_joined_0': '2024-01-01', 'date_joined_1': '00:00:00',
+        }, instance=other)
+        self.assertFalse(form.is_valid())  # The admin shows this instead of failing the save
+        self.assertEqual(form.errors['email'], ['A user with this email already exists.'])
+
+    def test_a_race_for_an_email_is_a_validation_error(self):
+        User.objects.create_user('eve', 'eve@example.com', 'S3cure-Passw0rd!')
+        user = User.objects.get(pk=self.user.pk)
+        user.email = 'Eve@Example.com'
+        with self.assertRaises(ValidationError), transaction.atomic():
+            user.save()
+        self.assertEqual(User.objects.get(pk=self.user.pk).email, 'bob@example.com')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('carol', 'carol@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, url):
+        # Follows next links to the end, returning every id seen
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content)
+            ids += [row['id'] for row in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_rooms_come_back_once_each_with_nulls_last(self):
+        owner = self.user.userprofile.uuid
+        now = timezone.now()
+        # Ties on last_active, distinct values and NULLs, so pages split inside each group
+        times = [now, now, now, now - datetime.timedelta(hours=1), now + datetime.timedelta(hours=1), None, None, None]
+        rooms = [Room.objects.create(name=f'Room {i}', owner_uuid=owner, last_active=t) for i, t in enumerate(times)]
+
+        expected = sorted((room for room in rooms if room.last_active), key=lambda room: (room.last_active, room.id), reverse=True)
+        expected += sorted((room for room in rooms if room.last_active is None), key=lambda room: room.id, reverse=True)
+        for page_size in (1, 2, 3, 50):
+            self.assertEqual(self.walk(f'/api/rooms/?page_size={page_size}'), [str(room.id) for room in expected])
+
+    def test_channels_come_back_once_each_with_nulls_last(self):
+        room_uuid = uuid.uuid4()
+        channels = [Channel.objects.create(name=f'Channel {i}', room_uuid=room_uuid, owner_uuid=uuid.uuid4(), relative_id=rid)
+                    for i, rid in enumerate([2, None, 1, 2, None, 3])]
+        Channel.objects.create(name='Elsewhere', room_uuid=uuid.uuid4(), owner_uuid=uuid.uuid4(), relative_id=1)
+
+        expected = sorted((c for c in channels if c.relative_id is not None), key=lambda c: (c.relative_id, c.id))
+        expected += sorted((c for c in channels if c.relative_id is None), key=lambda c: c.id)
+        for page_size in (1, 2, 4):
+            self.assertEqual(self.walk(f'/api/channels/room/{room_uuid}/?page_size={page_size}'), [c.id for c in expected])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('not-base64!', 'WzFd', 'WyJub3QgYSBkYXRlIiwgIngiXQ=='):
+            self.assertEqual(self.client.get(f'/api/rooms/?cursor={cursor}').status_code, 404)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('erin', 'erin@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(name='Study', owner_uuid=self.user.userprofile.uuid, description='x' * 1000,
+                                        members_uuids=[str(uuid.uuid4()), str(uuid.uuid4())], tags=['math'])
+
+    def listed(self, **params):
+        response = self.client.get('/api/rooms/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['results'][0]
+
+    def room_selects(self, **params):
+        # The keyset paginator reads rooms with and without last_active in separate queries
+        with CaptureQueriesContext(connection) as queries:
+            self.listed(**params)
+        selects = [query['sql'] for query in queries if query['sql'].startswith('SELECT') and 'FROM "core_room"' in query['sql']]
+        self.assertTrue(selects)
+        return selects
+
+    def test_lists_show_counts_and_details_show_arrays(self):
+        listed = self.listed()
+        self.assertEqual(listed['members_count'], 2)
+        self.assertNotIn('members_uuids', listed)
+        detail = self.client.get(f'/api/rooms/{self.room.pk}/').json()
+        self.assertEqual(len(detail['members_uuids']), 2)
+        self.assertNotIn('members_count', detail)
+
+    def test_fields_and_omit_shape_the_response(self):
+        self.assertEqual(set(self.listed(fields='id,name,members_count')), {'id', 'name', 'members_count'})
+        self.assertEqual(set(self.listed(fields='id,members_uuids')), {'id', 'members_uuids'})
+        self.assertEqual(set(self.listed(fields='id,name,tags', omit='tags')), {'id', 'name'})
+        omitted = self.listed(omit='description,tags')
+        self.assertNotIn('description', omitted)
+        self.assertNotIn('tags', omitted)
+        self.assertEqual(omitted['name'], 'Study')
+
+    def test_unknown_names_are_ignored(self):
+        self.assertEqual(set(self.listed(fields='id,bogus')), {'id'})
+        self.assertEqual(self.listed(omit='bogus'), self.listed())
+
+    def test_unrequested_columns_are_not_selected(self):
+        for sql in self.room_selects(fields='id,name,members_count'):
+            # members_count is counted in SQL, so the array is only read inside JSON_ARRAY_LENGTH
+            self.assertIn('JSON_ARRAY_LENGTH("core_room"."members_uuids")', sql)
+            self.assertEqual(sql.count('"core_room"."members_uuids"'), 1)
+            self.assertIn('"core_room"."last_active"', sql)  # The cursor's ordering field is always loaded
+            for column in ('description', 'tags', 'files', 'latest_message'):
+                self.assertNotIn(f'"core_room"."{column}"', sql)
+
+        for sql in self.room_selects(omit='description'):
+            self.assertNotIn('"core_room"."description"', sql)
+            self.assertIn('"core_room"."tags"', sql)
+
+
+class BatchLookupTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', 'frank@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.rooms = [Room.objects.create(name=f'Room {i}', owner_uuid=self.user.userprofile.uuid) for i in range(3)]
+        profile_usernames.clear()
+        self.addCleanup(profile_usernames.clear)
+
+    def ids(self, *values):
+        return ','.join(str(value) for value in values)
+
+    def test_rooms_come_back_in_request_order_in_one_query(self):
+        unknown = uuid.uuid4()
+        first, second, third = self.rooms
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/rooms/batch/', {'ids': self.ids(third.pk, unknown, first.pk, third.pk)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([room['id'] for room in response.data['results']], [str(third.pk), str(first.pk)])
+        self.assertEqual(response.data['missing'], [str(unknown)])
+
+    def test_channels_come_back_in_one_query(self):
+        channels = [Channel.objects.create(name=f'Channel {i}', room_uuid=self.rooms[0].pk, owner_uuid=uuid.uuid4())
+                    for i in range(2)]
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/channels/batch/', {'uuids': self.ids(channels[1].uuid, channels[0].uuid)})
+        self.assertEqual([channel['uuid'] for channel in response.data['results']],
+                         [str(channels[1].uuid), str(channels[0].uuid)])
+        self.assertEqual(response.data['missing'], [])
+
+    def test_bad_id_lists_are_rejected_without_a_query(self):
+        too_many = self.ids(*(uuid.uuid4() for _ in range(201)))
+        for url, params, error in (
+            ('/api/rooms/batch/', {}, 'ids is required'),
+            ('/api/rooms/batch/', {'ids': f'{self.rooms[0].pk},not-a-uuid'}, 'ids must be comma-separated UUIDs'),
+            ('/api/rooms/batch/', {'ids': too_many}, 'At most 200 ids per request'),
+            ('/api/channels/batch/', {'uuids': too_many}, 'At most 200 uuids per request'),
+            ('/api/users/resolve/', {'uuids': '12345'}, 'uuids must be comma-separated UUIDs'),
+            ('/api/users/resolve/', {'uuids': too_many}, 'At most 200 uuids per request'),
+        ):
+            with self.assertNumQueries(0):
+                response = self.client.get(url, params)
+            self.assertEqual((response.status_code, response.data), (400, {'error': error}), url)
+
+        limit = self.ids(*(uuid.uuid4() for _ in range(200)))
+        self.assertEqual(self.client.get('/api/rooms/batch/', {'ids': limit}).status_code, 200)
+
+    def test_resolve_caches_usernames_until_a_rename(self):
+        other = User.objects.create_user('grace', 'grace@example.com', 'S3cure-Passw0rd!')
+        profiles = [self.user.userprofile.uuid, other.userprofile.uuid]
+        unknown = uuid.uuid4()
+        params = {'uuids': self.ids(*profiles, unknown)}
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/resolve/', params)
+        self.assertEqual(response.data['results'], {str(profiles[0]): 'frank', str(profiles[1]): 'grace'})
+        self.assertEqual(response.data['missing'], [str(unknown)])
+        with self.assertNumQueries(0):
+            self.client.get('/api/users/resolve/', {'uuids': self.ids(*profiles)})
+
+        other.username = 'grace2'
+        other.save()
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/users/resolve/', {'uuids': self.ids(*profiles)})
+        self.assertEqual(response.data['results'][str(profiles[1])], 'grace2')
+
+    def test_resolved_usernames_expire(self):
+        profile = self.user.userprofile.uuid
+        with mock.patch.object(profile_usernames, 'ttl', -1):
+            resolve_usernames([profile])
+            with self.assertNumQueries(1):
+                self.assertEqual(resolve_usernames([profile]), {profile: 'frank'})
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PublicRoomsCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('heidi', 'heidi@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(name='Study', owner_uuid=self.user.userprofile.uuid)
+        Room.objects.create(name='Den', owner_uuid=self.user.userprofile.uuid, visibility='private')
+
+    def public_names(self, **extra):
+        response = self.client.get('/api/rooms/public/', **extra)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [room['name'] for room in response.json()['results']]
+
+    def test_cached_pages_are_served_without_queries(self):
+        self.assertEqual(self.public_names(), ['Study'])
+        with self.assertNumQueries(0):
+            self.assertEqual(self.public_names(), ['Study'])
+            # The key is the path, so another Host header doesn't add an entry
+            self.assertEqual(self.public_names(HTTP_HOST='other.example'), ['Study'])
+        # The query string still is part of the key
+        self.assertEqual(self.client.get('/api/rooms/public/', {'fields': 'name'}).json()['results'], [{'name': 'Study'}])
+
+    def test_room_saves_and_deletes_invalidate_the_cache(self):
+        self.assertEqual(self.public_names(), ['Study'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.name = 'Renamed'
+            self.room.save()
+        self.assertEqual(self.public_names(), ['Renamed'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Room.objects.create(name='Lounge', owner_uuid=self.user.userprofile.uuid)
+        self.assertEqual(sorted(self.public_names()), ['Lounge', 'Renamed'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room.delete()
+        self.assertEqual(self.public_names(), ['Lounge'])
+
+
+class MemberBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.room = Room.objects.create(name='Study', owner_uuid=self.user.userprofile.uuid)
+
+    def interfere(self, times):
+        # Another writer adds a member between each read and the compare-and-swap, up to times times
+        writes = iter(range(times))
+        select_for_update = Room.objects.select_for_update
+
+        def get(**kwargs):
+            instance = select_for_update().get(**kwargs)
+            if next(writes, None) is not None:
+                Room.objects.filter(pk=instance.pk).update(
+                    members_uuids=instance.members_uuids + [str(uuid.uuid4())],
+                    last_updated=timezone.now() + datetime.timedelta(seconds=1),
+                )
+            return instance
+        return mock.patch.object(Room.objects, 'select_for_update', return_value=mock.Mock(get=get))
+
+    def test_concurrent_update_is_retried_without_losing_either_write(self):
+        added = uuid.uuid4()
+        with self.interfere(times=1):
+            room = apply_member_batch(Room, self.room.pk, add=[added])
+
+        members = Room.objects.get(pk=self.room.pk).members_uuids
+        self.assertEqual(len(members), 2)  # The other writer's member and ours
+        self.assertEqual(members[-1], str(added))
+        self.assertEqual(room.members_uuids, members)
+        self.assertTrue(RoomMembership.objects.filter(room=self.room, member_uuid=added).exists())
+
+    def test_endless_conflicts_give_up_with_409(self):
+        with self.interfere(times=5), self.assertRaises(MembershipConflict):
+            apply_member_batch(Room, self.room.pk, add=[uuid.uuid4()], retries=5)
+        with self.interfere(times=5):
+            response = self.client.post(f'/api/rooms/{self.room.pk}/members:batch/', {'add': [str(uuid.uuid4())]}, format='json')
+        self.assertEqual(response.status_code, 409)
+
+    def test_unknown_or_malformed_ids_are_not_found(self):
+        body = {'add': [str(uuid.uuid4())]}
+        for url in (f'/api/rooms/{uuid.uuid4()}/members:batch/', '/api/rooms/not-a-uuid/members:batch/',
+                    '/api/channels/12345/members:batch/', '/api/channels/abc/members:batch/'):
+            self.assertEqual(self.client.post(url, body, format='json').status_code, 404, url)
+
+    def test_other_errors_are_not_reported_as_not_found(self):
+        with mock.patch('core.views.apply_member_batch', side_effect=ValueError('bug')), self.assertRaises(ValueError):
+            self.client.post(f'/api/rooms/{self.room.pk}/members:batch/', {'add': [str(uuid.uuid4())]}, format='json')
+
+
+class RoomMembershipTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('ivan', 'ivan@example.com', 'S3cure-Passw0rd!')
+        self.member = User.objects.create_user('judy', 'judy@example.com', 'S3cure-Passw0rd!')
+        self.client = APIClient()
+        self.client.force_authenticate(self.owner)
+        self.room = Room.objects.create(name='Study', owner_uuid=self.owner.userprofile.uuid)
+
+    def user_room_names(self, user):
+        response = self.client.get(f'/api/rooms/user/{user.pk}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return sorted(room['name'] for room in response.json())
+
+    def test_user_rooms_follow_membership_changes(self):
+        member_uuid = str(self.member.userprofile.uuid)
+        self.assertEqual(self.user_room_names(self.owner), ['Study'])
+        self.assertEqual(self.user_room_names(self.member), [])
+
+        self.client.post(f'/api/rooms/{self.room.pk}/members:batch/', {'add': [member_uuid]}, format='json')
+        self.assertEqual(self.user_room_names(self.member), ['Study'])
+        Room.objects.create(name='Lounge', owner_uuid=uuid.uuid4(), members_uuids=[member_uuid])
+        self.assertEqual(self.user_room_names(self.member), ['Lounge', 'Study'])
+
+        self.client.post(f'/api/rooms/{self.room.pk}/members:batch/', {'remove': [member_uuid]}, format='json')
+        self.assertEqual(self.user_room_names(self.member), ['Lounge'])
+        self.room.delete()
+        self.assertEqual(self.user_room_names(self.owner), [])
+        self.assertEqual(self.client.get('/api/rooms/user/999999/').status_code, 404)
+
+    def test_backfill_indexes_existing_rooms(self):
+        backfill = importlib.import_module('core.migrations.0002_room_membership').backfill_room_memberships
+        member_uuid = self.member.userprofile.uuid
+        owner_uuid = self.owner.userprofile.uuid
+        # The owner listed as a member too, and an entry that isn't a UUID
+        Room.objects.create(name='Lounge', owner_uuid=owner_uuid, members_uuids=[str(member_uuid), str(owner_uuid), 'junk'])
+        RoomMembership.objects.all().delete()
+
+        backfill(apps, None)
+        self.assertEqual(
+            sorted(RoomMembership.objects.values_list('room__name', 'member_uuid', 'role')),
+            sorted([('Study', owner_uuid, 'owner'), ('Lounge', owner_uuid, 'owner'), ('Lounge', member_uuid, 'member')]),
+        )
+        self.assertEqual(self.user_room_names(self.member), ['Lounge'])
+
+
+class ChannelProvisioningTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user('kim', 'kim@example.com', 'S3cure-Passw0rd!')
+        owner_uuid = self.owner.userprofile.uuid
+        self.rooms = sorted((Room.objects.create(name=f'Room {i}', owner_uuid=owner_uuid) for i in range(3)),
+                            key=lambda room: room.id)
+        self.orphan = Room.objects.create(name='Orphan', owner_uuid=uuid.uuid4())
+
+    def provision(self, command, *args):
+        call_command(command, *args, '--batch-size=2', stdout=io.StringIO())
+        return {room.pk: room for room in Room.objects.all()}
+
+    def room_state(self):
+        return list(Room.objects.order_by('id').values('channel_ids', 'members_uuids', 'last_updated'))
+
+    def test_update_room_members_references_new_channels_by_id(self):
+        rooms = self.provision('update_room_members')
+        for room in self.rooms:
+            channel = Channel.objects.get(room_uuid=room.pk)
+            # bulk_create must have set the primary keys, or this would be [None]
+            self.assertEqual(rooms[room.pk].channel_ids, [channel.id])
+            self.assertEqual(rooms[room.pk].members_uuids, [str(self.owner.userprofile.uuid)])
+            self.assertTrue(RoomMembership.objects.filter(room=room, member_uuid=self.owner.userprofile.uuid).exists())
+        self.assertEqual(rooms[self.orphan.pk].channel_ids, [])
+
+    def test_reruns_change_nothing(self):
+        self.provision('update_room_members')
+        first = self.room_state()
+        self.provision('update_room_members')
+        self.assertEqual(self.room_state(), first)
+        self.assertEqual(Channel.objects.count(), 3)
+
+        # create_default_channels always adds a fresh Intro channel, but the room still references only that one
+        self.provision('create_default_channels')
+        rooms = self.provision('create_default_channels')
+        for room in self.rooms:
+            newest = Channel.objects.filter(room_uuid=room.pk).latest('id')
+            self.assertEqual(rooms[room.pk].channel_ids, [str(newest.uuid)])
+            self.assertEqual(rooms[room.pk].members_uuids, [str(self.owner.userprofile.uuid)])
+
+    def test_dry_run_rolls_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            before = {room.pk: room.channel_ids for room in Room.objects.all()}
+            self.provision('update_room_members', '--dry-run', f'--checkpoint={checkpoint}')
+            self.assertEqual({room.pk: room.channel_ids for room in Room.objects.all()}, before)
+            self.assertFalse(Channel.objects.exists())
+            self.assertFalse(os.path.exists(checkpoint))
+
+    def test_checkpoint_resumes_after_an_interruption(self):
+        provision = DefaultChannelProvisioner._provision
+        batches = []
+
+        def interrupted(provisioner, batch):
+            if batches:
+                raise RuntimeError('interrupted')
+            batches.append(batch)
+            provision(provisioner, batch)
+
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, 'checkpoint.json')
+            with mock.patch.object(DefaultChannelProvisioner, '_provision', interrupted), self.assertRaises(RuntimeError):
+                self.provision('create_default_channels', f'--checkpoint={checkpoint}')
+            with open(checkpoint) as handle:
+                self.assertEqual(json.load(handle)['last_room_id'], str(batches[0][-1].id))
+
+            out = io.StringIO()
+            call_command('create_default_channels', '--batch-size=2', f'--checkpoint={checkpoint}', stdout=out)
+            self.assertIn(f'Resuming after room {batches[0][-1].id}.', out.getvalue())
+            self.assertFalse(os.path.exists(checkpoint))
+        # Each room was provisioned by exactly one of the two runs
+        for room in self.rooms:
+            self.assertEqual(Channel.objects.filter(room_uuid=room.pk).count(), 1)
+
+
+class AdminChangeListTests(TestCase):
+    def setUp(self):
+        self.admin_user = User.objects.create_superuser('leo', 'leo@example.com', 'S3cure-Passw0rd!')
+        self.client.force_login(self.admin_user)
+        owner = self.admin_user.userprofile.uuid
+        self.rooms = [Room.objects.create(name=f'Room {i}', owner_uuid=owner) for i in range(20)]
+
+    def test_counts_are_capped_from_the_requested_page(self):
+        rooms = Room.objects.order_by('id')
+        with mock.patch.object(CappedCountPaginator, 'count_cap', 5):
+            self.assertEqual(CappedCountPaginator(rooms, 2, page_number=1).count, 5)
+            # Deep pages count from their own start, so the next page stays reachable
+            self.assertEqual(CappedCountPaginator(rooms, 2, page_number=8).count, 19)
+            self.assertEqual(CappedCountPaginator(rooms, 2, page_number=9).count, 20)
+            with CaptureQueriesContext(connection) as queries:
+                CappedCountPaginator(rooms, 2, page_number=8).count
+            self.assertEqual(len(queries), 1)
+            self.assertIn('LIMIT 5 OFFSET 14', queries[0]['sql'])
+
+            with mock.patch.object(admin.site._registry[Room], 'list_per_page', 5):
+                first = self.client.get('/admin/core/room/')
+                last = self.client.get('/admin/core/room/', {'p': 4})
+            self.assertEqual(first.context['cl'].result_count, 5)
+            self.assertEqual(last.status_code, 200)
+            self.assertEqual(last.context['cl'].result_count, 20)  # 15 rows before page 4, then the cap's 5
+
+    def test_channel_changelist_queries_do_not_grow_with_the_page(self):
+        owners = [User.objects.create_user(f'owner{i}', f'owner{i}@example.com', 'S3cure-Passw0rd!') for i in range(5)]
+        for i in range(40):
+            Channel.objects.create(name=f'Channel {i}', room_uuid=self.rooms[i % 20].pk,
+                                   owner_uuid=owners[i % 5].userprofile.uuid)
+
+        def queries_for(per_page):
+            with mock.patch.object(admin.site._registry[Channel], 'list_per_page', per_page), \
+                    CaptureQueriesContext(connection) as queries:
+                response = self.client.get('/admin/core/channel/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['cl'].result_list), per_page)
+            self.assertNotContains(response, 'Room Not Found')
+            self.assertNotContains(response, 'User Not Found')
+            return len(queries)
+
+        self.assertEqual(queries_for(5), queries_for(40))
+
+
+class IncrementalRenumberTests(TestCase):
+    def test_deleting_a_channel_renumbers_its_room(self):
+        room = Room.objects.create(name='Study', owner_uuid=uuid.uuid4())
+        channels = [Channel.objects.create(name=f'Channel {i}', room_uuid=room.id, owner_uuid=room.owner_uuid)
+                    for i in range(4)]
+        with tempfile.TemporaryDirectory() as directory:
+            state_file = os.path.join(directory, 'state.json')
+            call_command('update_channels', '--incremental', '--state-file', state_file, stdout=io.StringIO())
+            self.assertEqual(sorted(Channel.objects.values_list('relative_id', flat=True)), [1, 2, 3, 4])
+
+            channels[0].delete()
+            Channel.objects.filter(pk=channels[2].pk).delete()  # Queryset deletes skip signals but not the trigger
+            self.assertEqual(ChannelDeletion.objects.count(), 2)
+
+            call_command('update_channels', '--incremental', '--state-file', state_file, stdout=io.StringIO())
+        self.assertEqual(list(Channel.objects.order_by('created_at').values_list('id', 'relative_id')),
+                         [(channels[1].id, 1), (channels[3].id, 2)])
+        self.assertFalse(ChannelDeletion.objects.exists())
+
+
+class StubMailerLite:
+    """A local HTTP server standing in for the MailerLite API.
+
+    Answers with the scripted (status, headers) responses in order, then 200s.
+    While gate is cleared every request waits for it, which holds a pipeline's
+    worker busy.
+    """
+
+    def __init__(self, responses=()):
+        self.responses = list(responses)
+        self.requests = []
+        self.received = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                stub.requests.append({'body': body, 'headers': dict(self.headers), 'at': time.monotonic()})
+                stub.received.set()
+                stub.gate.wait(10)
+                status, headers = stub.responses.pop(0) if stub.responses else (200, {})
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'{}')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/send'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def recipients(self):
+        return [[recipient['email'] for recipient in request['body']['recipients']] for request in self.requests]
+
+
+class MailerLiteDeliveryTests(SimpleTestCase):
+    def stub(self, responses=()):
+        stub = StubMailerLite(responses)
+        self.addCleanup(stub.close)
+        return stub
+
+    def client_for(self, stub, **kwargs):
+        return MailerLiteClient('test-key', url=stub.url, **dict({'backoff': 0.01, 'timeout': 5}, **kwargs))
+
+    def test_retries_429_and_5xx_honouring_retry_after(self):
+        stub = self.stub([(429, {'Retry-After': '0.3'}), (503, {}), (200, {})])
+        self.assertTrue(self.client_for(stub).send('Hi', 'Body', ['a@example.com']))
+
+        self.assertEqual(len(stub.requests), 3)
+        self.assertGreaterEqual(stub.requests[1]['at'] - stub.requests[0]['at'], 0.3)
+        self.assertEqual(stub.requests[0]['headers']['Authorization'], 'Bearer test-key')
+        self.assertEqual(stub.requests[0]['body'], {'subject': 'Hi', 'content': 'Body', 'recipients': [{'email': 'a@example.com'}]})
+
+    def test_gives_up_after_max_retries_and_on_client_errors(self):
+        stub = self.stub([(500, {})] * 3 + [(400, {})])
+        client = self.client_for(stub, max_retries=2)
+        self.assertFalse(client.send('Hi', 'Body', ['a@example.com']))
+        self.assertEqual(len(stub.requests), 3)
+        self.assertFalse(client.send('Hi', 'Body', ['a@example.com']))  # 400 is not retried
+        self.assertEqual(len(stub.requests), 4)
+
+    def hold_worker(self, stub, pipeline):
+        # Park the single worker inside a request so later submissions pile up in the queue
+        stub.gate.clear()
+        pipeline.submit('First', 'Body', ['first@example.com'])
+        self.assertTrue(stub.received.wait(5))
+
+    def test_queued_messages_are_merged_into_batches(self):
+        stub = self.stub()
+        pipeline = DeliveryPipeline(self.client_for(stub), workers=1, batch_size=4)
+        self.hold_worker(stub, pipeline)
+        for i in range(5):
+            pipeline.submit('Welcome', 'Body', [f'a{i}@example.com'])
+        pipeline.submit('Other', 'Body', [f'b{i}@example.com' for i in range(6)])
+        stub.gate.set()
+        self.assertTrue(pipeline.drain(timeout=5))
+
+        # Up to batch_size queued messages per pass, merged by subject and body, at most batch_size recipients per call
+        self.assertEqual(stub.recipients(), [
+            ['first@example.com'],
+            ['a0@example.com', 'a1@example.com', 'a2@example.com', 'a3@example.com'],
+            ['a4@example.com'],
+            ['b0@example.com', 'b1@example.com', 'b2@example.com', 'b3@example.com'],
+            ['b4@example.com', 'b5@example.com'],
+        ])
+
+    def test_full_queue_pushes_back_on_senders(self):
+        stub = self.stub()
+        pipeline = DeliveryPipeline(self.client_for(stub), queue_size=1, workers=1, enqueue_timeout=0.05)
+        self.hold_worker(stub, pipeline)
+        pipeline.submit('Queued', 'Body', ['queued@example.com'])
+        started = time.monotonic()
+        with self.assertRaises(DeliveryQueueFull):
+            pipeline.submit('Dropped', 'Body', ['dropped@example.com'])
+        self.assertLess(time.monotonic() - started, 1)
+
+        stub.gate.set()
+        self.assertTrue(pipeline.drain(timeout=5))
+        self.assertEqual(stub.recipients(), [['first@example.com'], ['queued@example.com']])
+
+    def test_exit_drains_queued_mail_within_the_shutdown_timeout(self):
+        stub = self.stub()
+        pipeline = DeliveryPipeline(self.client_for(stub), workers=1)
+        self.hold_worker(stub, pipeline)
+        pipeline.submit('Queued', 'Body', ['queued@example.com'])
+
+        with mock.patch.object(mailerlite_backend, '_pipeline', pipeline):
+            with override_settings(MAILERLITE_SHUTDOWN_TIMEOUT=0.2):
+                started = time.monotonic()
+                mailerlite_backend._drain_on_exit()  # The worker is still blocked: gives up at the timeout
+                self.assertLess(time.monotonic() - started, 2)
+            self.assertEqual(len(stub.requests), 1)
+
+            threading.Timer(0.2, stub.gate.set).start()
+            mailerlite_backend._drain_on_exit()
+        self.assertEqual(stub.recipients(), [['first@example.com'], ['queued@example.com']])
+
+
+class OutboxClaimTests(TestCase):
+    class Connection:
+        # Stands in for the MailerLite backend; run() is called during each send
+        def __init__(self, run=None):
+            self.sent, self.run = [], run
+
+        def send_messages(self, messages):
+            if self.run:
+                self.run()
+            self.sent.extend(message.to[0] for message in messages)
+            return len(messages)
+
+    def test_emails_reclaimed_by_another_worker_are_not_sent_or_overwritten(self):
+        for i in range(3):
+            OutboxEmail.objects.create(subject='Hi', body='Body', recipient=f'user{i}@example.com')
+        emails = claim_batch('worker-a', batch_size=3)
+        first, second, third = emails
+
+        def lease_expires():
+            # While worker-a sends the first email, worker-b reclaims the second, and the third's claim goes stale
+            if not connection.sent:
+                OutboxEmail.objects.filter(pk=second.pk).update(claimed_by='worker-b')
+                OutboxEmail.objects.filter(pk=third.pk).update(claimed_at=timezone.now() - datetime.timedelta(hours=1))
+
+        connection = self.Connection(lease_expires)
+        self.assertEqual(deliver_batch(emails, connection=connection), (2, 0))
+        self.assertEqual(connection.sent, ['user0@example.com', 'user2@example.com'])
+
+        # worker-b still owns the second email; the third was renewed before sending, so nobody else could take it
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.claimed_by, second.attempts), (OutboxEmail.STATUS_SENDING, 'worker-b', 0))
+        self.assertEqual(OutboxEmail.objects.filter(status=OutboxEmail.STATUS_SENT).count(), 2)
+
+    def test_a_stale_worker_does_not_overwrite_the_new_owner(self):
+        OutboxEmail.objects.create(subject='Hi', body='Body', recipient='user@example.com')
+        emails = claim_batch('worker-a')
+
+        def reclaimed_mid_send():
+            OutboxEmail.objects.filter(pk=emails[0].pk).update(claimed_by='worker-b')
+
+        deliver_batch(emails, connection=self.Connection(reclaimed_mid_send))
+        email = OutboxEmail.objects.get()
+        self.assertEqual((email.status, email.claimed_by, email.attempts), (OutboxEmail.STATUS_SENDING, 'worker-b', 0))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class UsernameIndexTests(TestCase):
+    def setUp(self):
+        User.objects.create_user('frank', 'frank@example.com', 'S3cure-Passw0rd!')
+        self.index = UsernameIndex(refresh_interval=3600, rebuild_interval=3600)
+        self.index.warm()
+
+    def test_free_names_are_answered_without_a_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.check('frances'), (True, []))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.check('frank'), (False, ['frank1', 'frank2', 'frank3']))
+
+    def test_stale_entries_are_dropped_when_the_database_disagrees(self):
+        User.objects.filter(username='frank').update(username='franklin')  # Skips the signals
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.check('frank'), (True, []))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.index.is_taken('frank'))
+
+    def test_renames_elsewhere_trigger_a_rebuild(self):
+        # self.index stands in for another worker's: the signals only update the module's username_index
+        user = User.objects.get(username='frank')
+        user.username = 'franklin'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertFalse(self.index.is_taken('franklin'))  # Until the next refresh
+
+        self.index.refresh_interval = 0
+        with mock.patch.object(self.index, '_rebuild_in_background', self.index.warm):
+            self.assertTrue(self.index.is_taken('franklin'))
+        self.assertFalse(self.index.is_taken('frank'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        with mock.patch.object(self.index, '_rebuild_in_background', self.index.warm):
+            self.assertFalse(self.index.is_taken('franklin'))
+
+    def test_overfull_filter_is_rebuilt_off_the_request_thread(self):
+        self.index._stale = True
+        with mock.patch.object(self.index, 'warm') as warm, self.assertLogs('core.usernames', level='ERROR') as logs:
+            warm.side_effect = RuntimeError('boom')
+            self.assertFalse(self.index.is_taken('frances'))
+            for _ in range(100):
+                if not self.index._rebuilding:
+                    break
+                time.sleep(0.01)
+        warm.assert_called_once()
+        self.assertIn('Failed to rebuild the username index', logs.output[0])
+
+
+class ChannelSocketTests(TransactionTestCase):
+    # Transactional so post_message's on_commit fan-out actually runs
+    application = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    def setUp(self):
+        self.owner = User.objects.create_user('ivan', 'ivan@example.com', 'S3cure-Passw0rd!')
+        self.member = User.objects.create_user('judy', 'judy@example.com', 'S3cure-Passw0rd!')
+        self.outsider = User.objects.create_user('mallory', 'mallory@example.com', 'S3cure-Passw0rd!')
+        self.room = Room.objects.create(name='Study', owner_uuid=self.owner.userprofile.uuid)
+        self.channel = Channel.objects.create(
+            name='General', room_uuid=self.room.id, owner_uuid=self.owner.userprofile.uuid,
+            members_uuids=[str(self.member.userprofile.uuid)],
+        )
+
+    def tearDown(self):
+        # Fan-out records activity; write it before the tables are emptied, so the flush thread has nothing left
+        activity_buffer.flush()
+
+    def socket(self, user=None, token=None, channel_uuid=None):
+        if user is not None:
+            token = str(VersionedRefreshToken.for_user(user).access_token)
+        path = f'/ws/channels/{channel_uuid or self.channel.uuid}/'
+        return WebsocketCommunicator(self.application, path + (f'?token={token}' if token else ''))
+
+    async def assertClosedWith(self, socket, code):
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)  # Accepted first, so the close code reaches the client
+        self.assertEqual(await socket.receive_output(timeout=5), {'type': 'websocket.close', 'code': code})
+
+    async def test_connect_checks_the_jwt_and_membership(self):
+        await self.assertClosedWith(self.socket(), 4401)
+        await self.assertClosedWith(self.socket(token='not-a-jwt'), 4401)
+        await self.assertClosedWith(self.socket(self.outsider), 4403)
+        await self.assertClosedWith(self.socket(self.member, channel_uuid=uuid.uuid4()), 4404)
+
+        socket = self.socket(self.member)
+        self.assertEqual(await socket.connect(), (True, None))
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    async def test_tokens_without_a_user_version_still_connect(self):
+        # As minted from refresh tokens issued before versioning; connect() reads the profile on the event loop
+        def legacy_token(user):
+            return str(RefreshToken.for_user(user).access_token)
+
+        token = await database_sync_to_async(legacy_token)(self.outsider)
+        await self.assertClosedWith(self.socket(token=token), 4403)
+        socket = self.socket(token=await database_sync_to_async(legacy_token)(self.member))
+        self.assertEqual(await socket.connect(), (True, None))
+        self.assertTrue(await socket.receive_nothing())
+        await socket.disconnect()
+
+    async def test_messages_fan_out_to_every_subscriber(self):
+        owner, member = self.socket(self.owner), self.socket(self.member)
+        for socket in (owner, member):
+            self.assertEqual(await socket.connect(), (True, None))
+
+        await member.send_json_to({'body': 'Hello'})
+        await member.send_json_to({'body': 'Again'})
+        for socket in (owner, member):  # The sender gets its own messages back, with their sequences
+            first, second = await socket.receive_json_from(timeout=5), await socket.receive_json_from(timeout=5)
+            self.assertEqual((first['sequence'], first['body'], first['sender_uuid']),
+                             (1, 'Hello', str(self.member.userprofile.uuid)))
+            self.assertEqual((second['sequence'], second['body']), (2, 'Again'))
+
+        await member.send_json_to({'text': 'no body'})
+        self.assertIn('error', await member.receive_json_from(timeout=5))
+        self.assertTrue(await owner.receive_nothing())
+        for socket in (owner, member):
+            await socket.disconnect()
+
+    async def heartbeat(self):
+        socket = self.socket(self.member)
+        await socket.connect()
+        await socket.send_json_to({'type': 'heartbeat'})
+        await socket.send_json_to({})  # Answered with an error once the heartbeat before it has been handled
+        self.assertIn('error', await socket.receive_json_from(timeout=5))
+        await socket.disconnect()
+
+    async def test_heartbeat_is_buffered(self):
+        with mock.patch.object(activity_buffer, '_ensure_thread'), mock.patch.dict(activity_buffer._pending, clear=True):
+            await self.heartbeat()
+            self.assertIsNotNone(activity_buffer.pending(self.room.id))
+        room = await database_sync_to_async(Room.objects.get)(pk=self.room.pk)
+        self.assertIsNone(room.last_active)
+
+    async def test_heartbeat_writes_through_without_a_flush_interval(self):
+        with mock.patch.object(activity_buffer, 'flush_interval', 0):
+            await self.heartbeat()
+        room = await database_sync_to_async(Room.objects.get)(pk=self.room.pk)
+        self.assertIsNotNone(room.last_active)
+
+
+class ActivityBufferTests(TestCase):
+    def setUp(self):
+        self.public = Room.objects.create(name='Lobby', owner_uuid=uuid.uuid4())
+        self.private = Room.objects.create(name='Den', owner_uuid=uuid.uuid4(), visibility='private')
+        self.buffer = ActivityBuffer(flush_interval=3600, cache_bump_interval=30)
+        mock.patch.object(self.buffer, '_ensure_thread').start()
+        self.bump = mock.patch.object(public_rooms_cache, 'bump').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def test_flush_writes_activity_and_last_updated(self):
+        before = Room.objects.get(pk=self.public.pk).last_updated
+        now = timezone.now()
+        self.buffer.record(self.public.pk, now, 'Hello')
+        self.buffer.record(self.private.pk, now)
+        self.assertEqual(self.buffer.flush(), 2)
+        room = Room.objects.get(pk=self.public.pk)
+        self.assertEqual((room.last_active, room.latest_message), (now, 'Hello'))
+        self.assertGreater(room.last_updated, before)
+        self.assertEqual(Room.objects.get(pk=self.private.pk).last_active, now)
+
+    def test_only_public_activity_bumps_the_cache_and_at_most_once_per_interval(self):
+        self.buffer.record(self.private.pk, timezone.now(), 'Psst')
+        self.buffer.flush()
+        self.bump.assert_not_called()
+
+        self.buffer.record(self.public.pk, timezone.now(), 'Hello')
+        self.buffer.flush()
+        self.buffer.record(self.public.pk, timezone.now(), 'Again')
+        self.buffer.flush()
+        self.assertEqual(self.bump.call_count, 1)
+
+        # The second change is still owed, and goes out with the first flush after the interval
+        with mock.patch('core.activity.time.monotonic', return_value=time.monotonic() + 31):
+            self.buffer.flush()
+        self.assertEqual(self.bump.call_count, 2)
+
+
+class MessageSequenceTests(TestCase):
+    def setUp(self):
+        self.sender = uuid.uuid4()
+        self.channels = [Channel.objects.create(name=f'Channel {i}', room_uuid=uuid.uuid4(), owner_uuid=self.sender)
+                         for i in range(2)]
+
+    def test_each_channel_numbers_its_messages_from_one(self):
+        first, second = (channel.uuid for channel in self.channels)
+        sequences = [(key, post_message(key, self.sender, f'Message {i}').sequence)
+                     for i, key in enumerate([first, second, first, first, second])]
+        self.assertEqual(sequences, [(first, 1), (second, 1), (first, 2), (first, 3), (second, 2)])
+        self.assertEqual(Channel.objects.get(uuid=first).last_sequence, 3)
+
+    def test_rejected_posts_do_not_use_up_a_sequence(self):
+        key = self.channels[0].uuid
+        post_message(key, self.sender, 'First')
+        with self.assertRaises(NotAChannelMember):
+            post_message(key, uuid.uuid4(), 'Intruder')
+        with self.assertRaises(Channel.DoesNotExist):
+            post_message(uuid.uuid4(), self.sender, 'Nowhere')
+        self.assertEqual(post_message(key, self.sender, 'Second').sequence, 2)
+
+    def test_history_pages_in_both_directions(self):
+        key = self.channels[0].uuid
+        for i in range(7):
+            post_message(key, self.sender, f'Message {i + 1}')
+
+        def page(**kwargs):
+            messages, has_more = message_history(key, limit=3, **kwargs)
+            return [message.sequence for message in messages], has_more
+
+        self.assertEqual(page(), ([5, 6, 7], True))
+        self.assertEqual(page(before=5), ([2, 3, 4], True))
+        self.assertEqual(page(before=2), ([1], False))
+        self.assertEqual(page(after=4), ([5, 6, 7], False))
+        self.assertEqual(page(after=0), ([1, 2, 3], True))
+
+
+class RoomSearchTests(TestCase):
+    def setUp(self):
+        self.member = uuid.uuid4()
+        for i in range(5):
+            Room.objects.create(name=f'Filler {i}', owner_uuid=uuid.uuid4())
+        self.chess = Room.objects.create(name='Chess club', description='Openings and endgames', owner_uuid=uuid.uuid4())
+        self.private = Room.objects.create(name='Chess coaching', visibility='private', owner_uuid=self.member)
+        Room.objects.create(name='Chess secrets', visibility='private', owner_uuid=uuid.uuid4())
+
+    def names(self, query, member=None):
+        return sorted(room.name for room in search_rooms(query, member or self.member))
+
+    def test_index_follows_room_writes(self):
+        self.assertEqual(self.names('chess'), ['Chess club', 'Chess coaching'])
+        self.assertEqual(self.names('chess', uuid.uuid4()), ['Chess club'])
+        self.chess.name = 'Go club'
+        self.chess.save()
+        self.assertEqual(self.names('chess'), ['Chess coaching'])
+        self.assertEqual(self.names('endgame'), ['Go club'])
+        Room.objects.filter(pk=self.private.pk).delete()
+        self.assertEqual(self.names('chess'), [])
+
+    def test_index_survives_rowid_changes(self):
+        # As a VACUUM or a table remake may do; no indexed column changes, so no trigger fires
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE core_room SET rowid = -rowid')
+        self.assertEqual(self.names('chess'), ['Chess club', 'Chess coaching'])
+        self.chess.description = 'Tactics'
+        self.chess.save()
+        self.assertEqual(self.names('endgames'), [])
+        self.assertEqual(self.names('tactics'), ['Chess club'])
+
+    @override_settings(SEARCH_MAX_RANKED_MATCHES=0)
+    def test_common_terms_return_recent_matches(self):
+        self.assertEqual(self.names('chess'), ['Chess club', 'Chess coaching'])
+        self.assertEqual(self.names('filler'), [f'Filler {i}' for i in range(5)])
+
+
+class FacetCountIndexTests(TestCase):
+    def setUp(self):
+        # 'chess' is on 70 of 71 rooms, so it passes 1 in 64 and becomes a bitmap; 'go' stays a tuple
+        for i in range(70):
+            Room.objects.create(name=f'Room {i}', owner_uuid=uuid.uuid4(), category='games',
+                                tags=['chess', 'go'] if i == 0 else ['chess'])
+        Room.objects.create(name='Quiet', owner_uuid=uuid.uuid4(), category='music')
+
+    def test_chunked_load_counts_match_the_database(self):
+        index = FacetCountIndex()
+        index.load(chunk_size=7)
+        self.assertIsInstance(index._postings[('tag', 'chess')], int)
+        self.assertIsInstance(index._postings[('tag', 'go')], tuple)
+        counts = index.counts([])
+        self.assertEqual(counts['tag'], [{'value': 'chess', 'count': 70}, {'value': 'go', 'count': 1}])
+        self.assertEqual(counts['category'], [{'value': 'games', 'count': 70}, {'value': 'music', 'count': 1}])
+        filtered = index.counts([('tag', 'go')])
+        self.assertEqual(filtered['tag'], [{'value': 'chess', 'count': 1}, {'value': 'go', 'count': 1}])
+        self.assertEqual(filtered['category'], [{'value': 'games', 'count': 1}])
+
+    def test_rooms_are_numbered_by_their_search_key(self):
+        # core_room's own rowid can change on VACUUM; the search key table's can't
+        index = FacetCountIndex()
+        index.load()
+        room = Room.objects.get(tags=['chess', 'go'])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT fts_rowid FROM core_room_fts_key WHERE room_id = %s', [room.id.hex])
+            self.assertEqual(index._postings[('tag', 'go')], (cursor.fetchone()[0],))
+
+    def test_counts_cover_the_listing_including_private_rooms(self):
+        Room.objects.create(name='Hidden', owner_uuid=uuid.uuid4(), category='music', visibility='private')
+        user = User.objects.create_user(username='facets', password='pw')
+        client = APIClient()
+        client.force_authenticate(user)
+        self.addCleanup(setattr, facet_index, '_postings', facet_index._postings)
+        facet_index.load()
+        response = client.get('/api/rooms/', {'category': 'music'})
+        self.assertEqual({room['name'] for room in response.data['results']}, {'Quiet', 'Hidden'})
+        self.assertEqual(response.data['facets']['category'], [{'value': 'music', 'count': 2}])
+
+    def test_failed_refresh_is_logged(self):
+        index = FacetCountIndex()
+        with mock.patch.object(index, 'load', side_effect=RuntimeError('boom')), \
+                self.assertLogs('core.facets', level='ERROR') as logs:
+            self.assertIsNone(index.current())
+            for _ in range(100):
+                if not index._loading:
+                    break
+                time.sleep(0.01)
+        self.assertIn('Failed to load the facet count index', logs.output[0])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ReadReplicaRoutingTests(TransactionTestCase):
+    # The replica is a second SQLite file that, as with replicate_sqlite, only changes when
+    # the primary is copied into it, so which database answered shows in the response. The
+    # alias only exists while this class runs, so '__all__' rather than naming it.
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.replica_name = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        connections.settings['replica'] = dict(connections['default'].settings_dict, NAME=cls.replica_name)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        os.remove(cls.replica_name)
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'S3cure-Passw0rd!')
+        self.other = User.objects.create_user('bob', 'bob@example.com', 'S3cure-Passw0rd!')
+        self.room = Room.objects.create(name='Study', owner_uuid=self.user.userprofile.uuid)
+        self.replicate()
+
+    def replicate(self):
+        connections['default'].ensure_connection()
+        target = sqlite3.connect(self.replica_name)
+        try:
+            connections['default'].connection.backup(target)
+        finally:
+            target.close()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {VersionedRefreshToken.for_user(user).access_token}')
+        return client
+
+    def room_name(self, client):
+        response = client.get(f'/api/rooms/{self.room.pk}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['name']
+
+    def test_gets_read_the_replica_and_writes_go_to_the_primary(self):
+        client = self.client_for(self.user)
+        Room.objects.filter(pk=self.room.pk).update(name='Renamed elsewhere')
+        self.assertEqual(self.room_name(client), 'Study')
+
+        response = client.patch(f'/api/rooms/{self.room.pk}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Room.objects.using('default').get(pk=self.room.pk).name, 'Renamed')
+        self.assertEqual(Room.objects.using('replica').get(pk=self.room.pk).name, 'Study')
+
+    def test_a_write_pins_the_client_and_the_user_to_the_primary(self):
+        writer = self.client_for(self.user)
+        response = writer.patch(f'/api/rooms/{self.room.pk}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertIn('kwf_primary_until', response.cookies)
+
+        self.assertEqual(self.room_name(writer), 'Renamed')
+        # Another client without the cookie, signed in as the same user
+        self.assertEqual(self.room_name(self.client_for(self.user)), 'Renamed')
+        self.assertEqual(self.room_name(self.client_for(self.other)), 'Study')
+
+        later = time.time() + settings.READ_YOUR_WRITES_SECONDS + 1
+        with mock.patch('core.dbrouting.time.time', return_value=later):
+            self.assertEqual(self.room_name(writer), 'Study')
+            self.assertEqual(self.room_name(self.client_for(self.user)), 'Study')
+
+    def test_public_rooms_cache_is_refilled_from_the_primary(self):
+        reader, writer = self.client_for(self.other), self.client_for(self.user)
+
+        def public_names(client):
+            response = client.get('/api/rooms/public/')
+            self.assertEqual(response.status_code, 200, response.content)
+            return [room['name'] for room in response.json()['results']]
+
+        self.assertEqual(public_names(reader), ['Study'])
+        # The write bumps the cache generation on commit, while the replica still has the old row
+        response = writer.patch(f'/api/rooms/{self.room.pk}/', {'name': 'Renamed'}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(public_names(reader), ['Renamed'])
+        self.assertEqual(public_names(writer), ['Renamed'])
+
+    def test_router_keeps_reads_on_the_primary_in_a_transaction_or_pin(self):
+        self.assertEqual(router.db_for_read(Room), 'default')  # Outside a request
+        alias_token = _read_alias.set('replica')
+        user_token = _read_user.set({'id': self.user.pk})
+        try:
+            self.assertEqual(router.db_for_read(Room), 'replica')
+            with transaction.atomic():
+                self.assertEqual(router.db_for_read(Room), 'default')
+            self.assertEqual(router.db_for_write(Room), 'default')
+
+            pin_user(self.user.pk, 5)
+            self.assertEqual(router.db_for_read(Room), 'replica')  # Looked up once per request
+            _read_user.set({'id': self.user.pk})
+            self.assertEqual(router.db_for_read(Room), 'default')
+        finally:
+            _read_user.reset(user_token)
+            _read_alias.reset(alias_token)
+
+
+class DataTransferTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        owner = User.objects.create_user('olga', 'Olga@Example.com', 'S3cure-Passw0rd!', first_name='Olga')
+        member = User.objects.create_user('pete', 'pete@example.com', 'S3cure-Passw0rd!')
+        self.owner_uuid, member_uuid = owner.userprofile.uuid, member.userprofile.uuid
+        room = Room.objects.create(name='Study', owner_uuid=self.owner_uuid, members_uuids=[str(member_uuid)],
+                                   tags=['Chess', 'go'], category='games', visibility='unlisted',
+                                   last_active=timezone.now())
+        Room.objects.create(name='Lobby', owner_uuid=member_uuid)
+        Channel.objects.create(name='General', room_uuid=room.id, owner_uuid=self.owner_uuid, relative_id=0)
+        # Stamps an export must carry over instead of getting the import's own time
+        long_ago = timezone.now() - datetime.timedelta(days=400)
+        Room.objects.update(created_at=long_ago, last_updated=long_ago)
+        Channel.objects.update(created_at=long_ago, last_updated=long_ago)
+
+    def snapshot(self):
+        return {
+            'profiles': sorted(UserProfile.objects.values_list(
+                'uuid', 'email_normalized', 'user__username', 'user__email', 'user__first_name', 'user__is_active',
+                'user__date_joined', 'user__password')),
+            'rooms': sorted(Room.objects.values_list(), key=repr),
+            'channels': sorted(Channel.objects.values_list(
+                'uuid', 'room_uuid', 'name', 'owner_uuid', 'members_uuids', 'created_at', 'relative_id',
+                'last_updated', 'last_sequence'), key=repr),
+            'memberships': sorted(RoomMembership.objects.values_list('room_id', 'member_uuid', 'role'), key=repr),
+            'facets': sorted(RoomFacet.objects.values_list('room_id', 'facet', 'value'), key=repr),
+        }
+
+    def round_trip(self, name):
+        path = os.path.join(self.directory.name, name)
+        before = self.snapshot()
+        call_command('export_data', path, '--include-passwords', stdout=io.StringIO())
+        call_command('flush', interactive=False, verbosity=0)
+        self.assertEqual(Room.objects.count() + User.objects.count() + RoomMembership.objects.count(), 0)
+        call_command('import_data', path, '--batch-size', '1', stdout=io.StringIO())
+        self.assertEqual(self.snapshot(), before)
+        return path
+
+    def test_round_trip_restores_rows_stamps_and_derived_tables(self):
+        self.round_trip('export.ndjson')
+        self.assertEqual(len(self.snapshot()['memberships']), 3)
+        self.assertTrue(self.client.login(username='olga', password='S3cure-Passw0rd!'))
+
+    def test_round_trip_through_gzip(self):
+        path = self.round_trip('export.ndjson.gz')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(2), b'\x1f\x8b')
+
+    def test_reimporting_existing_ids_skips_or_updates(self):
+        path = os.path.join(self.directory.name, 'export.ndjson')
+        call_command('export_data', path, stdout=io.StringIO())
+        Room.objects.filter(name='Study').update(name='Renamed')
+        User.objects.filter(username='olga').update(first_name='Changed', username='olga2')
+        before = self.snapshot()
+
+        importer = Importer()
+        with open(path, 'rb') as f:
+            importer.add_lines(open_ndjson(f))
+        counts = importer.finish()
+        self.assertEqual((counts['rooms skipped'], counts['channels skipped'], counts['profiles skipped']), (2, 1, 2))
+        self.assertEqual(self.snapshot(), before)
+
+        importer = Importer(on_conflict='update')
+        with open(path, 'rb') as f:
+            importer.add_lines(open_ndjson(f))
+        counts = importer.finish()
+        self.assertEqual((counts['rooms updated'], counts['channels updated'], counts['profiles updated']), (2, 1, 2))
+        self.assertTrue(Room.objects.filter(name='Study').exists())
+        user = User.objects.get(userprofile__uuid=self.owner_uuid)
+        # Profiles take everything but username and email; without exported hashes the password is kept
+        self.assertEqual((user.username, user.first_name), ('olga2', 'Olga'))
+        self.assertTrue(user.check_password('S3cure-Passw0rd!'))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def write_worker_file(self, name, requests, age=0):
+        # What another worker's flush leaves behind: `requests` successful room-list responses
+        other = MetricsRegistry()
+        for _ in range(requests):
+            other.record('room-list', 'GET', 200, 0.02, 100, 1, 0.001)
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as handle:
+            json.dump([['room-list', 'GET', other.snapshot()[('room-list', 'GET')]]], handle)
+        if age:
+            os.utime(path, (time.time() - age, time.time() - age))
+        return path
+
+    def test_collect_sums_live_workers_and_deletes_dead_ones(self):
+        registry = MetricsRegistry(self.directory.name, flush_interval=3600, stale_after=60)
+        registry.record('room-list', 'GET', 200, 0.02, 100, 1, 0.001)
+        registry.record('room-list', 'GET', 404, 0.02, 100, 1, 0.001)
+        self.write_worker_file('worker_101_1.json', 5)
+        dead = self.write_worker_file('worker_102_1.json', 7, age=120)
+
+        merged = registry.collect()
+        self.assertEqual(merged[('room-list', 'GET')]['requests'], {'2xx': 6, '4xx': 1})
+        self.assertEqual(sum(merged[('room-list', 'GET')]['latency_buckets']), 7)
+        self.assertFalse(os.path.exists(dead))
+
+        registry.remove()
+        self.assertEqual(registry.collect()[('room-list', 'GET')]['requests'], {'2xx': 6, '4xx': 1})
+
+    def test_each_process_start_gets_its_own_file(self):
+        # Same pid, as when the OS reuses a dead worker's: the new registry must not overwrite the old file
+        first, second = (MetricsRegistry(self.directory.name, flush_interval=3600) for _ in range(2))
+        first.flush()
+        second.flush()
+        self.assertNotEqual(first._path, second._path)
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+
+    @override_settings(METRICS_TOKEN='s3cret', METRICS_ALLOWED_IPS=['10.0.0.5'])
+    def test_metrics_are_restricted(self):
+        factory = RequestFactory()
+
+        def status(user=None, **extra):
+            request = factory.get('/metrics', **extra)
+            request.user = user or AnonymousUser()
+            return metrics_view(request).status_code
+
+        self.assertEqual(status(), 403)
+        self.assertEqual(status(HTTP_AUTHORIZATION='Bearer wrong'), 403)
+        self.assertEqual(status(HTTP_AUTHORIZATION='Bearer s3cret'), 200)
+        self.assertEqual(status(REMOTE_ADDR='10.0.0.5'), 200)
+        self.assertEqual(status(User(is_active=True, is_staff=True)), 200)
+        self.assertEqual(status(User(is_active=True, is_staff=False)), 403)
+        self.assertEqual(status(User(is_active=False, is_staff=True)), 403)
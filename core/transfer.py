@@ -0,0 +1,293 @@
+# core/transfer.py
+import datetime
+import gzip
+import json
+import zlib
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+from .authentication import forget_snapshot
+from .cache import public_rooms_cache
+from .credentials import normalize_email
+from .facets import sync_room_facets
+from .membership import sync_room_memberships
+from .models import Channel, Room, UserProfile
+from .usernames import username_index
+
+# In export order. RoomMembership and RoomFacet are not exported: both are derived
+# from the rooms and rebuilt on import, as backfill_room_memberships would.
+EXPORT_TYPES = ('profiles', 'rooms', 'channels')
+RECORD_TYPES = {'profile': 'profiles', 'room': 'rooms', 'channel': 'channels'}
+
+# Profile record key -> lookup from UserProfile
+PROFILE_FIELDS = {
+    'uuid': 'uuid',
+    'username': 'user__username',
+    'email': 'user__email',
+    'first_name': 'user__first_name',
+    'last_name': 'user__last_name',
+    'is_active': 'user__is_active',
+    'date_joined': 'user__date_joined',
+}
+# Fields an existing user gets from an import with on_conflict='update'; username and email stay put
+PROFILE_UPDATE_FIELDS = ['first_name', 'last_name', 'is_active']
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds; keep them exact so imported cursors line up
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def record_fields(model):
+    # Channel's integer id is local to each database; channels are identified by uuid
+    return [field for field in model._meta.concrete_fields if not (model is Channel and field.primary_key)]
+
+
+def export_records(kind, include_passwords=False, chunk_size=2000):
+    if kind == 'profiles':
+        lookups = dict(PROFILE_FIELDS, **({'password': 'user__password'} if include_passwords else {}))
+        rows = UserProfile.objects.order_by('pk').values_list(*lookups.values())
+        for row in rows.iterator(chunk_size=chunk_size):
+            yield {'type': 'profile', **dict(zip(lookups, row))}
+        return
+
+    model = Room if kind == 'rooms' else Channel
+    names = [field.attname for field in record_fields(model)]
+    record_type = 'room' if kind == 'rooms' else 'channel'
+    for row in model.objects.order_by('pk').values_list(*names).iterator(chunk_size=chunk_size):
+        yield {'type': record_type, **dict(zip(names, row))}
+
+
+def export_chunks(types=EXPORT_TYPES, include_passwords=False, chunk_size=2000, counts=None):
+    """NDJSON for every row of the given types, as bytes, about chunk_size records at a time.
+
+    Rows are read with .iterator(chunk_size=...), so memory stays flat however
+    large the tables are. Pass a Counter as counts to learn how many records of
+    each type were written. Password hashes are only included when asked for.
+    """
+    encoder = ExportEncoder(separators=(',', ':'))
+    for kind in types:
+        lines = []
+        for record in export_records(kind, include_passwords, chunk_size):
+            lines.append(encoder.encode(record))
+            if len(lines) >= chunk_size:
+                yield ('\n'.join(lines) + '\n').encode()
+                lines = []
+            if counts is not None:
+                counts[kind] += 1
+        if lines:
+            yield ('\n'.join(lines) + '\n').encode()
+
+
+def gzip_chunks(chunks, level=6):
+    # A streaming gzip member: each chunk is compressed as it arrives instead of after the whole export
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def open_ndjson(fileobj, compressed=None):
+    # compressed=None sniffs the gzip magic number; needs a file with peek(), like open(..., 'rb') or stdin.buffer
+    if compressed is None:
+        compressed = fileobj.peek(2)[:2] == b'\x1f\x8b'
+    return gzip.GzipFile(fileobj=fileobj, mode='rb') if compressed else fileobj
+
+
+class Importer:
+    """Writes export records back with bulk_create, batch_size records per type at a time.
+
+    Every batch is its own transaction and costs a constant number of queries:
+    one lookup for the UUIDs that already exist, the INSERT, and for rooms the
+    membership and facet sync that bulk_create would otherwise skip. Existing
+    UUIDs are skipped, or with on_conflict='update' overwritten (for profiles,
+    everything except username and email). New profiles whose username or
+    email is already taken by another user are skipped and counted as
+    conflicts. Call finish() after the last record.
+    """
+
+    def __init__(self, batch_size=2000, on_conflict='skip'):
+        if on_conflict not in ('skip', 'update'):
+            raise ValueError("on_conflict must be 'skip' or 'update'")
+        self.batch_size = batch_size
+        self.on_conflict = on_conflict
+        self.counts = Counter()
+        self._pending = {kind: [] for kind in EXPORT_TYPES}
+
+    def add(self, record):
+        kind = RECORD_TYPES.get(record.get('type')) if isinstance(record, dict) else None
+        if kind is None:
+            raise ValueError(f"Unknown record type: {record.get('type') if isinstance(record, dict) else record!r}")
+        self._pending[kind].append(record)
+        if len(self._pending[kind]) >= self.batch_size:
+            self._flush(kind)
+
+    def add_lines(self, lines):
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                self.add(json.loads(line))
+            except ValueError as e:
+                raise ValueError(f'Line {number}: {e}') from e
+
+    def finish(self):
+        for kind in EXPORT_TYPES:
+            self._flush(kind)
+        # bulk_create and the raw UPDATEs skip the Room signals
+        if self.counts['rooms created'] or self.counts['rooms updated']:
+            public_rooms_cache.bump()
+        return self.counts
+
+    def _flush(self, kind):
+        batch, self._pending[kind] = self._pending[kind], []
+        if batch:
+            try:
+                with transaction.atomic():
+                    getattr(self, f'_import_{kind}')(batch)
+            except KeyError as e:
+                raise ValueError(f'A {kind} record is missing {e}') from e
+            except ValidationError as e:
+                raise ValueError(f'Invalid {kind} record: {"; ".join(e.messages)}') from e
+
+    def _build(self, model, records, key):
+        # Later records win over earlier ones with the same key
+        fields = record_fields(model)
+        instances = {}
+        for record in records:
+            instance = model(**{field.attname: field.to_python(record[field.attname])
+                                for field in fields if field.attname in record})
+            instances[getattr(instance, key)] = instance
+        return instances
+
+    def _create(self, model, instances, ignore_conflicts=False):
+        # bulk_create stamps auto_now/auto_now_add fields with the current time; put the exported ones back
+        stamped = [field.attname for field in model._meta.concrete_fields
+                   if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+        originals = [{name: getattr(instance, name) for name in stamped} for instance in instances]
+        model.objects.bulk_create(instances, batch_size=self.batch_size, ignore_conflicts=ignore_conflicts)
+        for instance, values in zip(instances, originals):
+            for name, value in values.items():
+                if value is not None:
+                    setattr(instance, name, value)
+        self._update(model, instances, stamped)
+
+    def _update(self, model, instances, names):
+        # One prepared UPDATE by primary key per row, like bulk_update but without a CASE WHEN
+        # per column, which makes bulk_update's cost grow with the square of the batch
+        if not instances or not names:
+            return
+        fields = [model._meta.get_field(name) for name in names]
+        pk = model._meta.pk
+        sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+            connection.ops.quote_name(model._meta.db_table),
+            ', '.join(f'{connection.ops.quote_name(field.column)} = %s' for field in fields),
+            connection.ops.quote_name(pk.column),
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [
+                [field.get_db_prep_save(getattr(instance, field.attname), connection) for field in fields + [pk]]
+                for instance in instances
+            ])
+
+    def _import_rooms(self, records):
+        rooms = self._build(Room, records, 'id')
+        existing = set(Room.objects.filter(id__in=list(rooms)).values_list('id', flat=True))
+        created = [room for room_id, room in rooms.items() if room_id not in existing]
+        updated = [room for room_id, room in rooms.items() if room_id in existing] if self.on_conflict == 'update' else []
+
+        self._create(Room, created, ignore_conflicts=True)  # A room inserted meanwhile by someone else is left alone
+        self._update(Room, updated, [field.attname for field in record_fields(Room) if not field.primary_key])
+        sync_room_memberships(created + updated, batch_size=self.batch_size)
+        sync_room_facets(created + updated, batch_size=self.batch_size)
+
+        self.counts['rooms created'] += len(created)
+        self.counts['rooms updated'] += len(updated)
+        self.counts['rooms skipped'] += len(rooms) - len(created) - len(updated)
+
+    def _import_channels(self, records):
+        channels = self._build(Channel, records, 'uuid')
+        existing = dict(Channel.objects.filter(uuid__in=list(channels)).values_list('uuid', 'id'))
+        created = [channel for key, channel in channels.items() if key not in existing]
+        updated = []
+        if self.on_conflict == 'update':
+            for key, channel in channels.items():
+                if key in existing:
+                    channel.id = existing[key]
+                    updated.append(channel)
+
+        self._create(Channel, created)
+        self._update(Channel, updated, [field.attname for field in record_fields(Channel) if field.attname != 'uuid'])
+
+        self.counts['channels created'] += len(created)
+        self.counts['channels updated'] += len(updated)
+        self.counts['channels skipped'] += len(channels) - len(created) - len(updated)
+
+    def _import_profiles(self, records):
+        uuid_field = UserProfile._meta.get_field('uuid')
+        records = {uuid_field.to_python(record['uuid']): record for record in records}
+        existing = dict(UserProfile.objects.filter(uuid__in=list(records)).values_list('uuid', 'user_id'))
+
+        new = {key: record for key, record in records.items() if key not in existing}
+        taken_usernames = set(User.objects.filter(
+            username__in=[record['username'] for record in new.values()]).values_list('username', flat=True))
+        taken_emails = set(UserProfile.objects.filter(
+            email_normalized__in=[normalize_email(record.get('email')) for record in new.values()]
+        ).values_list('email_normalized', flat=True))
+
+        users, profiles = [], []
+        for key, record in new.items():
+            email = normalize_email(record.get('email')) or None
+            if record['username'] in taken_usernames or (email and email in taken_emails):
+                self.counts['profiles conflicting'] += 1
+                continue
+            taken_usernames.add(record['username'])
+            if email:
+                taken_emails.add(email)
+            users.append(self._build_user(record))
+            profiles.append(UserProfile(uuid=key, email_normalized=email))
+
+        # Like generate_dataset: bulk_create skips post_save, so profiles are inserted here rather than by the signal
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        for user, profile in zip(users, profiles):
+            profile.user = user
+            username_index.add(user.username)
+        UserProfile.objects.bulk_create(profiles, batch_size=self.batch_size)
+        self.counts['profiles created'] += len(users)
+
+        if self.on_conflict != 'update' or not existing:
+            self.counts['profiles skipped'] += len(existing)
+            return
+        keys = {user_id: key for key, user_id in existing.items()}
+        updated = list(User.objects.filter(pk__in=list(keys)))
+        for user in updated:
+            record = records[keys[user.pk]]
+            for name in PROFILE_UPDATE_FIELDS:
+                if name in record:
+                    setattr(user, name, User._meta.get_field(name).to_python(record[name]))
+            if record.get('password'):
+                user.password = record['password']
+        self._update(User, updated, PROFILE_UPDATE_FIELDS + ['password'])
+        for user in updated:
+            # Deactivated users or new password hashes must stop authenticating from cached snapshots
+            forget_snapshot(user.pk)
+        self.counts['profiles updated'] += len(updated)
+
+    def _build_user(self, record):
+        user = User(**{name: User._meta.get_field(name).to_python(record[name])
+                       for name in ('username', 'email', 'first_name', 'last_name', 'is_active', 'date_joined')
+                       if name in record})
+        # Exports without password hashes give users an unusable password; they sign in after a reset
+        user.password = record.get('password') or make_password(None)
+        return user
@@ -1,7 +1,7 @@
 # core/urls
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import  UserViewSet, UserRegistrationView, UserLoginView, UserProfileView, api_root
+from .views import  RoomViewSet, ChannelViewSet, UserViewSet, UserRegistrationView, UserLoginView, UserProfileView, CheckUsernameView, DataExportView, DataImportView, api_root
 from rest_framework_simplejwt.views import (
     TokenObtainPairView,
     TokenRefreshView,
@@ -10,6 +10,8 @@ from rest_framework_simplejwt.views import (
 
 # Create a router for the API
 router = DefaultRouter() 
+router.register('rooms', RoomViewSet)
+router.register('channels', ChannelViewSet)
 router.register('users', UserViewSet)  # Register the User viewset
 
 # URL patterns
@@ -25,6 +27,11 @@ urlpatterns = [
     path('register/', UserRegistrationView.as_view(), name='register'),
     path('signin/', UserLoginView.as_view(), name='login'),
     path('profile/', UserProfileView.as_view(), name='profile'),
+    path('check-username/', CheckUsernameView.as_view(), name='check-username'),
+
+    # NDJSON export/import between environments (staff only)
+    path('export/', DataExportView.as_view(), name='data-export'),
+    path('import/', DataImportView.as_view(), name='data-import'),
     
     # Router URLs
     path('', include(router.urls)),
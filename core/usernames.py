@@ -0,0 +1,226 @@
+# core/usernames.py
+import hashlib
+import logging
+import math
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .cache import TTLCache
+from .models import UserProfile
+
+logger = logging.getLogger(__name__)
+
+# Bumped in the shared cache by every rename or deletion (core.signals), so each worker's
+# index knows to rebuild; inserts are picked up by the incremental refresh instead
+GENERATION_KEY = 'username_index:generation'
+
+
+def username_generation():
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Seed from the clock so a counter lost to eviction never reuses an old generation
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_username_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+class BloomFilter:
+    # Answers "definitely absent" without touching the sorted index; sized for the expected load at false_positive_rate
+    def __init__(self, capacity, false_positive_rate=0.01):
+        self.capacity = capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], 'little')
+        b = int.from_bytes(digest[8:], 'little') | 1
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class UsernameIndex:
+    """Process-local index of taken usernames for availability checks.
+
+    A Bloom filter rejects most free names at once, and a sorted list confirms
+    the rest and finds free variants for suggestions. Only a name the index
+    believes is taken costs a query: other workers may have deleted or renamed
+    that user since, and a stale entry is dropped when the DB disagrees.
+    Every refresh_interval seconds, users added by other workers are loaded
+    incrementally, and a changed username generation in the shared cache (a
+    rename or deletion anywhere) starts a rebuild in the background. Writes
+    that skip the signals are caught by the rebuild every rebuild_interval
+    seconds. Registration still enforces uniqueness.
+    """
+
+    max_length = User._meta.get_field('username').max_length
+
+    def __init__(self, refresh_interval=30, rebuild_interval=600, false_positive_rate=0.01):
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.false_positive_rate = false_positive_rate
+        self._lock = threading.Lock()
+        self._names = None
+        self._bloom = None
+        self._max_id = 0
+        self._generation = None
+        self._loaded_at = 0.0
+        self._built_at = 0.0
+        self._stale = False
+        self._rebuilding = False
+
+    def warm(self):
+        # Read before the rows, so a rename committed during the load still triggers the next rebuild
+        generation = username_generation()
+        rows = list(User.objects.order_by().values_list('id', 'username'))
+        names = sorted(username for _, username in rows)
+        bloom = BloomFilter(max(len(names) * 2, 1024), self.false_positive_rate)  # Headroom for growth before a rebuild
+        for name in names:
+            bloom.add(name)
+        with self._lock:
+            self._names, self._bloom = names, bloom
+            self._max_id = max((user_id for user_id, _ in rows), default=0)
+            self._generation = generation
+            self._loaded_at = self._built_at = time.monotonic()
+            self._stale = False
+
+    def _rebuild_in_background(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+
+        def run():
+            try:
+                self.warm()
+            except Exception:
+                logger.exception('Failed to rebuild the username index')
+            finally:
+                self._rebuilding = False
+                close_old_connections()
+
+        threading.Thread(target=run, name='username-index', daemon=True).start()
+
+    def _ensure_current(self):
+        if self._names is None:
+            self.warm()  # Once per process; later rebuilds keep answering from the current index
+            return
+        now = time.monotonic()
+        if self._stale or now - self._built_at >= self.rebuild_interval:
+            self._rebuild_in_background()
+        if now - self._loaded_at >= self.refresh_interval:
+            self._loaded_at = now
+            for user_id, username in User.objects.filter(id__gt=self._max_id).values_list('id', 'username'):
+                self.add(username)
+                self._max_id = max(self._max_id, user_id)
+            if username_generation() != self._generation:
+                self._rebuild_in_background()
+
+    def _contains(self, name):
+        if name not in self._bloom:
+            return False
+        i = bisect_left(self._names, name)
+        return i < len(self._names) and self._names[i] == name
+
+    def add(self, name):
+        if self._names is None:
+            return  # Not warmed yet; the first lookup loads everything
+        with self._lock:
+            if not self._contains(name):
+                insort(self._names, name)
+                self._bloom.add(name)
+            if len(self._names) > self._bloom.capacity:
+                # Past its capacity the filter's false-positive rate climbs; the next lookup rebuilds it in the background
+                self._stale = True
+
+    def discard(self, name):
+        # Bloom filters can't forget; the sorted list is the authority once the filter says "maybe"
+        if self._names is None:
+            return
+        with self._lock:
+            i = bisect_left(self._names, name)
+            if i < len(self._names) and self._names[i] == name:
+                del self._names[i]
+
+    def is_taken(self, name):
+        self._ensure_current()
+        if not self._contains(name):
+            return False
+        if User.objects.filter(username=name).exists():
+            return True
+        self.discard(name)
+        return False
+
+    def suggest(self, name, count=3, attempts=200):
+        """Free variants of name, checked against the index only."""
+        self._ensure_current()
+        suggestions = []
+        for n in range(1, attempts + 1):
+            suffix = str(n)
+            candidate = name[:self.max_length - len(suffix)] + suffix
+            if not self._contains(candidate):
+                suggestions.append(candidate)
+                if len(suggestions) == count:
+                    break
+        return suggestions
+
+    def check(self, name, count=3):
+        if not self.is_taken(name):
+            return True, []
+        return False, self.suggest(name, count)
+
+
+username_index = UsernameIndex(
+    refresh_interval=getattr(settings, 'USERNAME_INDEX_REFRESH_INTERVAL', 30),
+    rebuild_interval=getattr(settings, 'USERNAME_INDEX_REBUILD_INTERVAL', 600),
+    false_positive_rate=getattr(settings, 'USERNAME_INDEX_FALSE_POSITIVE_RATE', 0.01),
+)
+
+
+# profile uuid -> username, for clients resolving owner_uuid/members_uuids. Renames and
+# deletions are evicted here by core.signals; other workers catch up within the TTL.
+profile_usernames = TTLCache(
+    max_entries=getattr(settings, 'USERNAME_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'USERNAME_CACHE_TTL', 300),
+)
+
+
+def resolve_usernames(profile_uuids):
+    """Map profile UUIDs to usernames; unknown UUIDs are left out.
+
+    Cached entries are answered from profile_usernames, the rest with one IN
+    query joining UserProfile to User.
+    """
+    resolved, misses = {}, []
+    for profile_uuid in profile_uuids:
+        username = profile_usernames.get(profile_uuid)
+        if username is None:
+            misses.append(profile_uuid)
+        else:
+            resolved[profile_uuid] = username
+    if misses:
+        for profile_uuid, username in UserProfile.objects.filter(uuid__in=misses).values_list('uuid', 'user__username'):
+            profile_usernames.set(profile_uuid, username)
+            resolved[profile_uuid] = username
+    return resolved
@@ -1,22 +1,34 @@
 # core/views.py
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from rest_framework import viewsets, status
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate  # Import authenticate for login
 from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from rest_framework.decorators import action
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.authtoken.models import Token  # Import Token for login
 from .models import Room, Channel, UserProfile  # Import UserProfile
-from .serializers import RoomSerializer, ChannelSerializer, UserSerializer, UserProfileSerializer, UserRegistrationSerializer  # Import serializers
+from .serializers import RoomSerializer, ChannelSerializer, MessageSerializer, UserSerializer, UserProfileSerializer, UserRegistrationSerializer, MemberBatchSerializer  # Import serializers
+from .membership import rooms_for_member, apply_member_batch, MembershipConflict
+from .pagination import RoomCursorPagination, ChannelCursorPagination
+from .cache import public_rooms_cache
+from .search import search_rooms
+from .facets import facet_counts, facet_filters, facet_index, filter_by_facets
+from .messages import NotAChannelMember, is_channel_member, message_history, post_message
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
 from django.conf import settings
-import requests
-from rest_framework_simplejwt.tokens import RefreshToken
-from django.db import IntegrityError
+from .mailerlite_backend import get_pipeline, DeliveryQueueFull
+from .outbox import enqueue_email
+from .authentication import VersionedRefreshToken
+from .usernames import resolve_usernames, username_index
+from .transfer import EXPORT_TYPES, Importer, export_chunks, gzip_chunks, open_ndjson
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, transaction
+from django.core.exceptions import ValidationError
+import uuid
 # from jwt.exceptions import InvalidKeyError  # Ensure correct import
 
 
@@ -24,68 +36,222 @@ def home(request):
     return HttpResponse("Welcome to the Study Rooms API")
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+def member_batch_response(model, pk, data):
+    serializer = MemberBatchSerializer(data=data)
+    serializer.is_valid(raise_exception=True)
+    try:
+        # Malformed ids are "not found"; any other error inside the batch is a bug and must surface as one
+        instance = apply_member_batch(model, model._meta.pk.to_python(pk), **serializer.validated_data)
+    except (model.DoesNotExist, ValidationError):
+        return Response({'error': f'{model.__name__} not found'}, status=status.HTTP_404_NOT_FOUND)
+    except MembershipConflict:
+        return Response({'error': 'Membership changed concurrently, please retry'}, status=status.HTTP_409_CONFLICT)
+    return Response({'members_count': len(instance.members_uuids)}, status=status.HTTP_200_OK)
+
+
+def parse_uuid_list(request, param):
+    # ?ids=a,b,c or ?ids=a&ids=b, deduplicated in request order. Returns (uuids, error message).
+    values = [value.strip() for raw in request.query_params.getlist(param) for value in raw.split(',') if value.strip()]
+    if not values:
+        return None, f'{param} is required'
+    limit = getattr(settings, 'BATCH_LOOKUP_MAX_IDS', 200)
+    try:
+        uuids = list(dict.fromkeys(uuid.UUID(value) for value in values))
+    except ValueError:
+        return None, f'{param} must be comma-separated UUIDs'
+    if len(uuids) > limit:
+        return None, f'At most {limit} {param} per request'
+    return uuids, None
+
+
+def batch_response(serializer, keys, found, key):
+    # Results in the order asked for; ids that matched nothing are listed rather than erroring
+    by_key = {getattr(instance, key): instance for instance in found}
+    return Response({
+        'results': serializer([by_key[k] for k in keys if k in by_key], many=True).data,
+        'missing': [str(k) for k in keys if k not in by_key],
+    }, status=status.HTTP_200_OK)
+
+
+class SparseFieldsViewMixin:
+    # Many-object responses use the compact representation; see core.fieldsets.SparseFieldsMixin
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many'):
+            kwargs.setdefault('compact', True)
+        return super().get_serializer(*args, **kwargs)
+
+    def restrict_queryset(self, queryset):
+        # Skip the columns the requested fields don't show; the keyset cursor still needs its ordering field
+        ordering_field = getattr(self.pagination_class, 'ordering_field', None)
+        serializer = self.get_serializer(compact=True)
+        return serializer.restrict_queryset(queryset, always=[ordering_field] if ordering_field else [])
+
+
+class RoomViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     queryset = Room.objects.all()
     serializer_class = RoomSerializer
+    pagination_class = RoomCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # ?tag=math&topic=calculus&category=science: every given value must match
+            filters = facet_filters(self.request.query_params)
+            queryset = filter_by_facets(queryset, filters, facet_index.result_size(filters))
+            queryset = self.restrict_queryset(queryset)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        # Counts are for the whole filtered result, not just this page, private rooms included like the list itself;
+        # ?facets=1 asks for them without filtering
+        filters = facet_filters(request.query_params)
+        if filters or request.query_params.get('facets'):
+            response.data['facets'] = facet_counts(filters)
+        return response
 
     # Custom action to fetch all public rooms
     @action(detail=False, methods=['get'], url_path='public')
     def public_rooms(self, request):
-        public_rooms = Room.objects.filter(visibility='public')
-        serializer = self.get_serializer(public_rooms, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        # Serve pre-rendered pages until a Room save/delete bumps the cache generation
+        generation = public_rooms_cache.generation()
+        # Path and query only: keying on the Host header would let any client add entries by varying it
+        request_key = request.get_full_path()
+        body = public_rooms_cache.get(generation, request_key)
+        if body is None:
+            # From the primary: a replica read could cache pre-write rows under the generation the write just bumped
+            public_rooms = Room.objects.using(DEFAULT_DB_ALIAS).filter(visibility='public')
+            public_rooms = self.paginate_queryset(self.restrict_queryset(public_rooms))
+            serializer = self.get_serializer(public_rooms, many=True)
+            body = JSONRenderer().render(self.get_paginated_response(serializer.data).data)
+            public_rooms_cache.set(generation, request_key, body)
+        return HttpResponse(body, content_type='application/json', status=status.HTTP_200_OK)
 
     # Custom action to fetch rooms belonging to a specific user by user ID
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>[^/.]+)')
     def user_rooms(self, request, user_id=None):
         try:
-            user = User.objects.get(id=user_id)
-            rooms = Room.objects.filter(owner_uuid=user.userprofile.uuid) | Room.objects.filter(members_uuids__contains=[str(user.userprofile.uuid)])
+            # Resolve the profile UUID in one query, then hit the membership index instead of scanning members_uuids
+            member_uuid = UserProfile.objects.values_list('uuid', flat=True).get(user_id=user_id)
+            rooms = self.restrict_queryset(rooms_for_member(member_uuid))
             serializer = self.get_serializer(rooms, many=True)
             return Response(serializer.data, status=status.HTTP_200_OK)
-        except User.DoesNotExist:
+        except (UserProfile.DoesNotExist, ValueError):
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    # Apply many member additions/removals atomically: {"add": [uuid, ...], "remove": [uuid, ...]}
+    @action(detail=True, methods=['post'], url_path='members:batch')
+    def members_batch(self, request, pk=None):
+        return member_batch_response(Room, pk, request.data)
+
+    # Many rooms in one request and one query: ?ids=<uuid>,<uuid>,... (supports ?fields=/?omit=)
+    @action(detail=False, methods=['get'], url_path='batch')
+    def batch(self, request):
+        ids, error = parse_uuid_list(request, 'ids')
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        rooms = self.restrict_queryset(Room.objects.filter(id__in=ids))
+        return batch_response(self.get_serializer, ids, rooms, 'id')
+
+    # Full-text search over public rooms and the caller's own, best match first: ?q=<text>&limit=<n>
+    @action(detail=False, methods=['get'], url_path='search')
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(int(request.query_params.get('limit', 20)), 100)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        rooms = search_rooms(query, request.user.userprofile.uuid, limit)
+        serializer = self.get_serializer(rooms, many=True)
+        return Response({'results': serializer.data}, status=status.HTTP_200_OK)
+
 
-class ChannelViewSet(viewsets.ModelViewSet):
+class ChannelViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
     queryset = Channel.objects.all()
     serializer_class = ChannelSerializer
+    pagination_class = ChannelCursorPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = self.restrict_queryset(queryset)
+        return queryset
 
     # Custom action to fetch channels by room UUID
     @action(detail=False, methods=['get'], url_path='room/(?P<room_uuid>[^/.]+)')
     def room_channels(self, request, room_uuid=None):
         try:
-            channels = Channel.objects.filter(room_uuid=room_uuid)
+            channels = self.paginate_queryset(self.restrict_queryset(Channel.objects.filter(room_uuid=room_uuid)))
             serializer = self.get_serializer(channels, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
-        except Room.DoesNotExist:
+            return self.get_paginated_response(serializer.data)
+        except ValidationError:
             return Response({'error': 'Room not found'}, status=status.HTTP_404_NOT_FOUND)
 
+    @action(detail=True, methods=['post'], url_path='members:batch')
+    def members_batch(self, request, pk=None):
+        return member_batch_response(Channel, pk, request.data)
+
+    # Many channels by uuid (as listed in Room.channel_ids) in one query: ?uuids=<uuid>,<uuid>,...
+    @action(detail=False, methods=['get'], url_path='batch')
+    def batch(self, request):
+        uuids, error = parse_uuid_list(request, 'uuids')
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        channels = self.restrict_queryset(Channel.objects.filter(uuid__in=uuids))
+        return batch_response(self.get_serializer, uuids, channels, 'uuid')
+
+    # GET: a page of history, newest first by default, or ?before=<sequence> / ?after=<sequence>, with ?limit=
+    # POST: {"body": "..."} appends a message. Both are limited to the channel's owner and members.
+    @action(detail=False, methods=['get', 'post'], url_path='messages/(?P<channel_uuid>[^/.]+)')
+    def messages(self, request, channel_uuid=None):
+        profile_uuid = request.user.userprofile.uuid
+        if request.method == 'POST':
+            serializer = MessageSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            try:
+                message = post_message(channel_uuid, profile_uuid, serializer.validated_data['body'])
+            except (Channel.DoesNotExist, ValidationError):
+                return Response({'error': 'Channel not found'}, status=status.HTTP_404_NOT_FOUND)
+            except NotAChannelMember:
+                return Response({'error': 'You are not a member of this channel'}, status=status.HTTP_403_FORBIDDEN)
+            return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+
+        try:
+            before, after = (int(request.query_params[name]) if name in request.query_params else None
+                             for name in ('before', 'after'))
+            limit = min(int(request.query_params.get('limit', 50)), 200)
+        except ValueError:
+            return Response({'error': 'before, after and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be positive'}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            channel = Channel.objects.values('owner_uuid', 'members_uuids').filter(uuid=channel_uuid).first()
+        except ValidationError:
+            channel = None
+        if channel is None:
+            return Response({'error': 'Channel not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not is_channel_member(channel, profile_uuid):
+            return Response({'error': 'You are not a member of this channel'}, status=status.HTTP_403_FORBIDDEN)
+
+        messages, has_more = message_history(channel_uuid, before=before, after=after, limit=limit)
+        return Response({'results': MessageSerializer(messages, many=True).data, 'has_more': has_more})
+
  
 
 def send_mailerlite_email(subject, body, recipient_email):
-    url = "https://api.mailerlite.com/api/v2/campaigns/send"
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {settings.MAILERLITE_API_KEY}'
-    }
-    data = {
-        "subject": subject,
-        "content": body,
-        "recipients": [
-            {
-                "email": recipient_email
-            }
-        ]
-    }
-
-    response = requests.post(url, json=data, headers=headers)
-    
-    if response.status_code == 200:
+    # Hands the message to the background MailerLite pipeline; returns False if the queue is full
+    try:
+        get_pipeline().submit(subject, body, [recipient_email])
         return True
-    else:
-        print(f"Failed to send email: {response.text}")
+    except DeliveryQueueFull as e:
+        print(f"Failed to send email: {e}")
         return False
     
 class UserRegistrationView(APIView):
@@ -97,19 +263,14 @@ class UserRegistrationView(APIView):
         # Validate the request data
         if serializer.is_valid():
             try:
-                # Save the user
-                user = serializer.save()
-
-                # Prepare the email content
-                subject = "Welcome to Read Rocket!"
-                body = f"Hello {user.username},\n\nThank you for registering with us!"
-                recipient_email = user.email
-
-                # Optionally send confirmation email via MailerLite (commented for now)
-                # email_sent = send_mailerlite_email(subject, body, recipient_email)
-                # if not email_sent:
-                #     return Response({"message": "User created successfully but failed to send confirmation email."},
-                #                     status=status.HTTP_201_CREATED)
+                # Create the user and queue the welcome email atomically; drain_outbox delivers it later
+                with transaction.atomic():
+                    user = serializer.save()
+                    enqueue_email(
+                        subject="Welcome to Read Rocket!",
+                        body=f"Hello {user.username},\n\nThank you for registering with us!",
+                        recipient=user.email,
+                    )
 
                 # Ensure this response is returned upon successful user creation
                 return Response({"message": "User created successfully!","user":{"username": user.username, "email":user.email}}, status=status.HTTP_201_CREATED)
@@ -132,20 +293,15 @@ class UserLoginView(APIView):
         username_or_email = request.data.get("username_or_email")
         password = request.data.get("password")
 
-        if '@' in username_or_email:
-            try:
-                user_obj = User.objects.get(email=username_or_email)
-                username = user_obj.username
-            except User.DoesNotExist:
-                return Response({"error": "Invalid email"}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            username = username_or_email
+        if not username_or_email or not password:
+            return Response({"error": "Username or email and password are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        user = authenticate(username=username, password=password)
+        # UsernameOrEmailBackend resolves either form with one indexed query
+        user = authenticate(request, username=username_or_email, password=password)
         
         if user:
             try:
-                refresh = RefreshToken.for_user(user)
+                refresh = VersionedRefreshToken.for_user(user)
                 return Response({
                     'refresh': str(refresh),
                     'access': str(refresh.access_token),
@@ -162,19 +318,39 @@ class UserProfileView(APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request, *args, **kwargs):
-        profile = UserProfile.objects.get(user=request.user)
+        # CachedJWTAuthentication attaches the profile to request.user, so this needs no query
+        profile = request.user.userprofile
         serializer = UserProfileSerializer(profile)
         return Response(serializer.data, status=status.HTTP_200_OK)
 
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+class UserViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = User.objects.select_related('userprofile')
     serializer_class = UserSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = self.restrict_queryset(queryset)
+        return queryset
+
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def profile(self, request):
-        user_profile = UserProfile.objects.get(user=request.user)
+        user_profile = request.user.userprofile
         serializer = UserProfileSerializer(user_profile)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+    # Usernames for the profile UUIDs in owner_uuid/members_uuids: ?uuids=<uuid>,<uuid>,...
+    # At most one query, none when every UUID is in this worker's cache.
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def resolve(self, request):
+        uuids, error = parse_uuid_list(request, 'uuids')
+        if error:
+            return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+        usernames = resolve_usernames(uuids)
+        return Response({
+            'results': {str(profile_uuid): usernames[profile_uuid] for profile_uuid in uuids if profile_uuid in usernames},
+            'missing': [str(profile_uuid) for profile_uuid in uuids if profile_uuid not in usernames],
+        }, status=status.HTTP_200_OK)
     
 class CheckUsernameView(APIView):
     permission_classes = [AllowAny]  # Allow anyone to access this endpoint
@@ -185,13 +361,58 @@ class CheckUsernameView(APIView):
         if not username:
             return Response({"error": "Username is required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if User.objects.filter(username=username).exists():
-            return Response({"available": False, "message": "Username already taken"}, status=status.HTTP_200_OK)
+        # Answered from the in-memory index; only a name it believes is taken is confirmed against the database
+        available, suggestions = username_index.check(username)
+        if not available:
+            return Response({"available": False, "message": "Username already taken", "suggestions": suggestions}, status=status.HTTP_200_OK)
         else:
             return Response({"available": True, "message": "Username is available"}, status=status.HTTP_200_OK)
         
  
 
+class DataExportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    # ?types=rooms,channels (default: everything) and ?gzip=1; rows stream out as they are read
+    def get(self, request, *args, **kwargs):
+        types = [kind for kind in request.query_params.get('types', ','.join(EXPORT_TYPES)).split(',') if kind]
+        if not types or set(types) - set(EXPORT_TYPES):
+            return Response({'error': f'types must be a comma-separated subset of {", ".join(EXPORT_TYPES)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Password hashes never leave through the API; export_data --include-passwords can include them
+        chunks = export_chunks(types)
+        filename = 'kwf-export.ndjson'
+        if request.query_params.get('gzip'):
+            chunks, filename = gzip_chunks(chunks), filename + '.gz'
+        response = StreamingHttpResponse(chunks, content_type='application/gzip' if filename.endswith('.gz') else 'application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class DataImportView(APIView):
+    permission_classes = [IsAdminUser]
+
+    # The body is NDJSON from the export (gzip with Content-Encoding: gzip or Content-Type: application/gzip),
+    # read line by line rather than loaded whole. ?on_conflict=update overwrites existing UUIDs instead of skipping them.
+    def post(self, request, *args, **kwargs):
+        on_conflict = request.query_params.get('on_conflict', 'skip')
+        if on_conflict not in ('skip', 'update'):
+            return Response({'error': "on_conflict must be 'skip' or 'update'"}, status=status.HTTP_400_BAD_REQUEST)
+        if request.stream is None:
+            return Response({'error': 'Request body is empty'}, status=status.HTTP_400_BAD_REQUEST)
+
+        compressed = request.headers.get('Content-Encoding') == 'gzip' or request.content_type == 'application/gzip'
+        importer = Importer(on_conflict=on_conflict)
+        try:
+            importer.add_lines(open_ndjson(request.stream, compressed=compressed))
+            counts = importer.finish()
+        except (ValueError, OSError) as e:
+            # Earlier batches are committed; report them alongside the error
+            return Response({'error': str(e), 'imported': importer.counts}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'imported': counts}, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def api_root(request, format=None):
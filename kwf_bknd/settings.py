@@ -46,6 +46,7 @@ DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
 # Application definition
 INSTALLED_APPS = [
+    'daphne',  # Must come first so runserver serves the ASGI app, WebSockets included
     'grappelli',  # Must be listed before 'django.contrib.admin'
     'django.contrib.sites', 
     'django.contrib.admin',
@@ -55,6 +56,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework', 
+    'channels',
     'rest_framework.authtoken',
     'allauth',
     'allauth.account',
@@ -67,7 +69,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.metrics.MetricsMiddleware',  # First, so it times the whole stack
     'django.middleware.security.SecurityMiddleware',
+    'core.dbrouting.ReadReplicaMiddleware',  # Picks the database alias reads use for this request
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add this after SecurityMiddleware
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,6 +82,17 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Prometheus metrics served at /metrics. With several gunicorn workers, point
+# METRICS_DIR at a directory they share so the scrape aggregates all of them.
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1.0  # Seconds between each worker writing its totals to METRICS_DIR
+METRICS_STALE_AFTER = 60.0  # Seconds without a rewrite before a worker's file is taken as dead and deleted
+# /metrics is only served to a scraper sending "Authorization: Bearer <METRICS_TOKEN>", to clients
+# whose REMOTE_ADDR is listed below (behind a reverse proxy that is the proxy's address, so keep it
+# empty there) and to staff signed in to the admin.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = [ip for ip in os.getenv('METRICS_ALLOWED_IPS', '').split(',') if ip]
+
 
 GRAPPELLI_ADMIN_TITLE = "KWF BKND"
 GRAPPELLI_INDEX_DASHBOARD = 'rkt-bknd.dashboard.CustomIndexDashboard'  # Optional for custom dashboards
@@ -87,7 +102,7 @@ SITE_ID = 1
 
 # Authentication settings
 AUTHENTICATION_BACKENDS = (
-    'django.contrib.auth.backends.ModelBackend',
+    'core.backends.UsernameOrEmailBackend',  # ModelBackend that also accepts an email address as the username
     'allauth.account.auth_backends.AuthenticationBackend',
 )
 
@@ -97,7 +112,7 @@ REST_FRAMEWORK = {
     #     'rest_framework.renderers.BrowsableAPIRenderer',  # For browsable API
     # ),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',  # JWTAuthentication without a per-request user query
         'rest_framework.authentication.TokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -111,8 +126,46 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=59),  # Access token expiration time
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),  # Refresh token expiration time
     'AUTH_HEADER_TYPES': ('Bearer',),
+    'TOKEN_OBTAIN_SERIALIZER': 'core.serializers.VersionedTokenObtainPairSerializer',
+}
+
+JWT_USER_CACHE_SIZE = 10000  # Users whose snapshot each process keeps (core/authentication.py)
+JWT_USER_CACHE_TTL = 60  # Seconds; also the longest a revoked token survives in another worker
+
+# MailerLite delivery (core/mailerlite_backend.py). Mail is queued and sent by
+# background threads sharing one pooled HTTP session.
+MAILERLITE_API_KEY = os.getenv('MAILERLITE_API_KEY', '')
+MAILERLITE_API_URL = os.getenv('MAILERLITE_API_URL', 'https://connect.mailerlite.com/v2/campaigns/send')
+MAILERLITE_ASYNC = True  # False sends on the calling thread
+MAILERLITE_QUEUE_SIZE = 1000  # Messages waiting before senders get back-pressure
+MAILERLITE_ENQUEUE_TIMEOUT = 0.05  # Seconds a sender waits for queue space before DeliveryQueueFull
+MAILERLITE_WORKERS = 2
+MAILERLITE_BATCH_SIZE = 50  # Recipients per API call
+MAILERLITE_MAX_RETRIES = 4
+MAILERLITE_SHUTDOWN_TIMEOUT = 5  # Seconds spent draining the queue when the process exits
+
+# Fan-out stays inside one process. Every socket for a channel must reach the same
+# process (sticky routing by channel uuid), or swap in channels_redis to span workers.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'CONFIG': {
+            'capacity': 1000,  # Messages buffered per socket before new ones are dropped
+            'expiry': 60,
+        },
+    },
 }
 
+WEBSOCKET_MAX_MESSAGE_LENGTH = 4000  # Characters per message body (core/consumers.py)
+
+USERNAME_INDEX_REFRESH_INTERVAL = 30  # Seconds between picking up users registered, renamed or deleted through other workers (core/usernames.py)
+USERNAME_INDEX_REBUILD_INTERVAL = 600  # Seconds between full rebuilds, for renames made without the User signals (queryset update())
+USERNAME_INDEX_FALSE_POSITIVE_RATE = 0.01  # Bloom filter target; a false positive only costs a sorted-list lookup
+USERNAME_CACHE_SIZE = 10000  # Profile UUID -> username entries kept per process for /users/resolve/; 0 disables
+USERNAME_CACHE_TTL = 300  # Seconds before a rename made through another worker shows up
+
+BATCH_LOOKUP_MAX_IDS = 200  # Most ids one /rooms/batch/, /channels/batch/ or /users/resolve/ request may ask for
+
 ACCOUNT_EMAIL_VERIFICATION = "none"
 ACCOUNT_EMAIL_REQUIRED = True
 
@@ -136,6 +189,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'kwf_bknd.wsgi.application'
+ASGI_APPLICATION = 'kwf_bknd.asgi.application'  # HTTP plus the WebSocket routes in core/routing.py
 
 
 # Database
@@ -145,9 +199,54 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {'timeout': 20},  # Seconds a writer waits for the lock before "database is locked"
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', '60')),  # Keep connections between requests
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# GET/HEAD/OPTIONS requests read from this copy when DATABASE_REPLICA_NAME is set;
+# everything else, and every write, uses default (core/dbrouting.py). Locally,
+# `manage.py replicate_sqlite --loop` keeps the second file up to date.
+if os.getenv('DATABASE_REPLICA_NAME'):
+    DATABASES['replica'] = dict(
+        DATABASES['default'],
+        NAME=os.getenv('DATABASE_REPLICA_NAME'),
+        TEST={'MIRROR': 'default'},
+    )
+
+DATABASE_ROUTERS = ['core.dbrouting.PrimaryReplicaRouter']
+READ_DATABASE_ALIAS = 'replica'
+READ_YOUR_WRITES_SECONDS = 5  # How long a client, and the user signed in on it, read from the primary after a write
+
+# Run on every new SQLite connection (core/signals.py)
+SQLITE_PRAGMAS = ['journal_mode=WAL', 'synchronous=NORMAL']
+
+
+# Cache
+# The file cache is shared by every worker on the host; core/cache.py keeps a
+# small in-process LRU in front of it for the hottest responses.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', os.path.join(BASE_DIR, '.cache')),
     }
 }
 
+PUBLIC_ROOMS_CACHE_TIMEOUT = 300  # Seconds a rendered public rooms page is kept in the shared cache
+PUBLIC_ROOMS_CACHE_LOCAL_SIZE = 256  # Rendered pages kept in each worker's LRU
+
+ROOM_ACTIVITY_FLUSH_INTERVAL = 1.0  # Seconds between batched Room.last_active/latest_message writes; 0 writes through
+ROOM_ACTIVITY_MAX_PENDING = 500  # Rooms waiting before a flush is triggered early
+ROOM_ACTIVITY_CACHE_BUMP_INTERVAL = 30.0  # Most seconds public room pages show activity older than the database's
+
+SEARCH_MAX_RANKED_MATCHES = 20000  # Queries matching more rooms than this skip BM25 (core/search.py)
+SEARCH_RECENT_CANDIDATES = 5000  # Newest matches considered for those broad queries
+
+FACET_COUNTS_REFRESH_INTERVAL = 60  # Seconds between rebuilds of each worker's facet count bitmaps (core/facets.py)
+FACET_SEEK_THRESHOLD = 2000  # Filtered results smaller than this are read from the posting lists, not the last_active index
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
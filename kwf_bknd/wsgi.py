@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kwf_bknd.settings')
 
 application = get_wsgi_application()
+
+# Load the username index before the first availability check arrives
+from core.usernames import username_index  # noqa: E402
+username_index.warm()
+
+from core.facets import facet_index  # noqa: E402
+facet_index.current()  # Starts loading the facet count bitmaps in the background